@@ -122,6 +122,10 @@ _C.DATALOADER.REPEAT_THRESHOLD = 0.0
 # Tf True, when working on datasets that have instance annotations, the
 # training dataloader will filter out images without associated annotations
 _C.DATALOADER.FILTER_EMPTY_ANNOTATIONS = True
+# How dataset dicts are held in memory by the data loader. Options: "pickle" stores
+# each dict pickled; "columnar" stores boxes, classes and polygons of all dicts in
+# flat numpy arrays, which are cheaper to access and to share between workers.
+_C.DATALOADER.DATASET_STORAGE = "pickle"
 
 # ---------------------------------------------------------------------------- #
 # Backbone options
@@ -347,6 +351,23 @@ _C.MODEL.ROI_MASK_HEAD.CLS_AGNOSTIC_MASK = False
 # Type of pooling operation applied to the incoming feature map for each RoI
 _C.MODEL.ROI_MASK_HEAD.POOLER_TYPE = "ROIAlignV2"
 
+# Refinement of the masks at the uncertain points, with high-resolution features.
+_C.MODEL.ROI_MASK_HEAD.REFINE = CN()
+# Maximum number of boxes per image whose masks are refined, in training and in inference.
+# The masks of the other boxes are the coarse masks, upsampled. Set to -1 to refine all boxes.
+# In training, the first boxes of each image, i.e. a random sample of its foreground
+# proposals, are refined.
+_C.MODEL.ROI_MASK_HEAD.REFINE.BOXES_PER_IMAGE_TRAIN = 15
+_C.MODEL.ROI_MASK_HEAD.REFINE.BOXES_PER_IMAGE_TEST = 10
+# Which boxes of an image are refined in inference. Options:
+# "score": the boxes with the highest scores.
+# "area": the largest boxes.
+# "uncertainty": the boxes with the highest mean predicted uncertainty.
+_C.MODEL.ROI_MASK_HEAD.REFINE.ORDER = "score"
+# In inference, compute the semantic branch of the finest feature map only around the
+# refined boxes, instead of on the whole feature map. The results are the same.
+_C.MODEL.ROI_MASK_HEAD.REFINE.SEMANTIC_ON_ROIS = True
+
 
 # ---------------------------------------------------------------------------- #
 # Keypoint Head
@@ -586,6 +607,13 @@ _C.TEST.EXPECTED_RESULTS = []
 # The period (in terms of steps) to evaluate the model during training.
 # Set to 0 to disable.
 _C.TEST.EVAL_PERIOD = 0
+# The periodic evaluations during training use a fixed subset of EVAL_SUBSET.SIZE images of
+# each test set, stratified by the GROUP_KEY field of the images and by their classes.
+# The evaluation at the end of training uses the full test sets. 0 always uses them.
+_C.TEST.EVAL_SUBSET = CN()
+_C.TEST.EVAL_SUBSET.SIZE = 0
+_C.TEST.EVAL_SUBSET.GROUP_KEY = "subject"
+_C.TEST.EVAL_SUBSET.SEED = 0
 # The sigmas used to calculate keypoint OKS. See http://cocodataset.org/#keypoints-eval
 # When empty, it will use the defaults in COCO.
 # Otherwise it should be a list[float] with the same length as ROI_KEYPOINT_HEAD.NUM_KEYPOINTS.
@@ -593,6 +621,33 @@ _C.TEST.KEYPOINT_OKS_SIGMAS = []
 # Maximum number of detections to return per image during inference (100 is
 # based on the limit established for the COCO dataset).
 _C.TEST.DETECTIONS_PER_IMAGE = 100
+# Whether detectors paste the predicted masks into full-image masks. If False, the outputs
+# keep the masks as ROIMasks, which COCOEvaluator encodes into RLE without pasting them.
+_C.TEST.PASTE_MASKS = True
+# Whether detectors only compute the areas covered by the predicted masks, for the courseware
+# score. The masks are kept as ROIMasks, as if PASTE_MASKS were False, and the outputs have a
+# "mask_coverage" with the union area of the masks of each class, computed without pasting.
+_C.TEST.SCORE_ONLY = False
+# Whether each process of a distributed evaluation matches its own predictions to the ground
+# truth, so that only the per-image results are gathered to the main process.
+_C.TEST.SHARD_EVALUATION = False
+# Number of processes evaluating the COCO tasks and groups of categories in parallel.
+# 0 evaluates them in the main process.
+_C.TEST.EVAL_NUM_WORKERS = 0
+# Whether COCO evaluators stream the predictions to a columnar PredictionDump in the output
+# directory, instead of dumping them to a .pth and a json file at the end of the evaluation.
+_C.TEST.COLUMNAR_DUMP = False
+# The courseware score of an image is the score of the band its text area ratio falls in.
+# A band starts at its lower bound and ends at the next one, the last one at 1 inclusive.
+# Ratios outside the bands score 0.
+_C.TEST.SCORE_BANDS = CN()
+_C.TEST.SCORE_BANDS.LOWER_BOUNDS = [0.0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9]
+_C.TEST.SCORE_BANDS.SCORES = [3, 5, 7, 15, 12, 9, 7, 5, 3, 1]
+# BatchPredictor runs the model on batches of up to BATCH_SIZE images of similar aspect
+# ratios, while NUM_WORKERS threads read and resize the next images.
+_C.TEST.BATCH_PREDICTOR = CN()
+_C.TEST.BATCH_PREDICTOR.BATCH_SIZE = 8
+_C.TEST.BATCH_PREDICTOR.NUM_WORKERS = 4
 
 _C.TEST.AUG = CN({"ENABLED": False})
 _C.TEST.AUG.MIN_SIZES = (400, 500, 600, 700, 800, 900, 1000, 1100, 1200)
@@ -6,11 +6,19 @@ from .build import (
     build_detection_test_loader,
     build_detection_train_loader,
     get_detection_dataset_dicts,
+    get_eval_subset,
     load_proposals_into_dataset,
     print_instances_class_histogram,
+    stratified_subset,
 )
 from .catalog import DatasetCatalog, MetadataCatalog, Metadata
-from .common import DatasetFromList, MapDataset, ToIterableDataset
+from .common import (
+    ColumnarDatasetDicts,
+    DatasetFromList,
+    MapDataset,
+    SerializedList,
+    ToIterableDataset,
+)
 from .dataset_mapper import DatasetMapper
 
 # ensure the builtin datasets are registered
@@ -10,7 +10,7 @@ from fvcore.common.timer import Timer
 from detectron2.utils import comm
 
 from .build import build_batch_data_loader
-from .common import DatasetFromList, MapDataset
+from .common import ColumnarDatasetDicts, DatasetFromList, MapDataset, SerializedList
 from .samplers import TrainingSampler
 
 logger = logging.getLogger(__name__)
@@ -83,7 +83,7 @@ class DataLoaderBenchmark:
             max_time_seconds (int): maximum time to spent for each benchmark
             other args: same as in `build.py:build_detection_train_loader`
         """
-        if isinstance(dataset, list):
+        if isinstance(dataset, (list, SerializedList, ColumnarDatasetDicts)):
             dataset = DatasetFromList(dataset, copy=False, serialize=True)
         if sampler is None:
             sampler = TrainingSampler(len(dataset))
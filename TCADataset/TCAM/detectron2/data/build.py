@@ -1,9 +1,12 @@
 # Copyright (c) Facebook, Inc. and its affiliates.
 import itertools
+import json
 import logging
 import numpy as np
 import operator
+import os
 import pickle
+from collections import Counter, defaultdict
 import torch
 import torch.utils.data as torchdata
 from tabulate import tabulate
@@ -11,13 +14,21 @@ from termcolor import colored
 
 from detectron2.config import configurable
 from detectron2.structures import BoxMode
+from detectron2.utils import comm
 from detectron2.utils.comm import get_world_size
 from detectron2.utils.env import seed_all_rng
 from detectron2.utils.file_io import PathManager
 from detectron2.utils.logger import _log_api_usage, log_first_n
 
 from .catalog import DatasetCatalog, MetadataCatalog
-from .common import AspectRatioGroupedDataset, DatasetFromList, MapDataset, ToIterableDataset
+from .common import (
+    AspectRatioGroupedDataset,
+    ColumnarDatasetDicts,
+    DatasetFromList,
+    MapDataset,
+    SerializedList,
+    ToIterableDataset,
+)
 from .dataset_mapper import DatasetMapper
 from .detection_utils import check_metadata_consistency
 from .samplers import (
@@ -36,11 +47,20 @@ __all__ = [
     "build_detection_train_loader",
     "build_detection_test_loader",
     "get_detection_dataset_dicts",
+    "get_eval_subset",
     "load_proposals_into_dataset",
     "print_instances_class_histogram",
+    "stratified_subset",
 ]
 
 
+def _filter_dataset_dicts(dataset_dicts, predicate):
+    # keep a SerializedList serialized, so its memory stays shared
+    if isinstance(dataset_dicts, SerializedList):
+        return dataset_dicts.select([i for i, x in enumerate(dataset_dicts) if predicate(x)])
+    return [x for x in dataset_dicts if predicate(x)]
+
+
 def filter_images_with_only_crowd_annotations(dataset_dicts):
     """
     Filter out images with none annotations or only crowd annotations
@@ -61,7 +81,7 @@ def filter_images_with_only_crowd_annotations(dataset_dicts):
                 return True
         return False
 
-    dataset_dicts = [x for x in dataset_dicts if valid(x["annotations"])]
+    dataset_dicts = _filter_dataset_dicts(dataset_dicts, lambda x: valid(x["annotations"]))
     num_after = len(dataset_dicts)
     logger = logging.getLogger(__name__)
     logger.info(
@@ -93,9 +113,9 @@ def filter_images_with_few_keypoints(dataset_dicts, min_keypoints_per_image):
             if "keypoints" in ann
         )
 
-    dataset_dicts = [
-        x for x in dataset_dicts if visible_keypoints_in_image(x) >= min_keypoints_per_image
-    ]
+    dataset_dicts = _filter_dataset_dicts(
+        dataset_dicts, lambda x: visible_keypoints_in_image(x) >= min_keypoints_per_image
+    )
     num_after = len(dataset_dicts)
     logger = logging.getLogger(__name__)
     logger.info(
@@ -226,6 +246,8 @@ def get_detection_dataset_dicts(names, filter_empty=True, min_keypoints=0, propo
 
     Returns:
         list[dict]: a list of dicts following the standard dataset dict format.
+            If a single dataset is loaded as a :class:`SerializedList`, the result is
+            also a :class:`SerializedList`.
     """
     if isinstance(names, str):
         names = [names]
@@ -238,11 +260,15 @@ def get_detection_dataset_dicts(names, filter_empty=True, min_keypoints=0, propo
         assert len(names) == len(proposal_files)
         # load precomputed proposals from proposal files
         dataset_dicts = [
-            load_proposals_into_dataset(dataset_i_dicts, proposal_file)
+            load_proposals_into_dataset(list(dataset_i_dicts), proposal_file)
             for dataset_i_dicts, proposal_file in zip(dataset_dicts, proposal_files)
         ]
 
-    dataset_dicts = list(itertools.chain.from_iterable(dataset_dicts))
+    if len(dataset_dicts) == 1 and isinstance(dataset_dicts[0], SerializedList):
+        # e.g. a memory-mapped dataset from the dataset cache; avoid deserializing it
+        dataset_dicts = dataset_dicts[0]
+    else:
+        dataset_dicts = list(itertools.chain.from_iterable(dataset_dicts))
 
     has_instances = "annotations" in dataset_dicts[0]
     if filter_empty and has_instances:
@@ -313,6 +339,10 @@ def build_batch_data_loader(
         )
 
 
+# DATALOADER.DATASET_STORAGE -> the `serialize` argument of DatasetFromList
+_SERIALIZE = {"pickle": True, "columnar": "columnar"}
+
+
 def _train_loader_from_config(cfg, mapper=None, *, dataset=None, sampler=None):
     if dataset is None:
         dataset = get_detection_dataset_dicts(
@@ -351,12 +381,20 @@ def _train_loader_from_config(cfg, mapper=None, *, dataset=None, sampler=None):
         "total_batch_size": cfg.SOLVER.IMS_PER_BATCH,
         "aspect_ratio_grouping": cfg.DATALOADER.ASPECT_RATIO_GROUPING,
         "num_workers": cfg.DATALOADER.NUM_WORKERS,
+        "dataset_storage": cfg.DATALOADER.DATASET_STORAGE,
     }
 
 
 @configurable(from_config=_train_loader_from_config)
 def build_detection_train_loader(
-    dataset, *, mapper, sampler=None, total_batch_size, aspect_ratio_grouping=True, num_workers=0
+    dataset,
+    *,
+    mapper,
+    sampler=None,
+    total_batch_size,
+    aspect_ratio_grouping=True,
+    num_workers=0,
+    dataset_storage="pickle",
 ):
     """
     Build a dataloader for object detection with some default features.
@@ -380,6 +418,8 @@ def build_detection_train_loader(
             aspect ratio for efficiency. When enabled, it requires each
             element in dataset be a dict with keys "width" and "height".
         num_workers (int): number of parallel data loading workers
+        dataset_storage (str): how a list ``dataset`` is stored, one of "pickle" (pickled
+            dicts) or "columnar" (see :class:`ColumnarDatasetDicts`).
 
     Returns:
         torch.utils.data.DataLoader:
@@ -387,8 +427,8 @@ def build_detection_train_loader(
             ``total_batch_size / num_workers``, where ``mapped_element`` is produced
             by the ``mapper``.
     """
-    if isinstance(dataset, list):
-        dataset = DatasetFromList(dataset, copy=False)
+    if isinstance(dataset, (list, SerializedList, ColumnarDatasetDicts)):
+        dataset = DatasetFromList(dataset, copy=False, serialize=_SERIALIZE[dataset_storage])
     if mapper is not None:
         dataset = MapDataset(dataset, mapper)
 
@@ -407,10 +447,120 @@ def build_detection_train_loader(
     )
 
 
-def _test_loader_from_config(cfg, dataset_name, mapper=None):
+def stratified_subset(dataset_dicts, size, groups=None, seed=0):
+    """
+    Sample a deterministic subset of images, in which every stratum of images has the same
+    proportion as in the whole dataset. The stratum of an image is its group and the rarest
+    class among its annotations, where rarity is the number of images containing the class.
+
+    Args:
+        dataset_dicts (list[dict]): dataset dicts with "annotations".
+        size (int): number of images to sample.
+        groups (list or None): a hashable group of each image, e.g. its subject.
+        seed (int): seed of the sampling inside the strata.
+
+    Returns:
+        list[int]: the sorted indices of the sampled images.
+    """
+    num_images = len(dataset_dicts)
+    if size >= num_images:
+        return list(range(num_images))
+    if groups is None:
+        groups = [None] * num_images
+    assert len(groups) == num_images, f"Got {len(groups)} groups for {num_images} images!"
+
+    classes = [
+        {x["category_id"] for x in d.get("annotations", []) if not x.get("iscrowd", 0)}
+        for d in dataset_dicts
+    ]
+    frequency = Counter(itertools.chain.from_iterable(classes))
+    strata = defaultdict(list)
+    for idx, (group, image_classes) in enumerate(zip(groups, classes)):
+        rarest = min(image_classes, key=lambda c: (frequency[c], c)) if image_classes else -1
+        strata[(str(group), rarest)].append(idx)
+    keys = sorted(strata)
+
+    # proportional allocation, the remaining images going to the largest remainders
+    quotas = np.array([len(strata[k]) for k in keys], dtype=np.float64) * size / num_images
+    counts = np.floor(quotas).astype(np.int64)
+    remainders = np.argsort(-(quotas - counts), kind="stable")
+    counts[remainders[: size - counts.sum()]] += 1
+
+    rng = np.random.RandomState(seed)
+    indices = []
+    for key, count in zip(keys, counts.tolist()):
+        members = strata[key]
+        indices.extend(members[i] for i in rng.permutation(len(members))[:count])
+    return sorted(indices)
+
+
+def _image_groups(dataset_name, dataset_dicts, group_key):
+    """
+    Returns:
+        list or None: the value of ``group_key`` of each image, from the dataset dicts or
+            from the images of the dataset's json file. None if no image has it.
+    """
+    groups = [d.get(group_key) for d in dataset_dicts]
+    if all(x is None for x in groups):
+        json_file = MetadataCatalog.get(dataset_name).get("json_file")
+        if json_file is not None:
+            with PathManager.open(json_file) as f:
+                images = {x["id"]: x for x in json.load(f)["images"]}
+            groups = [images.get(d["image_id"], {}).get(group_key) for d in dataset_dicts]
+    return None if all(x is None for x in groups) else groups
+
+
+def get_eval_subset(dataset_name, size, cache_file=None, group_key="subject", seed=0):
+    """
+    Get the images of a :func:`stratified_subset` of a dataset, stratified by ``group_key``
+    of the images and by classes. The subset is cached so that it stays the same in
+    the evaluations of a training, and when resuming it.
+
+    Args:
+        dataset_name (str): a registered dataset.
+        size (int): number of images of the subset.
+        cache_file (str or None): a json file storing the image ids of the subset. It is
+            written if it does not exist or was made with other arguments.
+        group_key (str): a field of the images to stratify by, in the dataset dicts or in
+            the images of the dataset's COCO json file.
+        seed (int): seed of the sampling.
+
+    Returns:
+        list[int]: the ids of the images of the subset, the same in all processes.
+    """
+    logger = logging.getLogger(__name__)
+    key = {"dataset": dataset_name, "size": size, "group_key": group_key, "seed": seed}
+    image_ids = None
+    if comm.is_main_process():
+        if cache_file is not None and PathManager.exists(cache_file):
+            with PathManager.open(cache_file) as f:
+                cache = json.load(f)
+            if all(cache.get(k) == v for k, v in key.items()):
+                image_ids = cache["image_ids"]
+            else:
+                logger.warning(f"Overwriting {cache_file} made with other arguments: {cache}")
+        if image_ids is None:
+            dataset_dicts = DatasetCatalog.get(dataset_name)
+            groups = _image_groups(dataset_name, dataset_dicts, group_key)
+            if groups is None:
+                logger.warning(f"Images of {dataset_name} have no '{group_key}'.")
+            indices = stratified_subset(dataset_dicts, size, groups, seed)
+            image_ids = [dataset_dicts[i]["image_id"] for i in indices]
+            if cache_file is not None:
+                PathManager.mkdirs(os.path.dirname(cache_file))
+                with PathManager.open(cache_file, "w") as f:
+                    json.dump(dict(key, image_ids=image_ids), f)
+        logger.info(f"Using {len(image_ids)} images of {dataset_name} for evaluation.")
+    if comm.get_world_size() > 1:
+        image_ids = comm.all_gather(image_ids)[0]
+    return image_ids
+
+
+def _test_loader_from_config(cfg, dataset_name, mapper=None, image_ids=None):
     """
     Uses the given `dataset_name` argument (instead of the names in cfg), because the
     standard practice is to evaluate each test set individually (not combining them).
+    If `image_ids` is given, only these images are loaded.
     """
     if isinstance(dataset_name, str):
         dataset_name = [dataset_name]
@@ -424,13 +574,23 @@ def _test_loader_from_config(cfg, dataset_name, mapper=None):
         if cfg.MODEL.LOAD_PROPOSALS
         else None,
     )
+    if image_ids is not None:
+        image_ids = set(image_ids)
+        dataset = [d for d in dataset if d["image_id"] in image_ids]
     if mapper is None:
         mapper = DatasetMapper(cfg, False)
-    return {"dataset": dataset, "mapper": mapper, "num_workers": cfg.DATALOADER.NUM_WORKERS}
+    return {
+        "dataset": dataset,
+        "mapper": mapper,
+        "num_workers": cfg.DATALOADER.NUM_WORKERS,
+        "dataset_storage": cfg.DATALOADER.DATASET_STORAGE,
+    }
 
 
 @configurable(from_config=_test_loader_from_config)
-def build_detection_test_loader(dataset, *, mapper, sampler=None, num_workers=0):
+def build_detection_test_loader(
+    dataset, *, mapper, sampler=None, num_workers=0, dataset_storage="pickle"
+):
     """
     Similar to `build_detection_train_loader`, but uses a batch size of 1,
     and :class:`InferenceSampler`. This sampler coordinates all workers to
@@ -448,6 +608,7 @@ def build_detection_test_loader(dataset, *, mapper, sampler=None, num_workers=0)
             indices to be applied on ``dataset``. Default to :class:`InferenceSampler`,
             which splits the dataset across all workers.
         num_workers (int): number of parallel data loading workers
+        dataset_storage (str): see :func:`build_detection_train_loader`.
 
     Returns:
         DataLoader: a torch DataLoader, that loads the given detection
@@ -462,8 +623,8 @@ def build_detection_test_loader(dataset, *, mapper, sampler=None, num_workers=0)
         # or, instantiate with a CfgNode:
         data_loader = build_detection_test_loader(cfg, "my_test")
     """
-    if isinstance(dataset, list):
-        dataset = DatasetFromList(dataset, copy=False)
+    if isinstance(dataset, (list, SerializedList, ColumnarDatasetDicts)):
+        dataset = DatasetFromList(dataset, copy=False, serialize=_SERIALIZE[dataset_storage])
     if mapper is not None:
         dataset = MapDataset(dataset, mapper)
     if sampler is None:
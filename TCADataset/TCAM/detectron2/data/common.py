@@ -3,14 +3,24 @@ import copy
 import itertools
 import logging
 import numpy as np
+import os
 import pickle
 import random
+from typing import Union
 import torch.utils.data as data
 from torch.utils.data.sampler import Sampler
 
+from detectron2.structures import BoxMode
 from detectron2.utils.serialize import PicklableWrapper
 
-__all__ = ["MapDataset", "DatasetFromList", "AspectRatioGroupedDataset", "ToIterableDataset"]
+__all__ = [
+    "MapDataset",
+    "DatasetFromList",
+    "SerializedList",
+    "ColumnarDatasetDicts",
+    "AspectRatioGroupedDataset",
+    "ToIterableDataset",
+]
 
 
 def _shard_iterator_dataloader_worker(iterable):
@@ -106,25 +116,390 @@ class MapDataset(data.Dataset):
                 )
 
 
+class SerializedList:
+    """
+    A read-only list of picklable objects, stored as pickled bytes in one flat
+    ``np.uint8`` buffer. Every access unpickles a new object, so the result can be
+    modified in place without affecting the list.
+
+    The buffer can be saved to and memory-mapped from a directory with :meth:`save`
+    and :meth:`load`. A memory-mapped list is pickled by its path, so processes
+    (e.g. data loader workers and all ranks on a machine) share the same pages of the
+    file instead of each holding a private copy.
+    """
+
+    def __init__(self, lst=None, *, buffer=None, starts=None, ends=None, path=None):
+        """
+        Args:
+            lst (list): objects to serialize. Alternatively, the serialized form can
+                be given by ``buffer``, ``starts`` and ``ends``.
+            buffer (ndarray): uint8 buffer of concatenated pickled objects.
+            starts, ends (ndarray): int64 byte offsets of each object in ``buffer``.
+            path (str): the directory ``buffer`` is memory-mapped from, if any.
+        """
+        if lst is not None:
+            assert buffer is None, "Cannot specify both lst and buffer!"
+            lst = [pickle.dumps(x, protocol=-1) for x in lst]
+            ends = np.cumsum(np.asarray([len(x) for x in lst], dtype=np.int64))
+            starts = ends - np.asarray([len(x) for x in lst], dtype=np.int64)
+            buffer = np.frombuffer(b"".join(lst), dtype=np.uint8)
+        self._buffer = buffer
+        self._starts = np.asarray(starts, dtype=np.int64)
+        self._ends = np.asarray(ends, dtype=np.int64)
+        self._path = path
+
+    @staticmethod
+    def load(path):
+        """
+        Memory-map a list saved by :meth:`save`.
+
+        Args:
+            path (str): a local directory.
+
+        Returns:
+            SerializedList
+        """
+        buffer = np.load(os.path.join(path, "data.npy"), mmap_mode="r")
+        index = np.load(os.path.join(path, "index.npy"))
+        return SerializedList(buffer=buffer, starts=index[0], ends=index[1], path=path)
+
+    def save(self, path):
+        """
+        Save the serialized list into a new local directory.
+
+        Args:
+            path (str): the directory to create. It must not exist.
+        """
+        os.makedirs(path)
+        np.save(os.path.join(path, "data.npy"), self._buffer)
+        np.save(os.path.join(path, "index.npy"), np.stack([self._starts, self._ends]))
+
+    def select(self, indices):
+        """
+        Returns:
+            SerializedList: the elements at ``indices``. It shares the same buffer.
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        return SerializedList(
+            buffer=self._buffer,
+            starts=self._starts[indices],
+            ends=self._ends[indices],
+            path=self._path,
+        )
+
+    @property
+    def nbytes(self):
+        """
+        Number of bytes used by the serialized elements.
+        """
+        return int((self._ends - self._starts).sum())
+
+    def __len__(self):
+        return len(self._starts)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return self.select(np.arange(len(self))[idx])
+        start_addr = self._starts[idx].item()
+        end_addr = self._ends[idx].item()
+        return pickle.loads(memoryview(self._buffer[start_addr:end_addr]))
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self._path is not None:
+            # re-open the memory-mapped file instead of pickling its content
+            state["_buffer"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self._buffer is None:
+            self._buffer = np.load(os.path.join(self._path, "data.npy"), mmap_mode="r")
+
+
+def _is_int(x):
+    return isinstance(x, (int, np.integer)) and not isinstance(x, bool)
+
+
+def _is_polygons(x):
+    # list[list[float] or ndarray], i.e. polygons in Detectron2 Dataset format
+    return isinstance(x, list) and all(
+        isinstance(p, (list, tuple, np.ndarray)) and np.ndim(p) == 1 for p in x
+    )
+
+
+def _read_only(arr):
+    arr = np.ascontiguousarray(arr)
+    arr.setflags(write=False)
+    return arr
+
+
+class ColumnarDatasetDicts:
+    """
+    A read-only list of dataset dicts in Detectron2 Dataset format, stored in flat
+    numpy arrays instead of Python objects:
+
+    * "file_name" as one utf-8 byte buffer with offsets, and integer "image_id",
+      "height" and "width" as int64 arrays.
+    * the "bbox" of all annotations as an Mx4 float64 array, and integer
+      "category_id", "bbox_mode" and "iscrowd" as int64 arrays.
+    * polygons ("segmentation" and "bg_object_segmentation") as one float64
+      coordinate array, with offsets of each polygon and of each annotation's polygons.
+
+    Keys that are missing in some records or have other types are pickled per record.
+
+    Every access materializes a new dict, whose polygons are read-only views of the
+    arrays. The dicts and lists can be modified in place, but the polygon arrays must be
+    copied before being modified.
+
+    As the arrays contain no Python objects, reading them does not touch reference
+    counts, so data loader workers keep sharing the pages of the parent process.
+    The arrays can also be saved to and memory-mapped from a directory with
+    :meth:`save` and :meth:`load`.
+    """
+
+    _RECORD_INT_KEYS = ("image_id", "height", "width")
+    _ANNO_INT_KEYS = ("category_id", "bbox_mode", "iscrowd")
+    _POLYGON_KEYS = ("segmentation", "bg_object_segmentation")
+
+    def __init__(self, lst=None, *, columns=None, schema=None, path=None):
+        """
+        Args:
+            lst (iterable[dict]): dataset dicts to store. Alternatively, the stored form
+                can be given by ``columns`` and ``schema``.
+            columns (dict[str, ndarray]): arrays created by this class.
+            schema (dict): which keys are stored in ``columns``.
+            path (str): the directory ``columns`` are memory-mapped from, if any.
+        """
+        if lst is not None:
+            assert columns is None, "Cannot specify both lst and columns!"
+            columns, schema = self._to_columns(list(lst))
+        self._columns = columns
+        self._schema = schema
+        self._path = path
+        self._extras = None
+        if schema["extras"]:
+            self._extras = SerializedList(
+                buffer=columns["extras"],
+                starts=columns["extras_starts"],
+                ends=columns["extras_ends"],
+            )
+
+    @classmethod
+    def _to_columns(cls, lst):
+        annos = [a for r in lst for a in r.get("annotations", [])]
+        # a key is stored in arrays if it has the expected type in all records / annotations
+        schema = {
+            "record_str_keys": [
+                k for k in ["file_name"] if all(isinstance(r.get(k), str) for r in lst)
+            ],
+            "record_int_keys": [
+                k for k in cls._RECORD_INT_KEYS if all(_is_int(r.get(k)) for r in lst)
+            ],
+            "bbox": all(np.shape(a.get("bbox")) == (4,) for a in annos),
+            "anno_int_keys": [
+                k for k in cls._ANNO_INT_KEYS if all(_is_int(a.get(k)) for a in annos)
+            ],
+            # polygons may be missing, or in other formats (e.g. RLE), in some annotations
+            "polygon_keys": [
+                k for k in cls._POLYGON_KEYS if any(_is_polygons(a.get(k)) for a in annos)
+            ],
+        }
+
+        columns = {}
+        for k in schema["record_str_keys"]:
+            buf = [r[k].encode("utf-8") for r in lst]
+            columns[k] = np.frombuffer(b"".join(buf), dtype=np.uint8)
+            columns[k + "_offsets"] = np.cumsum([0] + [len(x) for x in buf], dtype=np.int64)
+        for k in schema["record_int_keys"]:
+            columns[k] = np.asarray([r[k] for r in lst], dtype=np.int64)
+        columns["has_annotations"] = np.asarray(["annotations" in r for r in lst], dtype=bool)
+        columns["anno_offsets"] = np.cumsum(
+            [0] + [len(r.get("annotations", [])) for r in lst], dtype=np.int64
+        )
+        if schema["bbox"]:
+            columns["bbox"] = np.asarray([a["bbox"] for a in annos], dtype=np.float64)
+            columns["bbox"] = columns["bbox"].reshape(-1, 4)
+        for k in schema["anno_int_keys"]:
+            columns[k] = np.asarray([a[k] for a in annos], dtype=np.int64)
+        for k in schema["polygon_keys"]:
+            present = [_is_polygons(a.get(k)) for a in annos]
+            polys = [p for a, v in zip(annos, present) if v for p in a[k]]
+            columns[k + "_present"] = np.asarray(present, dtype=bool)
+            columns[k + "_poly_offsets"] = np.cumsum(
+                [0] + [len(a[k]) if v else 0 for a, v in zip(annos, present)], dtype=np.int64
+            )
+            columns[k + "_coord_offsets"] = np.cumsum([0] + [len(p) for p in polys], dtype=np.int64)
+            columns[k] = (
+                np.concatenate([np.asarray(p, dtype=np.float64) for p in polys])
+                if len(polys)
+                else np.zeros((0,), dtype=np.float64)
+            )
+
+        # everything else is pickled, per record
+        stored_record_keys = set(schema["record_str_keys"] + schema["record_int_keys"])
+        stored_record_keys.add("annotations")
+        stored_anno_keys = set(schema["anno_int_keys"]) | ({"bbox"} if schema["bbox"] else set())
+        extras = []
+        for r in lst:
+            record_extra = {k: v for k, v in r.items() if k not in stored_record_keys}
+            anno_extras = [
+                {
+                    k: v
+                    for k, v in a.items()
+                    if k not in stored_anno_keys
+                    and not (k in schema["polygon_keys"] and _is_polygons(v))
+                }
+                for a in r.get("annotations", [])
+            ]
+            extras.append((record_extra, anno_extras))
+        schema["extras"] = any(e[0] or any(e[1]) for e in extras)
+        if schema["extras"]:
+            extras = SerializedList(extras)
+            columns["extras"] = extras._buffer
+            columns["extras_starts"] = extras._starts
+            columns["extras_ends"] = extras._ends
+
+        columns = {k: _read_only(v) for k, v in columns.items()}
+        return columns, schema
+
+    @staticmethod
+    def load(path):
+        """
+        Memory-map a list saved by :meth:`save`.
+
+        Args:
+            path (str): a local directory.
+
+        Returns:
+            ColumnarDatasetDicts
+        """
+        with open(os.path.join(path, "schema.pkl"), "rb") as f:
+            schema, names = pickle.load(f)
+        columns = {k: np.load(os.path.join(path, k + ".npy"), mmap_mode="r") for k in names}
+        return ColumnarDatasetDicts(columns=columns, schema=schema, path=path)
+
+    def save(self, path):
+        """
+        Save the arrays into a new local directory.
+
+        Args:
+            path (str): the directory to create. It must not exist.
+        """
+        os.makedirs(path)
+        for k, v in self._columns.items():
+            np.save(os.path.join(path, k + ".npy"), v)
+        with open(os.path.join(path, "schema.pkl"), "wb") as f:
+            pickle.dump((self._schema, list(self._columns.keys())), f)
+
+    @property
+    def nbytes(self):
+        """
+        Number of bytes used by all arrays.
+        """
+        return int(sum(v.nbytes for v in self._columns.values()))
+
+    def __len__(self):
+        return len(self._columns["anno_offsets"]) - 1
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("Index {} out of range for {} records".format(idx, len(self)))
+        c, schema = self._columns, self._schema
+
+        record = {}
+        for k in schema["record_str_keys"]:
+            start, end = c[k + "_offsets"][idx : idx + 2].tolist()
+            record[k] = c[k][start:end].tobytes().decode("utf-8")
+        for k in schema["record_int_keys"]:
+            record[k] = int(c[k][idx])
+
+        start, end = c["anno_offsets"][idx : idx + 2].tolist()
+        annos = [{} for _ in range(end - start)]
+        if schema["bbox"]:
+            # a list, as the "bbox" of a dataset dict is usually a list or tuple
+            for anno, bbox in zip(annos, c["bbox"][start:end].tolist()):
+                anno["bbox"] = bbox
+        for k in schema["anno_int_keys"]:
+            values = c[k][start:end].tolist()
+            if k == "bbox_mode":
+                values = [BoxMode(v) for v in values]
+            for anno, v in zip(annos, values):
+                anno[k] = v
+        for k in schema["polygon_keys"]:
+            present = c[k + "_present"][start:end].tolist()
+            poly_offsets = c[k + "_poly_offsets"][start : end + 1].tolist()
+            coord_offsets = c[k + "_coord_offsets"]
+            coords = c[k]
+            for i, anno in enumerate(annos):
+                if present[i]:
+                    offsets = coord_offsets[poly_offsets[i] : poly_offsets[i + 1] + 1].tolist()
+                    anno[k] = [coords[s:e] for s, e in zip(offsets[:-1], offsets[1:])]
+
+        if self._extras is not None:
+            record_extra, anno_extras = self._extras[idx]
+            record.update(record_extra)
+            for anno, extra in zip(annos, anno_extras):
+                anno.update(extra)
+        if c["has_annotations"][idx]:
+            record["annotations"] = annos
+        return record
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self._path is not None:
+            # re-open the memory-mapped files instead of pickling their content
+            state["_columns"] = None
+            state["_extras"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self._columns is None:
+            self.__dict__.update(ColumnarDatasetDicts.load(self._path).__dict__)
+
+
 class DatasetFromList(data.Dataset):
     """
     Wrap a list to a torch Dataset. It produces elements of the list as data.
     """
 
-    def __init__(self, lst: list, copy: bool = True, serialize: bool = True):
+    def __init__(self, lst: list, copy: bool = True, serialize: Union[bool, str] = True):
         """
         Args:
-            lst (list): a list which contains elements to produce.
+            lst (list, SerializedList or ColumnarDatasetDicts): a list which contains
+                elements to produce. A :class:`SerializedList` or
+                :class:`ColumnarDatasetDicts` is used as-is, since it is already
+                serialized and produces new objects on every access.
             copy (bool): whether to deepcopy the element when producing it,
                 so that the result can be modified in place without affecting the
                 source in the list.
-            serialize (bool): whether to hold memory using serialized objects, when
+            serialize (bool or str): whether to hold memory using serialized objects, when
                 enabled, data loader workers can use shared RAM from master
-                process instead of making a copy.
+                process instead of making a copy. Set to "columnar" to store dataset dicts
+                in a :class:`ColumnarDatasetDicts`, which is cheaper to access than
+                pickled objects.
         """
         self._lst = lst
         self._copy = copy
         self._serialize = serialize
+        if serialize == "columnar" and not isinstance(lst, ColumnarDatasetDicts):
+            logger = logging.getLogger(__name__)
+            logger.info("Storing {} dataset dicts in columnar arrays ...".format(len(lst)))
+            self._lst = ColumnarDatasetDicts(lst)
+            logger.info("Columnar dataset takes {:.2f} MiB".format(self._lst.nbytes / 1024 ** 2))
+        if isinstance(self._lst, (SerializedList, ColumnarDatasetDicts)):
+            self._copy = self._serialize = False
 
         def _serialize(data):
             buffer = pickle.dumps(data, protocol=-1)
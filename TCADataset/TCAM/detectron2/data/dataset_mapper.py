@@ -113,8 +113,11 @@ class DatasetMapper:
         return ret
 
     def _transform_annotations(self, dataset_dict, transforms, image_shape):
+        # Shallow copies are enough: the transforms below replace the values of
+        # the annotations instead of modifying them in place.
+        annos = [dict(obj) for obj in dataset_dict.pop("annotations") if obj.get("iscrowd", 0) == 0]
         # USER: Modify this if you want to keep them for some reason.
-        for anno in dataset_dict["annotations"]:
+        for anno in annos:
             if not self.use_instance_mask:
                 anno.pop("segmentation", None)
             if not self.use_keypoint:
@@ -125,8 +128,7 @@ class DatasetMapper:
             utils.transform_instance_annotations(
                 obj, transforms, image_shape, keypoint_hflip_indices=self.keypoint_hflip_indices
             )
-            for obj in dataset_dict.pop("annotations")
-            if obj.get("iscrowd", 0) == 0
+            for obj in annos
         ]
         instances = utils.annotations_to_instances(
             annos, image_shape, mask_format=self.instance_mask_format
@@ -149,7 +151,9 @@ class DatasetMapper:
         Returns:
             dict: a format that builtin models in detectron2 accept
         """
-        dataset_dict = copy.deepcopy(dataset_dict)  # it will be modified by code below
+        # it will be modified by code below. A shallow copy avoids the cost of deep-copying
+        # every polygon: annotations are copied in `_transform_annotations`.
+        dataset_dict = copy.copy(dataset_dict)
         # USER: Write your own image loading if it's not from a file
         image = utils.read_image(dataset_dict["file_name"], format=self.image_format)
         utils.check_image_size(dataset_dict, image)
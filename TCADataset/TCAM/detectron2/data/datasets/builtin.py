@@ -20,6 +20,7 @@ To add new dataset, refer to the tutorial "docs/DATASETS.md".
 import os
 
 from detectron2.data import DatasetCatalog, MetadataCatalog
+from detectron2.data.datasets.cache import load_dataset_dicts_with_cache
 from detectron2.data.datasets.coco import load_coco_json
 
 DatasetCatalog.clear()
@@ -46,15 +47,22 @@ PREDEFINED_SPLITS_DATASET = {
 }
 
 def register_all_TCA(root):
+    # The processed dataset dicts are cached on disk, see `load_dataset_dicts_with_cache`.
     # train
-    DatasetCatalog.register("TCA_train", lambda: load_coco_json(TRAIN_JSON, TRAIN_PATH))
+    DatasetCatalog.register(
+        "TCA_train",
+        lambda: load_dataset_dicts_with_cache("TCA_train", load_coco_json, TRAIN_JSON, TRAIN_PATH),
+    )
     MetadataCatalog.get("TCA_train").set(thing_classes=CLASS_NAMES,
                                           evaluator_type='coco',
                                           json_file=TRAIN_JSON,
                                           image_root=TRAIN_PATH)
 
 
-    DatasetCatalog.register("TCA_val", lambda: load_coco_json(VAL_JSON, VAL_PATH))
+    DatasetCatalog.register(
+        "TCA_val",
+        lambda: load_dataset_dicts_with_cache("TCA_val", load_coco_json, VAL_JSON, VAL_PATH),
+    )
     MetadataCatalog.get("TCA_val").set(thing_classes=CLASS_NAMES,
                                         evaluator_type='coco',
                                         json_file=VAL_JSON,
@@ -0,0 +1,121 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+from fvcore.common.timer import Timer
+from iopath.common.file_io import file_lock, get_cache_dir
+
+from detectron2.utils.file_io import PathManager
+
+from ..common import SerializedList
+
+"""
+This file implements an on-disk cache of processed dataset dicts.
+"""
+
+logger = logging.getLogger(__name__)
+
+__all__ = ["file_checksum", "get_dataset_cache_dir", "load_dataset_dicts_with_cache"]
+
+# Bump this when the dataset loaders change their outputs, to invalidate existing caches.
+DATASET_CACHE_VERSION = 1
+
+
+def get_dataset_cache_dir():
+    """
+    Returns:
+        str or None: the directory of the dataset cache, or None if caching is disabled.
+            It is ``$DETECTRON2_DATASET_CACHE`` if the environment variable is set
+            (set it to an empty string to disable caching), otherwise
+            "detectron2_datasets" under the iopath cache directory.
+    """
+    cache_dir = os.getenv("DETECTRON2_DATASET_CACHE")
+    if cache_dir is None:
+        return os.path.join(get_cache_dir(), "detectron2_datasets")
+    return cache_dir or None
+
+
+def file_checksum(path, chunk_size=1 << 20):
+    """
+    Returns:
+        str: the sha256 hex digest of the content of a file.
+    """
+    sha = hashlib.sha256()
+    with PathManager.open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def load_dataset_dicts_with_cache(
+    name, loader, json_file, *args, cache_dir=None, version=DATASET_CACHE_VERSION, **kwargs
+):
+    """
+    Call ``loader(json_file, *args, **kwargs)`` and cache its results on disk.
+
+    The cache is keyed by the checksum of ``json_file``, the name of the loader, ``version``
+    and the other arguments. The first call serializes the loaded dicts into the cache
+    directory; later calls, including those of other processes and other ranks, memory-map
+    the cached file instead of running the loader. Concurrent callers are synchronized by a
+    file lock, so the loader runs only once.
+
+    Side effects of ``loader`` (e.g. setting metadata) do not happen when the cache is hit,
+    so such metadata should be set when registering the dataset.
+
+    Args:
+        name (str): the name of the dataset, used to name the cache.
+        loader (callable): a function such as :func:`load_coco_json`, which returns
+            a list of dataset dicts.
+        json_file (str): the annotation file, passed as the first argument to ``loader``.
+        cache_dir (str or None): a local directory to store the cache in.
+            Defaults to :func:`get_dataset_cache_dir`. Caching is disabled if it is empty.
+        version: anything json-serializable that identifies the loader version.
+        args, kwargs: other arguments of ``loader``. They must have a deterministic ``repr``.
+
+    Returns:
+        SerializedList or list[dict]: the dataset dicts. They are a read-only,
+            memory-mapped :class:`SerializedList` unless caching is disabled.
+    """
+    if cache_dir is None:
+        cache_dir = get_dataset_cache_dir()
+    if not cache_dir:
+        return loader(json_file, *args, **kwargs)
+
+    key = {
+        "json_checksum": file_checksum(json_file),
+        "loader": "{}.{}".format(loader.__module__, loader.__qualname__),
+        "version": version,
+        "args": args,
+        "kwargs": kwargs,
+    }
+    key = hashlib.sha256(json.dumps(key, sort_keys=True, default=repr).encode()).hexdigest()
+    path = os.path.join(cache_dir, "{}-{}".format(name, key[:16]))
+
+    PathManager.mkdirs(cache_dir)
+    with file_lock(path):
+        if not os.path.isdir(path):
+            timer = Timer()
+            dataset_dicts = SerializedList(loader(json_file, *args, **kwargs))
+            # write to a temporary directory first so that a cache is never partially written
+            tmp_dir = tempfile.mkdtemp(dir=cache_dir)
+            try:
+                dataset_dicts.save(os.path.join(tmp_dir, "cache"))
+                os.replace(os.path.join(tmp_dir, "cache"), path)
+            finally:
+                shutil.rmtree(tmp_dir)
+            logger.info(
+                "Cached {} dataset dicts of '{}' ({:.2f} MiB) to {} in {:.2f} seconds.".format(
+                    len(dataset_dicts),
+                    name,
+                    dataset_dicts.nbytes / 1024 ** 2,
+                    path,
+                    timer.seconds(),
+                )
+            )
+
+    dataset_dicts = SerializedList.load(path)
+    logger.info("Loaded {} dataset dicts of '{}' from {}".format(len(dataset_dicts), name, path))
+    return dataset_dicts
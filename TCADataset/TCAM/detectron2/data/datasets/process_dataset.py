@@ -2,10 +2,12 @@
 import io
 import logging
 import contextlib
+import multiprocessing as mp
 import os
 import datetime
 import json
 import numpy as np
+import pycocotools.mask as mask_util
 import cv2
 from PIL import Image
 from skimage import measure
@@ -13,6 +15,8 @@ from skimage import measure
 from fvcore.common.timer import Timer
 from detectron2.structures import BoxMode, PolygonMasks, Boxes, polygons_to_bitmask
 from fvcore.common.file_io import PathManager, file_lock
+from detectron2.utils.comm import get_world_size
+from detectron2.utils.logger import log_every_n_seconds
 
 
 from .. import MetadataCatalog, DatasetCatalog
@@ -24,7 +28,7 @@ This file contains functions to parse COCO-format annotations into dicts in "Det
 
 logger = logging.getLogger(__name__)
 
-__all__ = ["load_coco_json", "load_sem_seg"]
+__all__ = ["load_coco_json", "load_sem_seg", "build_bg_object_segmentation"]
 
 CLASS_NAMES = [
     "airplane", "bicycle", "bird", "boat", "bottle", "bus", "car", "cat",
@@ -51,7 +55,205 @@ def bb_intersection_over_union(boxA, boxB):
     # return the intersection over union value
     return iou
 
-def load_coco_json(json_file, image_root, dataset_name=None, extra_annotation_keys=None):
+
+def pairwise_bb_intersection_over_union(boxes):
+    """
+    Vectorized :func:`bb_intersection_over_union` between all pairs of boxes.
+
+    Args:
+        boxes (ndarray): Nx4 boxes in XYXY_ABS format.
+
+    Returns:
+        ndarray: NxN float64 matrix of IoU values.
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    lt = np.maximum(boxes[:, None, :2], boxes[None, :, :2])
+    rb = np.minimum(boxes[:, None, 2:], boxes[None, :, 2:])
+    wh = np.maximum(rb - lt + 1, 0)
+    inter = wh[..., 0] * wh[..., 1]
+    area = (boxes[:, 2] - boxes[:, 0] + 1) * (boxes[:, 3] - boxes[:, 1] + 1)
+    return inter / (area[:, None] + area[None, :] - inter)
+
+
+def _subsample_contour(contour):
+    # contours are (row, col); flip to (x, y) and keep fewer points on long contours
+    if contour.shape[0] > 500:
+        return np.flip(contour, axis=1)[::10, :]
+    elif contour.shape[0] > 200:
+        return np.flip(contour, axis=1)[::5, :]
+    elif contour.shape[0] > 100:
+        return np.flip(contour, axis=1)[::3, :]
+    elif contour.shape[0] > 50:
+        return np.flip(contour, axis=1)[::2, :]
+    return np.flip(contour, axis=1)
+
+
+def _bg_object_segmentation_single_image(height, width, bboxes, segms):
+    """
+    Compute "bg_object_segmentation" for all instances of one image.
+
+    For every instance, the masks of the other instances whose boxes overlap its box
+    (IoU > 0.05) are cropped to its box and merged, and the contours of the merged mask
+    are returned. All work is restricted to the box of the instance: other instances are
+    only rasterized if they take part in an overlapping pair, and only up to the
+    bottom-right corner of the furthest box that needs them.
+
+    Args:
+        height, width (int): image size.
+        bboxes (list): per-instance boxes in XYWH_ABS format.
+        segms (list): per-instance polygons, or None for instances without segmentation.
+
+    Returns:
+        list[list[list[float]]]: the "bg_object_segmentation" of every instance.
+        tuple: (number of instances with any intersection, sum of intersect rates,
+            number of instances with a "bg_object_segmentation")
+    """
+    num = len(bboxes)
+    results = [[] for _ in range(num)]
+    if num < 2:
+        return results, (0, 0.0, 0)
+
+    boxes = np.array([[b[0], b[1], b[0] + b[2], b[1] + b[3]] for b in bboxes], dtype=np.float64)
+    overlaps = pairwise_bb_intersection_over_union(boxes) > 0.05
+    np.fill_diagonal(overlaps, False)
+
+    # index ranges of each box, with the same semantics as slicing a full-image array
+    crops = [
+        (range(height)[int(y0) : int(y1)], range(width)[int(x0) : int(x1)])
+        for x0, y0, x1, y1 in boxes.tolist()
+    ]
+    active = [
+        i for i in range(num) if overlaps[i].any() and len(crops[i][0]) and len(crops[i][1])
+    ]
+
+    # rasterize each needed instance once, clipped at the furthest bottom-right corner.
+    # Clipping the bottom/right border gives the same pixels as a full-image rasterization.
+    extent = np.zeros((num, 2), dtype=np.int64)
+    for i in active:
+        rows, cols = crops[i]
+        for j in [i] + overlaps[i].nonzero()[0].tolist():
+            extent[j] = np.maximum(extent[j], (rows.stop, cols.stop))
+    masks = {}
+    for j in extent.any(axis=1).nonzero()[0].tolist():
+        if segms[j]:
+            masks[j] = polygons_to_bitmask(segms[j], int(extent[j, 0]), int(extent[j, 1]))
+
+    intersect_num, intersect_rate, num_bg = 0, 0.0, 0
+    for i in active:
+        rows, cols = crops[i]
+        # pad by one pixel (inside the image) so contours close as they do on the full image
+        y0, x0 = max(rows.start - 1, 0), max(cols.start - 1, 0)
+        y1, x1 = min(rows.stop + 1, height), min(cols.stop + 1, width)
+        union = np.zeros((y1 - y0, x1 - x0), dtype=bool)
+        inner = union[rows.start - y0 : rows.stop - y0, cols.start - x0 : cols.stop - x0]
+        for j in overlaps[i].nonzero()[0].tolist():
+            if j in masks:
+                inner |= masks[j][rows.start : rows.stop, cols.start : cols.stop]
+
+        if i in masks:
+            intersect = np.count_nonzero(
+                inner & masks[i][rows.start : rows.stop, cols.start : cols.stop]
+            )
+            if intersect >= 1:
+                intersect_num += 1
+                rle = mask_util.merge(mask_util.frPyObjects(segms[i], height, width))
+                area = mask_util.area(rle)
+                if area > 1:
+                    intersect_rate += intersect / float(area)
+
+        if np.count_nonzero(inner) > 20:
+            num_bg += 1
+            for contour in measure.find_contours(union.astype(int), 0):
+                contour = _subsample_contour(contour + (y0, x0))
+                results[i].append(contour.ravel().tolist())
+    return results, (intersect_num, intersect_rate, num_bg)
+
+
+def _bg_object_segmentation_worker(record):
+    annos = record["annotations"]
+    return _bg_object_segmentation_single_image(
+        int(record["height"]),
+        int(record["width"]),
+        [anno["bbox"] for anno in annos],
+        [anno.get("segmentation", None) for anno in annos],
+    )
+
+
+def build_bg_object_segmentation(dataset_dicts, num_workers=None):
+    """
+    Add the "bg_object_segmentation" field to every annotation of the dataset dicts in place.
+    It contains the polygons of the other instances that overlap the box of the annotation.
+
+    Images are sharded across a process pool, so the whole dataset can be processed
+    without a cap on the number of images.
+
+    Args:
+        dataset_dicts (list[dict]): dataset dicts whose annotations have an XYWH_ABS
+            "bbox" and a polygon "segmentation", as produced by :func:`load_coco_json`.
+        num_workers (int or None): number of processes to use. 0 or 1 runs in the current
+            process. Defaults to half of the CPUs of each process of the world, at least 1.
+
+    Returns:
+        list[dict]: the same dataset dicts.
+    """
+    if num_workers is None:
+        num_workers = max(mp.cpu_count() // get_world_size() // 2, 1)
+
+    timer = Timer()
+    num_instances = sum(len(record["annotations"]) for record in dataset_dicts)
+    if num_workers > 1 and len(dataset_dicts) > 1:
+        pool = mp.Pool(processes=num_workers)
+        chunksize = max(len(dataset_dicts) // (num_workers * 16), 1)
+        results = pool.imap(_bg_object_segmentation_worker, dataset_dicts, chunksize=chunksize)
+    else:
+        pool = None
+        results = map(_bg_object_segmentation_worker, dataset_dicts)
+
+    intersect_num, intersect_rate, num_bg = 0, 0.0, 0
+    try:
+        for idx, (record, (segms, stats)) in enumerate(zip(dataset_dicts, results)):
+            for anno, segm in zip(record["annotations"], segms):
+                anno["bg_object_segmentation"] = segm
+            intersect_num += stats[0]
+            intersect_rate += stats[1]
+            num_bg += stats[2]
+            log_every_n_seconds(
+                logging.INFO,
+                "Computed occlusion annotations for {}/{} images, {:.1f} images/s".format(
+                    idx + 1, len(dataset_dicts), (idx + 1) / max(timer.seconds(), 1e-6)
+                ),
+                n=30,
+                name=__name__,
+            )
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    seconds = timer.seconds()
+    logger.info(
+        "Computed occlusion annotations of {} images ({} instances) in {:.2f}s "
+        "with {} workers: {:.1f} images/s.".format(
+            len(dataset_dicts),
+            num_instances,
+            seconds,
+            num_workers,
+            len(dataset_dicts) / max(seconds, 1e-6),
+        )
+    )
+    logger.info(
+        "{} instances have occluding objects; avg intersect rate: {:.4f}, "
+        "avg intersect rate over intersected instances: {:.4f}.".format(
+            num_bg,
+            intersect_rate / max(num_instances, 1),
+            intersect_rate / max(intersect_num, 1),
+        )
+    )
+    return dataset_dicts
+
+def load_coco_json(
+    json_file, image_root, dataset_name=None, extra_annotation_keys=None, num_workers=None
+):
     """
     Load a json file with COCO's instances annotation format.
     Currently supports instance detection, instance segmentation,
@@ -67,6 +269,8 @@ def load_coco_json(json_file, image_root, dataset_name=None, extra_annotation_ke
             loaded into the dataset dict (besides "iscrowd", "bbox", "keypoints",
             "category_id", "segmentation"). The values for these keys will be returned as-is.
             For example, the densepose annotations are loaded in this way.
+        num_workers (int or None): number of processes used to compute the
+            "bg_object_segmentation" field. See :func:`build_bg_object_segmentation`.
 
     Returns:
         list[dict]: a list of dicts in Detectron2 standard dataset dicts format. (See
@@ -88,7 +292,6 @@ def load_coco_json(json_file, image_root, dataset_name=None, extra_annotation_ke
     id_map = None
     if dataset_name is not None:
         meta = MetadataCatalog.get(dataset_name)
-        print('meta:', meta)
         cat_ids = sorted(coco_api.getCatIds())
         cats = coco_api.loadCats(cat_ids)
         # The categories in a custom json file may not be sorted.
@@ -158,21 +361,14 @@ Category ids in annotations are not in [1, #categories]! We'll apply a mapping f
 
     ann_keys = ["iscrowd", "bbox", "keypoints", "category_id"] + (extra_annotation_keys or [])
 
-    sum_box = 0
-    sum_co_box = 0
-    intersect_rate = 0.0
-    intersect_num = 0
-
     num_instances_without_valid_segmentation = 0
-    index_c = 0
 
-    for jdex, (img_dict, anno_dict_list) in enumerate(imgs_anns):
+    for img_dict, anno_dict_list in imgs_anns:
         record = {}
         record["file_name"] = os.path.join(image_root, img_dict["file_name"])
         record["height"] = img_dict["height"]
         record["width"] = img_dict["width"]
         image_id = record["image_id"] = img_dict["id"]
-        print('file name:', jdex, ':', record["file_name"])
         objs = []
         for anno in anno_dict_list:
             # Check that the image_id in this annotation is the same as
@@ -214,99 +410,9 @@ Category ids in annotations are not in [1, #categories]! We'll apply a mapping f
                 obj["category_id"] = id_map[obj["category_id"]]
             objs.append(obj)
         record["annotations"] = objs
-        seg_list = []
-        for obj in objs:
-            seg_list.append(obj['segmentation'])
-        #print('seg list:', seg_list)
-
-        dirname = "mask-vis"
-        os.makedirs(dirname, exist_ok=True)
-
-        bitmask_list = []
-        if len(seg_list) > 0:
-            for index, seg in enumerate(seg_list):
-                #print('seg len:', len(seg))
-                invalid = False
-                for sub_seg in seg:
-                    #print('seg len:', len(sub_seg))
-                    if len(sub_seg) < 6:
-                        invalid = True
-                if not invalid:
-                    bitmask = polygons_to_bitmask(seg, img_dict["height"], img_dict["width"])
-                else:
-                    bitmask = np.zeros((int(img_dict["height"]), int(img_dict["width"])), dtype=bool)
-
-                bitmask_list.append(bitmask.astype('int'))
-
-
-        box_list = []
-        for obj in objs:
-            box_list.append([obj['bbox'][0],obj['bbox'][1],obj['bbox'][0]+obj['bbox'][2],obj['bbox'][1]+obj['bbox'][3]])
-
-        box_mask_list = []
-        for index, obj in enumerate(objs):
-            box_mask = np.zeros((int(img_dict["height"]), int(img_dict["width"])), dtype=int)
-            box_mask[int(box_list[index][1]):int(box_list[index][3]),int(box_list[index][0]):int(box_list[index][2])] = 1
-            box_mask_list.append(box_mask)
-
-
-        sum_box += len(box_list)
-
-        for index1, a_box in enumerate(box_list):
-            union_mask_whole = np.zeros((int(img_dict["height"]), int(img_dict["width"])), dtype=int)
-            for index2, b_box in enumerate(box_list):
-                if index1 != index2:
-                    iou = bb_intersection_over_union(a_box, b_box)
-                    if iou > 0.05:
-                        union_mask = np.multiply(box_mask_list[index1], bitmask_list[index2])
-                        union_mask_whole += union_mask
-            
-            print("===========================================")
-            print('bit mask area:', bitmask_list[index1].sum())
-            union_mask_whole[union_mask_whole > 1.0] = 1.0
-            print('cropped union mask area:', union_mask_whole.sum())
-            intersect_mask = union_mask_whole * bitmask_list[index1]
-            print('intersect mask area:', intersect_mask.sum()) 
-            print('intersect rate:', intersect_mask.sum()/float(bitmask_list[index1].sum()))
-            print("===========================================")
-            
-            if intersect_mask.sum() >= 1.0:
-                intersect_num += 1
-
-            if float(bitmask_list[index1].sum()) > 1.0:
-                intersect_rate += intersect_mask.sum()/float(bitmask_list[index1].sum())
-            
-            union_mask_non_zero_num = np.count_nonzero(union_mask_whole.astype(int))
-            record["annotations"][index1]['bg_object_segmentation'] = []
-            if union_mask_non_zero_num > 20:
-                sum_co_box += 1
-                contours = measure.find_contours(union_mask_whole.astype(int), 0)
-                for contour in contours:
-                    if contour.shape[0] > 500: 
-                        contour = np.flip(contour, axis=1)[::10,:]
-                    elif contour.shape[0] > 200: 
-                        contour = np.flip(contour, axis=1)[::5,:]
-                    elif contour.shape[0] > 100: 
-                        contour = np.flip(contour, axis=1)[::3,:]
-                    elif contour.shape[0] > 50: 
-                        contour = np.flip(contour, axis=1)[::2,:]
-                    else:
-                        contour = np.flip(contour, axis=1)
-
-                    segmentation = contour.ravel().tolist()
-                    record["annotations"][index1]['bg_object_segmentation'].append(segmentation)
-
         dataset_dicts.append(record)
-        if jdex > 10000:
-            break
-
-    print('sum intersect rate:', intersect_rate)
-    print('sum box:', sum_box)
 
-    avg_intersect_rate = intersect_rate/float(sum_box)
-    avg_intersect_rate_over_inter = intersect_rate/float(intersect_num)
-    print('avg rate:', avg_intersect_rate)
-    print('avg rate over intersect:', avg_intersect_rate_over_inter)
+    build_bg_object_segmentation(dataset_dicts, num_workers=num_workers)
 
     if num_instances_without_valid_segmentation > 0:
         logger.warning(
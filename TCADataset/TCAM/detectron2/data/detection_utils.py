@@ -13,14 +13,13 @@ import torch
 from PIL import Image
 
 from detectron2.structures import (
-    BitMasks,
     Boxes,
     BoxMode,
+    CroppedBitMasks,
     Instances,
     Keypoints,
     PolygonMasks,
     RotatedBoxes,
-    polygons_to_bitmask,
 )
 from detectron2.utils.file_io import PathManager
 
@@ -292,7 +291,8 @@ def transform_instance_annotations(
         segm = annotation["segmentation"]
         if isinstance(segm, list):
             # polygons
-            polygons = [np.asarray(p).reshape(-1, 2) for p in segm]
+            # copy, as transforms may modify the coordinates in place
+            polygons = [np.array(p, dtype=np.float64).reshape(-1, 2) for p in segm]
             annotation["segmentation"] = [
                 p.reshape(-1) for p in transforms.apply_polygons(polygons)
             ]
@@ -332,8 +332,8 @@ def transform_keypoint_annotations(keypoints, transforms, image_size, keypoint_h
             When `transforms` includes horizontal flip, will use the index
             mapping to flip keypoints.
     """
-    # (N*3,) -> (N, 3)
-    keypoints = np.asarray(keypoints, dtype="float64").reshape(-1, 3)
+    # (N*3,) -> (N, 3). Copy, as it is modified in place below.
+    keypoints = np.array(keypoints, dtype="float64").reshape(-1, 3)
     keypoints_xy = transforms.apply_coords(keypoints[:, :2])
 
     # Set all out-of-boundary points to "unlabeled"
@@ -399,43 +399,20 @@ def annotations_to_instances(annos, image_size, mask_format="polygon"):
     if len(annos) and "segmentation" in annos[0]:
         segms = [obj["segmentation"] for obj in annos]
         #print('mask_format:', mask_format)
+        # Full-image masks for the semantic and incoherence targets of the mask head,
+        # stored as crops around each object, which are much smaller.
+        gt_masks_bit = CroppedBitMasks.from_segmentations(segms, *image_size)
         if mask_format == "polygon":
             try:
-                poly_masks = PolygonMasks(segms)
+                target.gt_masks = PolygonMasks(segms)
             except ValueError as e:
                 raise ValueError(
                     "Failed to use mask_format=='polygon' from the given annotations!"
                 ) from e
-            #else:
-            #assert mask_format == "bitmask", mask_format
-            masks = []
-            for segm in segms:
-                if isinstance(segm, list):
-                    # polygon
-                    masks.append(polygons_to_bitmask(segm, *image_size))
-                elif isinstance(segm, dict):
-                    # COCO RLE
-                    masks.append(mask_util.decode(segm))
-                elif isinstance(segm, np.ndarray):
-                    assert segm.ndim == 2, "Expect segmentation of 2 dimensions, got {}.".format(
-                        segm.ndim
-                    )
-                    # mask array
-                    masks.append(segm)
-                else:
-                    raise ValueError(
-                        "Cannot convert segmentation of type '{}' to BitMasks!"
-                        "Supported types are: polygons as list[list[float] or ndarray],"
-                        " COCO-style RLE as a dict, or a binary segmentation mask "
-                        " in a 2D numpy array of shape HxW.".format(type(segm))
-                    )
-            # torch.from_numpy does not support array with negative stride.
-            masks = BitMasks(
-                torch.stack([torch.from_numpy(np.ascontiguousarray(x)) for x in masks])
-            )
-
-        target.gt_masks = poly_masks
-        target.gt_masks_bit = masks 
+        else:
+            assert mask_format == "bitmask", mask_format
+            target.gt_masks = gt_masks_bit.to_bitmasks()
+        target.gt_masks_bit = gt_masks_bit
 
     if len(annos) and "keypoints" in annos[0]:
         kpts = [obj.get("keypoints", []) for obj in annos]
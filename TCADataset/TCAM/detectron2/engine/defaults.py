@@ -10,11 +10,15 @@ since they are meant to represent the "common default behavior" people need in t
 """
 
 import argparse
+import itertools
 import logging
+import math
 import os
 import sys
+import time
 import weakref
-from collections import OrderedDict
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
 import torch
 from fvcore.nn.precise_bn import get_bn_modules
@@ -28,9 +32,12 @@ from detectron2.data import (
     MetadataCatalog,
     build_detection_test_loader,
     build_detection_train_loader,
+    get_eval_subset,
 )
+from detectron2.data.detection_utils import read_image
 from detectron2.evaluation import (
     DatasetEvaluator,
+    ImageSubsetEvaluator,
     inference_on_dataset,
     print_csv_format,
     verify_results,
@@ -42,7 +49,7 @@ from detectron2.utils.collect_env import collect_env_info
 from detectron2.utils.env import seed_all_rng
 from detectron2.utils.events import CommonMetricPrinter, JSONWriter, TensorboardXWriter
 from detectron2.utils.file_io import PathManager
-from detectron2.utils.logger import setup_logger
+from detectron2.utils.logger import create_small_table, setup_logger
 
 from . import hooks
 from .train_loop import AMPTrainer, SimpleTrainer, TrainerBase
@@ -52,6 +59,7 @@ __all__ = [
     "default_argument_parser",
     "default_setup",
     "default_writers",
+    "BatchPredictor",
     "DefaultPredictor",
     "DefaultTrainer",
 ]
@@ -320,6 +328,170 @@ class DefaultPredictor:
             return predictions
 
 
+class BatchPredictor:
+    """
+    Create an end-to-end predictor with the given config, like :class:`DefaultPredictor`,
+    that runs on single device for many input images:
+
+    1. Read and resize the images in a pool of threads, while the model runs.
+    2. Group the images by aspect ratio, so that a batch needs little padding.
+    3. Run the model on batches of up to `batch_size` images.
+
+    The outputs are returned in the order of the inputs. The throughput of the model for
+    each batch size is logged, and returned by :meth:`throughput`.
+
+    Attributes:
+        metadata (Metadata): the metadata of the underlying dataset, obtained from
+            cfg.DATASETS.TEST.
+
+    Examples:
+    ::
+        pred = BatchPredictor(cfg)
+        outputs = pred(["slide1.jpg", "slide2.jpg", cv2.imread("slide3.jpg")])
+    """
+
+    def __init__(self, cfg, batch_size=None, num_workers=None, score_only=None):
+        """
+        Args:
+            cfg (CfgNode):
+            batch_size (int): maximum number of images of a batch.
+                Defaults to cfg.TEST.BATCH_PREDICTOR.BATCH_SIZE.
+            num_workers (int): number of threads reading and resizing the images. 0 reads
+                them in the main thread. Defaults to cfg.TEST.BATCH_PREDICTOR.NUM_WORKERS.
+            score_only (bool): whether the model only computes the areas covered by the
+                masks, without pasting them. Defaults to cfg.TEST.SCORE_ONLY.
+        """
+        self.cfg = cfg.clone()  # cfg can be modified by model
+        if score_only is not None:
+            self.cfg.defrost()
+            self.cfg.TEST.SCORE_ONLY = score_only
+        self.model = build_model(self.cfg)
+        self.model.eval()
+        # the device of the model, to wait for its outputs when timing it
+        tensor = next(itertools.chain(self.model.parameters(), self.model.buffers()), None)
+        self.device = tensor.device if tensor is not None else torch.device("cpu")
+        if len(cfg.DATASETS.TEST):
+            self.metadata = MetadataCatalog.get(cfg.DATASETS.TEST[0])
+
+        checkpointer = DetectionCheckpointer(self.model)
+        checkpointer.load(cfg.MODEL.WEIGHTS)
+
+        self.aug = T.ResizeShortestEdge(
+            [cfg.INPUT.MIN_SIZE_TEST, cfg.INPUT.MIN_SIZE_TEST], cfg.INPUT.MAX_SIZE_TEST
+        )
+
+        self.input_format = cfg.INPUT.FORMAT
+        assert self.input_format in ["RGB", "BGR"], self.input_format
+
+        self.batch_size = batch_size or cfg.TEST.BATCH_PREDICTOR.BATCH_SIZE
+        if num_workers is None:
+            num_workers = cfg.TEST.BATCH_PREDICTOR.NUM_WORKERS
+        self.num_workers = num_workers
+        # batch size -> number of images and seconds of the model
+        self._timings = defaultdict(lambda: [0, 0.0])
+        self._logger = logging.getLogger(__name__)
+
+    def preprocess(self, image):
+        """
+        Args:
+            image (np.ndarray or str): an image of shape (H, W, C) (in BGR order), or the
+                path of an image file.
+
+        Returns:
+            dict: the input of the model for the image.
+        """
+        if isinstance(image, str):
+            image = read_image(image, format="BGR")
+        if self.input_format == "RGB":
+            # whether the model expects BGR inputs or RGB
+            image = image[:, :, ::-1]
+        height, width = image.shape[:2]
+        image = self.aug.get_transform(image).apply_image(image)
+        image = torch.as_tensor(image.astype("float32").transpose(2, 0, 1))
+        return {"image": image, "height": height, "width": width}
+
+    def _inputs(self, images):
+        """
+        Yields:
+            (int, dict): the index and the model inputs of each image, in order.
+        """
+        if self.num_workers == 0:
+            yield from enumerate(map(self.preprocess, images))
+            return
+        with ThreadPoolExecutor(self.num_workers) as executor:
+            # read ahead by a bounded number of images, so that they are not all in memory
+            pending = deque()
+            idx = 0
+            for image in images:
+                pending.append(executor.submit(self.preprocess, image))
+                if len(pending) > 2 * self.batch_size + self.num_workers:
+                    yield idx, pending.popleft().result()
+                    idx += 1
+            for future in pending:
+                yield idx, future.result()
+                idx += 1
+
+    def _batches(self, images):
+        """
+        Yields:
+            list[(int, dict)]: batches of the indices and model inputs of images whose aspect
+                ratios are in the same quarter of an octave.
+        """
+        buckets = defaultdict(list)
+        for idx, inputs in self._inputs(images):
+            height, width = inputs["image"].shape[-2:]
+            bucket_id = round(math.log2(width / height) * 4)
+            bucket = buckets[bucket_id]
+            bucket.append((idx, inputs))
+            if len(bucket) == self.batch_size:
+                yield buckets.pop(bucket_id)
+        yield from buckets.values()
+
+    def __call__(self, images):
+        """
+        Args:
+            images (list[np.ndarray or str]): images of shape (H, W, C) (in BGR order), or
+                paths of image files.
+
+        Returns:
+            list[dict]: the outputs of the model for each image, in the order of `images`.
+                See :doc:`/tutorials/models` for details about the format.
+        """
+        images = list(images)
+        predictions = [None] * len(images)
+        start_time = time.perf_counter()
+        with torch.no_grad():
+            for batch in self._batches(images):
+                start = time.perf_counter()
+                outputs = self.model([inputs for _, inputs in batch])
+                if self.device.type == "cuda":
+                    torch.cuda.synchronize(self.device)
+                timing = self._timings[len(batch)]
+                timing[0] += len(batch)
+                timing[1] += time.perf_counter() - start
+                for (idx, _), output in zip(batch, outputs):
+                    predictions[idx] = output
+
+        if len(images):
+            total_time = time.perf_counter() - start_time
+            self._logger.info(
+                "Predicted {} images in {:.2f} s ({:.2f} images/s). "
+                "Throughput of the model (images/s) by batch size:\n".format(
+                    len(images), total_time, len(images) / total_time
+                )
+                + create_small_table(self.throughput())
+            )
+        return predictions
+
+    def throughput(self):
+        """
+        Returns:
+            dict[int, float]: the number of images per second of the model for each batch
+                size, over all calls of this predictor.
+        """
+        return {k: n / t for k, (n, t) in sorted(self._timings.items()) if t > 0}
+
+
 class DefaultTrainer(TrainerBase):
     """
     A trainer with default training logic. It does the following:
@@ -452,7 +624,9 @@ class DefaultTrainer(TrainerBase):
             ret.append(hooks.PeriodicCheckpointer(self.checkpointer, cfg.SOLVER.CHECKPOINT_PERIOD))
 
         def test_and_save_results():
-            self._last_eval_results = self.test(self.cfg, self.model)
+            # the periodic evaluations may use subsets of the test sets, but not the last one
+            subset = self.iter + 1 < self.max_iter
+            self._last_eval_results = self.test(self.cfg, self.model, subset=subset)
             return self._last_eval_results
 
         # Do evaluation after checkpointer, because then if it fails,
@@ -540,15 +714,19 @@ class DefaultTrainer(TrainerBase):
         return build_detection_train_loader(cfg)
 
     @classmethod
-    def build_test_loader(cls, cfg, dataset_name):
+    def build_test_loader(cls, cfg, dataset_name, image_ids=None):
         """
+        Args:
+            image_ids (list or None): if given, only load the images with these ids.
+                :meth:`test` uses it for the evaluations on a subset of the test sets.
+
         Returns:
             iterable
 
         It now calls :func:`detectron2.data.build_detection_test_loader`.
         Overwrite it if you'd like a different data loader.
         """
-        return build_detection_test_loader(cfg, dataset_name)
+        return build_detection_test_loader(cfg, dataset_name, image_ids=image_ids)
 
     @classmethod
     def build_evaluator(cls, cfg, dataset_name):
@@ -567,7 +745,7 @@ Alternatively, you can call evaluation functions yourself (see Colab balloon tut
         )
 
     @classmethod
-    def test(cls, cfg, model, evaluators=None):
+    def test(cls, cfg, model, evaluators=None, subset=False):
         """
         Evaluate the given model. The given model is expected to already contain
         weights to evaluate.
@@ -578,6 +756,9 @@ Alternatively, you can call evaluation functions yourself (see Colab balloon tut
             evaluators (list[DatasetEvaluator] or None): if None, will call
                 :meth:`build_evaluator`. Otherwise, must have the same length as
                 ``cfg.DATASETS.TEST``.
+            subset (bool): if True and ``cfg.TEST.EVAL_SUBSET.SIZE`` is positive, evaluate on
+                the subsets of :func:`get_eval_subset` instead of the full test sets.
+                They are cached in ``cfg.OUTPUT_DIR``.
 
         Returns:
             dict: a dict of result metrics
@@ -592,7 +773,18 @@ Alternatively, you can call evaluation functions yourself (see Colab balloon tut
 
         results = OrderedDict()
         for idx, dataset_name in enumerate(cfg.DATASETS.TEST):
-            data_loader = cls.build_test_loader(cfg, dataset_name)
+            img_ids = None
+            if subset and cfg.TEST.EVAL_SUBSET.SIZE > 0:
+                img_ids = get_eval_subset(
+                    dataset_name,
+                    cfg.TEST.EVAL_SUBSET.SIZE,
+                    cache_file=os.path.join(cfg.OUTPUT_DIR, f"eval_subset_{dataset_name}.json"),
+                    group_key=cfg.TEST.EVAL_SUBSET.GROUP_KEY,
+                    seed=cfg.TEST.EVAL_SUBSET.SEED,
+                )
+                data_loader = cls.build_test_loader(cfg, dataset_name, image_ids=img_ids)
+            else:
+                data_loader = cls.build_test_loader(cfg, dataset_name)
             # When evaluators are passed in as arguments,
             # implicitly assume that evaluators can be created before data_loader.
             if evaluators is not None:
@@ -607,6 +799,8 @@ Alternatively, you can call evaluation functions yourself (see Colab balloon tut
                     )
                     results[dataset_name] = {}
                     continue
+            if img_ids is not None:
+                evaluator = ImageSubsetEvaluator(evaluator, img_ids)
             results_i = inference_on_dataset(model, data_loader, evaluator)
             results[dataset_name] = results_i
             if comm.is_main_process():
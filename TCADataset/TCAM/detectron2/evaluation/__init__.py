@@ -2,10 +2,17 @@
 from .cityscapes_evaluation import CityscapesInstanceEvaluator, CityscapesSemSegEvaluator
 from .coco_evaluation import COCOEvaluator
 from .rotated_coco_evaluation import RotatedCOCOEvaluator
-from .evaluator import DatasetEvaluator, DatasetEvaluators, inference_context, inference_on_dataset
+from .evaluator import (
+    DatasetEvaluator,
+    DatasetEvaluators,
+    ImageSubsetEvaluator,
+    inference_context,
+    inference_on_dataset,
+)
 from .lvis_evaluation import LVISEvaluator
 from .panoptic_evaluation import COCOPanopticEvaluator
 from .pascal_voc_evaluation import PascalVOCDetectionEvaluator
+from .prediction_dump import PredictionDump, PredictionDumpWriter
 from .sem_seg_evaluation import SemSegEvaluator
 from .testing import print_csv_format, verify_results
 
@@ -5,21 +5,20 @@ import io
 import itertools
 import json
 import logging
+import multiprocessing as mp
 import tempfile
-from easydict import EasyDict
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 
 import numpy as np
 import os
 import pickle
 from collections import OrderedDict
 import pycocotools.mask as mask_util
-from pycocotools import mask as maskUtils
 import torch
 from pycocotools.coco import COCO
 from pycocotools.cocoeval import COCOeval
 from tabulate import tabulate
-from sklearn.metrics import mean_squared_error,mean_absolute_error
 from scipy import stats
 
 import detectron2.utils.comm as comm
@@ -28,11 +27,23 @@ from detectron2.data import MetadataCatalog
 from detectron2.data.datasets.coco import convert_to_coco_json
 from detectron2.evaluation.fast_eval_api import COCOeval_opt
 # from detectron2.evaluation import test
-from detectron2.structures import Boxes, BoxMode, pairwise_iou
+from detectron2.structures import Boxes, BoxMode, ROIMasks, pairwise_iou
 from detectron2.utils.file_io import PathManager
 from detectron2.utils.logger import create_small_table
 
 from .evaluator import DatasetEvaluator
+from .prediction_dump import PredictionDumpWriter
+from .rle_coverage import union_area
+
+# dataset category ids of the Text and Title classes. The courseware score of an image is
+# derived from the ratio of their area to the area of all instances.
+TEXT_CATEGORY_IDS = (2, 3)
+# the lower bounds of the bands of text area ratios, and the courseware score of each band.
+# See :func:`compt_score`.
+DEFAULT_SCORE_BANDS = (
+    [0.0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9],
+    [3, 5, 7, 15, 12, 9, 7, 5, 3, 1],
+)
 
 
 class COCOEvaluator(DatasetEvaluator):
@@ -58,6 +69,10 @@ class COCOEvaluator(DatasetEvaluator):
         max_dets_per_image=None,
         use_fast_impl=True,
         kpt_oks_sigmas=(),
+        shard_evaluation=False,
+        num_workers=0,
+        columnar_dump=False,
+        score_bands=DEFAULT_SCORE_BANDS,
     ):
         """
         Args:
@@ -92,11 +107,31 @@ class COCOEvaluator(DatasetEvaluator):
                 See http://cocodataset.org/#keypoints-eval
                 When empty, it will use the defaults in COCO.
                 Otherwise it should be the same length as ROI_KEYPOINT_HEAD.NUM_KEYPOINTS.
+            shard_evaluation (bool): if True, every rank matches its own predictions to the
+                ground truth and computes their courseware scores, and only these per-image
+                results are gathered to the main process, which accumulates them with the
+                official COCO API. The predictions themselves are not gathered, so they
+                are only dumped to ``output_dir`` with ``columnar_dump``.
+            num_workers (int): if positive, the tasks are evaluated in this number of forked
+                processes, each task split into groups of categories. The ground truth and
+                the predictions are inherited by the processes instead of being pickled.
+            columnar_dump (bool): if True, the instance predictions are appended to a
+                :class:`PredictionDump` in "predictions" of ``output_dir`` as they are
+                processed, with one shard per rank, instead of being dumped to the files above.
+            score_bands (tuple[list[float], list[int]]): the bands of text area ratios that
+                define the courseware scores of the images. See :func:`compt_score`.
         """
         self._logger = logging.getLogger(__name__)
         self._distributed = distributed
         self._output_dir = output_dir
         self._use_fast_impl = use_fast_impl
+        self._shard_evaluation = shard_evaluation
+        self._num_workers = num_workers
+        self._score_bands = score_bands
+        self._dump_dir = (
+            os.path.join(output_dir, "predictions") if columnar_dump and output_dir else None
+        )
+        self._dump_writer = None
 
         # COCOeval requires the limit on the number of detections per image (maxDets) to be a list
         # with at least 3 elements. The default maxDets in COCOeval is [1, 10, 100], in which the
@@ -145,6 +180,9 @@ class COCOEvaluator(DatasetEvaluator):
 
     def reset(self):
         self._predictions = []
+        if self._dump_writer is not None:
+            self._dump_writer.close()
+        self._dump_writer = None
 
     def process(self, inputs, outputs):
         """
@@ -156,23 +194,63 @@ class COCOEvaluator(DatasetEvaluator):
                 "instances" that contains :class:`Instances`.
         """
 
+        text_classes = get_text_classes(self._metadata)
         for input, output in zip(inputs, outputs):
             prediction = {"image_id": input["image_id"]}
 
             if "instances" in output:
-                instances = output["instances"].to(self._cpu_device)
+                instances = output["instances"]
+                pred_masks = instances.pred_masks if instances.has("pred_masks") else None
+                roi_masks = isinstance(pred_masks, ROIMasks)
+                if pred_masks is not None and not roi_masks and len(instances) > 0:
+                    prediction["areas"] = courseware_areas(instances, text_classes)
+                instances = instances.to(self._cpu_device)
+                if roi_masks:
+                    # encode on the device of the masks, which only copies the crops to host
+                    instances.pred_masks = pred_masks
                 prediction["instances"] = instances_to_coco_json(instances, input["image_id"])
+                if "mask_coverage" in output:
+                    # computed by the model in score-only mode, see TEST.SCORE_ONLY
+                    if len(instances) > 0:
+                        prediction["areas"] = _coverage_courseware_areas(
+                            output["mask_coverage"], text_classes
+                        )
+                elif roi_masks and len(instances) > 0:
+                    prediction["areas"] = _rle_courseware_areas(
+                        prediction["instances"], text_classes
+                    )
+                if self._dump_dir is not None:
+                    self._dump(input["image_id"], instances.image_size, prediction["instances"])
             if "proposals" in output:
                 prediction["proposals"] = output["proposals"].to(self._cpu_device)
             if len(prediction) > 1:
                 self._predictions.append(prediction)
 
+    def _dump(self, image_id, image_size, coco_results):
+        """
+        Append the COCO-format results of an image to the columnar dump, with dataset
+        category ids.
+        """
+        if self._dump_writer is None:
+            self._dump_writer = PredictionDumpWriter(self._dump_dir, shard=str(comm.get_rank()))
+        id_map = self._metadata.get("thing_dataset_id_to_contiguous_id")
+        if id_map is not None:
+            reverse_id_mapping = {v: k for k, v in id_map.items()}
+            coco_results = [
+                dict(x, category_id=reverse_id_mapping[x["category_id"]]) for x in coco_results
+            ]
+        self._dump_writer.append(image_id, image_size, coco_results)
 
     def evaluate(self, img_ids=None):
         """
         Args:
             img_ids: a list of image IDs to evaluate on. Default to None for the whole dataset
         """
+        if self._dump_writer is not None:
+            self._dump_writer.close()
+            self._dump_writer = None
+        if self._shard_evaluation:
+            return self._evaluate_shards(img_ids=img_ids)
         if self._distributed:
             comm.synchronize()
             predictions = comm.gather(self._predictions, dst=0)
@@ -187,7 +265,7 @@ class COCOEvaluator(DatasetEvaluator):
             self._logger.warning("[COCOEvaluator] Did not receive valid predictions.")
             return {}
 
-        if self._output_dir:
+        if self._output_dir and self._dump_dir is None:
             PathManager.mkdirs(self._output_dir)
             file_path = os.path.join(self._output_dir, "instances_predictions.pth")
             with PathManager.open(file_path, "wb") as f:
@@ -213,13 +291,11 @@ class COCOEvaluator(DatasetEvaluator):
                 tasks.add("keypoints")
         return sorted(tasks)
 
-    def _eval_predictions(self, predictions, img_ids=None):
+    def _to_coco_results(self, predictions):
         """
-        Evaluate predictions. Fill self._results with the metrics of the tasks.
+        Collect the COCO-format results of the predictions, with dataset category ids.
         """
-        self._logger.info("Preparing results for COCO format ...")
         coco_results = list(itertools.chain(*[x["instances"] for x in predictions]))
-        tasks = self._tasks or self._tasks_from_predictions(coco_results)
 
         # unmap the category ids for COCO
         if hasattr(self._metadata, "thing_dataset_id_to_contiguous_id"):
@@ -237,8 +313,135 @@ class COCOEvaluator(DatasetEvaluator):
                     f"predicted class id should be in [0, {num_classes - 1}]."
                 )
                 result["category_id"] = reverse_id_mapping[category_id]
+        return coco_results
 
-        if self._output_dir:
+    def _evaluate_shards(self, img_ids=None):
+        """
+        Evaluate the predictions where they were produced. Each rank matches its predictions
+        to the ground truth and scores their courseware areas, and only these per-image
+        results are gathered to the main process, which accumulates them into the metrics.
+        """
+        if self._distributed:
+            comm.synchronize()
+            all_gather, gather = comm.all_gather, comm.gather
+            is_main_process = comm.is_main_process()
+        else:
+            all_gather = gather = lambda x: [x]
+            is_main_process = True
+        if self._output_dir and self._dump_dir is None:
+            self._logger.warning(
+                "[COCOEvaluator] Predictions are only dumped in shards with columnar_dump=True."
+            )
+
+        instances = [x for x in self._predictions if "instances" in x]
+        coco_results = self._to_coco_results(instances)
+        # what each rank has predicted is small, and every rank needs it to take its share
+        shared = all_gather(
+            (
+                len(self._predictions),
+                len(coco_results),
+                self._tasks_from_predictions(coco_results) if instances else [],
+                [x["image_id"] for x in instances],
+            )
+        )
+        num_predictions, num_results, tasks, predicted_ids = zip(*shared)
+        tasks = self._tasks or sorted(set(itertools.chain(*tasks)))
+
+        proposals = [
+            {"image_id": x["image_id"], "proposals": x["proposals"]}
+            for x in self._predictions
+            if "proposals" in x
+        ]
+        proposals = list(itertools.chain(*gather(proposals)))
+
+        shard = None
+        if any(predicted_ids) and self._do_evaluation:
+            eval_ids = self._coco_api.getImgIds() if img_ids is None else img_ids
+            shard_ids = set(eval_ids).intersection(x["image_id"] for x in instances)
+            if is_main_process:
+                # the images without any prediction only contribute their ground truth
+                predicted = set(itertools.chain(*predicted_ids))
+                shard_ids.update(k for k in eval_ids if k not in predicted)
+            shard_ids = sorted(shard_ids)
+
+            pred_areas = {x["image_id"]: x["areas"] for x in instances if "areas" in x}
+            pred_areas = {k: pred_areas[k] for k in shard_ids if k in pred_areas}
+            shard = {
+                "scores": _courseware_score_pairs(
+                    self._coco_api, pred_areas, self._score_bands
+                ),
+                "eval_imgs": {
+                    task: _evaluate_images_on_coco(
+                        self._coco_api,
+                        coco_results,
+                        task,
+                        shard_ids,
+                        kpt_oks_sigmas=self._kpt_oks_sigmas,
+                        max_dets_per_image=self._max_dets_per_image,
+                    )
+                    for task in tasks
+                    if sum(num_results) > 0
+                },
+            }
+        shards = gather(shard)
+        if not is_main_process:
+            return {}
+
+        if sum(num_predictions) == 0:
+            self._logger.warning("[COCOEvaluator] Did not receive valid predictions.")
+            return {}
+
+        self._results = OrderedDict()
+        if len(proposals) > 0:
+            self._eval_box_proposals(proposals)
+        if any(predicted_ids) and not self._do_evaluation:
+            self._logger.info("Annotations are not available for evaluation.")
+        elif any(predicted_ids):
+            self._logger.info(
+                "Accumulating the per-image results of {} shards ...".format(len(shards))
+            )
+            true_scores, pred_scores = (
+                np.concatenate(x) for x in zip(*[s["scores"] for s in shards])
+            )
+            courseware_metrics = courseware_score_metrics(true_scores, pred_scores)
+            if courseware_metrics:
+                self._logger.info(
+                    "Evaluation results for courseware score: \n"
+                    + create_small_table(courseware_metrics)
+                )
+            for task in sorted(tasks):
+                assert task in {"bbox", "segm", "keypoints"}, f"Got unknown task: {task}!"
+                eval_imgs = {}
+                for s in shards:
+                    eval_imgs.update(s["eval_imgs"].get(task, {}))
+                coco_eval = (
+                    _accumulate_images_on_coco(
+                        self._coco_api,
+                        eval_imgs,
+                        task,
+                        eval_ids,
+                        kpt_oks_sigmas=self._kpt_oks_sigmas,
+                        max_dets_per_image=self._max_dets_per_image,
+                    )
+                    if sum(num_results) > 0
+                    else None
+                )
+                res = self._derive_coco_results(
+                    coco_eval, task, class_names=self._metadata.get("thing_classes")
+                )
+                res.update(courseware_metrics)
+                self._results[task] = res
+        return copy.deepcopy(self._results)
+
+    def _eval_predictions(self, predictions, img_ids=None):
+        """
+        Evaluate predictions. Fill self._results with the metrics of the tasks.
+        """
+        self._logger.info("Preparing results for COCO format ...")
+        coco_results = self._to_coco_results(predictions)
+        tasks = self._tasks or self._tasks_from_predictions(coco_results)
+
+        if self._output_dir and self._dump_dir is None:
             file_path = os.path.join(self._output_dir, "coco_instances_results.json")
             self._logger.info("Saving results to {}".format(file_path))
             with PathManager.open(file_path, "w") as f:
@@ -254,29 +457,58 @@ class COCOEvaluator(DatasetEvaluator):
                 "unofficial" if self._use_fast_impl else "official"
             )
         )
-        for task in sorted(tasks):
+        # the courseware score does not depend on the task, so it is computed once
+        pred_areas = {x["image_id"]: x["areas"] for x in predictions if "areas" in x}
+        if img_ids is not None:
+            pred_areas = {k: pred_areas[k] for k in img_ids if k in pred_areas}
+        courseware_metrics = _evaluate_courseware_scores(
+            self._coco_api, pred_areas, self._score_bands
+        )
+        if courseware_metrics:
+            self._logger.info(
+                "Evaluation results for courseware score: \n"
+                + create_small_table(courseware_metrics)
+            )
+
+        for task in tasks:
             assert task in {"bbox", "segm", "keypoints"}, f"Got unknown task: {task}!"
-            coco_eval = (
-                _evaluate_predictions_on_coco(
-                    self._coco_api,
-                    coco_results,
-                    task,
-                    kpt_oks_sigmas=self._kpt_oks_sigmas,
-                    use_fast_impl=self._use_fast_impl,
-                    img_ids=img_ids,
-                    max_dets_per_image=self._max_dets_per_image,
-                )
-                if len(coco_results) > 0
-                else None  # cocoapi does not handle empty results very well
+        coco_evals = {}
+        if self._num_workers > 0 and len(coco_results) > 0:
+            coco_evals = _evaluate_predictions_in_workers(
+                self._coco_api,
+                coco_results,
+                sorted(tasks),
+                self._num_workers,
+                kpt_oks_sigmas=self._kpt_oks_sigmas,
+                use_fast_impl=self._use_fast_impl,
+                img_ids=img_ids,
+                max_dets_per_image=self._max_dets_per_image,
             )
 
+        for task in sorted(tasks):
+            if task in coco_evals:
+                coco_eval = coco_evals[task]
+            else:
+                coco_eval = (
+                    _evaluate_predictions_on_coco(
+                        self._coco_api,
+                        coco_results,
+                        task,
+                        kpt_oks_sigmas=self._kpt_oks_sigmas,
+                        use_fast_impl=self._use_fast_impl,
+                        img_ids=img_ids,
+                        max_dets_per_image=self._max_dets_per_image,
+                    )
+                    if len(coco_results) > 0
+                    else None  # cocoapi does not handle empty results very well
+                )
+
             res = self._derive_coco_results(
-                coco_eval['COCOeval'], task, class_names=self._metadata.get("thing_classes")
+                coco_eval, task, class_names=self._metadata.get("thing_classes")
             )
-            res.update(coco_eval['custom_metrics'])
+            res.update(courseware_metrics)
             self._results[task] = res
 
-
     def _eval_box_proposals(self, predictions):
         """
         Evaluate the box proposals in predictions.
@@ -385,6 +617,61 @@ class COCOEvaluator(DatasetEvaluator):
         return results
 
 
+def get_text_classes(metadata):
+    """
+    Args:
+        metadata (Metadata): metadata of a dataset.
+
+    Returns:
+        list[int]: the contiguous ids of the classes in :data:`TEXT_CATEGORY_IDS`.
+    """
+    id_map = metadata.get("thing_dataset_id_to_contiguous_id")
+    if id_map is None:
+        return list(TEXT_CATEGORY_IDS)
+    return [id_map[k] for k in TEXT_CATEGORY_IDS if k in id_map]
+
+
+def courseware_areas(instances, text_classes):
+    """
+    Compute the mask areas used by the courseware score of an image, on the device of the
+    predictions, so that the masks need not be decoded again after RLE encoding.
+    Pixels covered by several instances are counted once, as in :func:`gen_area_dict`.
+
+    Args:
+        instances (Instances): the predictions of an image, with full-image "pred_masks".
+        text_classes (list[int]): contiguous ids of the text classes.
+
+    Returns:
+        tuple[float, float]: the area covered by the instances of the text classes,
+            and by all instances.
+    """
+    masks = instances.pred_masks
+    text_classes = torch.as_tensor(text_classes, device=masks.device, dtype=torch.long)
+    is_text = (instances.pred_classes[:, None] == text_classes).any(dim=1)
+    areas = torch.stack([masks[is_text].any(dim=0).sum(), masks.any(dim=0).sum()])
+    text_area, total_area = areas.double().tolist()
+    return text_area, total_area
+
+
+def _rle_courseware_areas(coco_results, text_classes):
+    """
+    Like :func:`courseware_areas`, for the RLE-encoded results of an image.
+    """
+    rles = [result["segmentation"] for result in coco_results]
+    text_rles = [r["segmentation"] for r in coco_results if r["category_id"] in text_classes]
+    return float(union_area(text_rles)), float(union_area(rles))
+
+
+def _coverage_courseware_areas(coverage, text_classes):
+    """
+    Like :func:`courseware_areas`, for the "mask_coverage" of
+    :func:`detectron2.modeling.mask_coverage`.
+    """
+    class_rles = coverage["class_rles"]
+    text_rles = [class_rles[c] for c in text_classes if c in class_rles]
+    return float(union_area(text_rles)), float(coverage["union_area"])
+
+
 def instances_to_coco_json(instances, img_id):
     """
     Dump an "Instances" object to a COCO-format json that's used for evaluation.
@@ -410,10 +697,19 @@ def instances_to_coco_json(instances, img_id):
     if has_mask:
         # use RLE to encode the masks, because they are too large and takes memory
         # since this evaluator stores outputs of the entire dataset
-        rles = [
-            mask_util.encode(np.array(mask[:, :, None], order="F", dtype="uint8"))[0]
-            for mask in instances.pred_masks
-        ]
+        if instances.has("pred_mask_rles"):
+            # encoded by mask_coverage in score-only mode. Copied, as the counts are decoded below
+            rles = [dict(rle) for rle in instances.pred_mask_rles]
+        elif isinstance(instances.pred_masks, ROIMasks):
+            # encode the masks in their boxes, without pasting them into the full image
+            rles = instances.pred_masks.to_rles(
+                instances.pred_boxes.tensor, *instances.image_size
+            )
+        else:
+            rles = [
+                mask_util.encode(np.array(mask[:, :, None], order="F", dtype="uint8"))[0]
+                for mask in instances.pred_masks
+            ]
         for rle in rles:
             # "counts" is an array encoded by mask_util as a byte-stream. Python3's
             # json writer which always produces strings cannot serialize a bytestream
@@ -560,138 +856,113 @@ def _evaluate_box_proposals(dataset_predictions, coco_api, thresholds=None, area
         "num_pos": num_pos,
     }
 
-def gen_area_dict(label_dict):
-    text_area = 0
-    if "score" in label_dict.keys():
-        class_labels = label_dict["labels"]
-        masks = label_dict["counts"]
-        segmentation = label_dict["segmentation"]
-        total_area = 0
-        for class_label, segmentation in zip(class_labels, segmentation):
-            if isinstance(segmentation,dict) and "size" in segmentation and "counts" in segmentation:
-                rle = {'size':segmentation["size"],
-                       'counts':segmentation["counts"]}
-                mask = maskUtils.decode(rle)
-                mask = np.array(mask,dtype=np.float32)
-                class_area = np.sum(mask)
-                class_area = float(class_area)
-                total_area += class_area
-                if class_label == 2 or class_label == 3:
-                    text_area += class_area
-    else:
-        # gt
-        class_labels = label_dict["labels"]
-        area = label_dict["area"]
 
-        text_area = 0
-        total_area = 0
-        for class_label, class_area in zip(class_labels, area):
-            total_area += class_area
-            if class_label == 2 or class_label == 3:
-                text_area += class_area
+def gen_area_dict(coco_gt, annotations):
+    """
+    Returns:
+        tuple[int, int]: the area covered by the ground truth annotations of the text
+            classes, and by all annotations. Overlaps are counted once.
+    """
+    rles = [coco_gt.annToRLE(annotation) for annotation in annotations]
+    text_rles = [
+        rle
+        for rle, annotation in zip(rles, annotations)
+        if annotation["category_id"] in TEXT_CATEGORY_IDS
+    ]
+    return union_area(text_rles), union_area(rles)
+
 
-    return text_area, total_area
+def compute_ptrate(text_areas, total_areas):
+    """
+    Args:
+        text_areas, total_areas (array-like): the text and total areas of images.
+
+    Returns:
+        ndarray: the float64 ratios of the text areas to the total areas. 0 for the
+            images of total area 0.
+    """
+    text_areas = np.asarray(text_areas, dtype=np.float64)
+    total_areas = np.asarray(total_areas, dtype=np.float64)
+    out = np.zeros(np.broadcast(text_areas, total_areas).shape)
+    return np.divide(text_areas, total_areas, out=out, where=total_areas > 0)
 
-def compute_ptrate(image_id,text_area,total_area):
-    rate_dict = {}
-    try:
-        text_rate = text_area /total_area
-        image_id_key = tuple(image_id) if isinstance(image_id,list) else image_id
-        rate_dict[image_id_key] = text_rate
-    except ZeroDivisionError:
-        print("**********************************************", image_id)
-        print("**********************************************", text_area)
-        print("**********************************************",total_area)
-        rate_dict[image_id_key] = 0
-    return rate_dict
-
-def compt_score(rate_dict):
-    score_dict={}
-    image_id = list(rate_dict.keys())[0]
-    rate = list(rate_dict.values())[0]
-
-    if rate >= 0.9 and rate <= 1:
-        temp_score  = 1
-    elif (rate >= 0 and rate < 0.1) or (rate >= 0.8 and rate < 0.9):
-        temp_score = 3
-    elif (rate >= 0.1 and rate < 0.2) or (rate >= 0.7 and rate < 0.8):
-        temp_score = 5
-    elif (rate >= 0.2 and rate < 0.3) or (rate >= 0.6 and rate < 0.7):
-        temp_score = 7
-    elif rate >= 0.3 and rate < 0.4:
-        temp_score = 15
-    elif rate >= 0.4 and rate < 0.5:
-        temp_score = 12
-    elif rate >= 0.5 and rate < 0.6:
-        temp_score = 9
-    else:
-        temp_score = 0
-
-    score_dict[image_id]=temp_score
-    return score_dict
-def get_all_label_dicts_from_coco_gt(coco_gt):
-    label_dicts = []
-    for image_id in coco_gt.getImgIds():
-        ann_ids = coco_gt.getAnnIds(imgIds=image_id)
-        anns = coco_gt.loadAnns(ann_ids)
-        label_dict = EasyDict()
-        label_dict.image_id = image_id
-        label_dict.annotations = anns
-        label_dicts.append(label_dict)
-    return label_dicts
-def convert_label_dicts(label_dicts_gt):
-    new_label_dicts_gt = []
-    for label_dict in label_dicts_gt:
-        image_id = label_dict["image_id"]
-        annotations = label_dict["annotations"]
-
-        new_label_dict = {
-            "bbox": [],
-            "labels": [],
-            "masks": [],
-            "image_id": [],
-            "area": [],
-            "iscrowd": []
-        }
-        for annotation in annotations:
-            new_label_dict["bbox"].append(annotation["bbox"])
-            new_label_dict["labels"].append(annotation["category_id"])
-            new_label_dict["masks"].append(annotation["segmentation"])
-            new_label_dict["image_id"].append(image_id)
-            new_label_dict["area"].append(annotation["area"])
-            new_label_dict["iscrowd"].append(annotation["iscrowd"])
-
-        new_label_dicts_gt.append(new_label_dict)
-    return new_label_dicts_gt
-def convert_coco_results(coco_results):
-    new_coco_results = []
-    current_image_id = None
-    current_result = None
-    for result in coco_results:
-        image_id = result["image_id"]
-        if image_id != current_image_id:
-            if current_result is not None:
-                new_coco_results.append(current_result)
-            current_result = {
-                "bbox": [],
-                "labels": [],
-                "image_id": [],
-                "score": [],
-                "segmentation":[],
-                "counts":[]
-            }
-            current_image_id = image_id
 
-        current_result["bbox"].append(result["bbox"])
-        current_result["labels"].append(result["category_id"])
-        current_result["image_id"].append(image_id)
-        current_result["score"].append(result["score"])
-        current_result["segmentation"].append(result["segmentation"])
-        current_result["counts"].append(result["segmentation"]["counts"])
-    if current_result is not None:
-        new_coco_results.append(current_result)
+def compt_score(rates, score_bands=DEFAULT_SCORE_BANDS):
+    """
+    Args:
+        rates (array-like): text area ratios of images, as computed by :func:`compute_ptrate`.
+        score_bands (tuple[list[float], list[int]]): the lower bounds of the bands of ratios
+            in increasing order, and the courseware score of each band. A band ends where the
+            next one starts, and the last one at 1, inclusive.
+
+    Returns:
+        ndarray: the int64 courseware scores of the rates. 0 for rates outside [0, 1].
+    """
+    lower_bounds, scores = score_bands
+    assert len(lower_bounds) == len(scores), "A score band has no score or no lower bound!"
+    assert np.all(np.diff(lower_bounds) > 0), "Score bands must be in increasing order!"
+    # band k + 1 of the edges is [lower_bounds[k], next bound), and the last edge is
+    # the float after 1 so that 1 is in the last band
+    edges = np.append(np.asarray(lower_bounds, dtype=np.float64), np.nextafter(1.0, 2.0))
+    table = np.concatenate([[0], scores, [0]]).astype(np.int64)
+    return table[np.digitize(rates, edges)]
+
+
+def _evaluate_courseware_scores(coco_gt, pred_areas, score_bands=DEFAULT_SCORE_BANDS):
+    """
+    Compare the courseware scores derived from the predicted and ground truth text area
+    ratios of the images.
+
+    Args:
+        coco_gt (COCO): the ground truth.
+        pred_areas (dict): maps an image id to the (text area, total area) of its
+            predicted masks, as computed by :func:`courseware_areas`.
+        score_bands: see :func:`compt_score`.
+
+    Returns:
+        dict: the Spearman correlation "rho", "mae" and "rmse" between the predicted and
+            the ground truth scores of the images in ``pred_areas``. Empty if no such image.
+    """
+    return courseware_score_metrics(*_courseware_score_pairs(coco_gt, pred_areas, score_bands))
 
-    return new_coco_results
+
+def _courseware_score_pairs(coco_gt, pred_areas, score_bands=DEFAULT_SCORE_BANDS):
+    """
+    Returns:
+        ndarray, ndarray: the ground truth and the predicted courseware scores of the
+            images in ``pred_areas``.
+    """
+    # imgToAnns is an image id -> annotations index, so the join is linear in the images
+    image_ids = [k for k in coco_gt.getImgIds() if k in pred_areas]
+    true_areas = [gen_area_dict(coco_gt, coco_gt.imgToAnns[k]) for k in image_ids]
+    true_areas = np.array(true_areas, dtype=np.int64).reshape(-1, 2)
+    pred_areas = np.array([pred_areas[k] for k in image_ids], dtype=np.int64).reshape(-1, 2)
+    return (
+        compt_score(compute_ptrate(true_areas[:, 0], true_areas[:, 1]), score_bands),
+        compt_score(compute_ptrate(pred_areas[:, 0], pred_areas[:, 1]), score_bands),
+    )
+
+
+def courseware_score_metrics(true_scores, pred_scores):
+    """
+    Args:
+        true_scores, pred_scores (array-like): the ground truth and the predicted courseware
+            scores of the images, as computed by :func:`compt_score`.
+
+    Returns:
+        dict: the Spearman correlation "rho", "mae" and "rmse" between the predicted and
+            the ground truth scores. Empty if there is no image.
+    """
+    true_scores = np.asarray(true_scores, dtype=np.float64)
+    pred_scores = np.asarray(pred_scores, dtype=np.float64)
+    if len(true_scores) == 0:
+        return {}
+
+    rho, _ = stats.spearmanr(pred_scores, true_scores)
+    errors = pred_scores - true_scores
+    mae = np.abs(errors).mean()
+    rmse = np.sqrt(np.square(errors).mean())
+    return {"rho": float(rho), "mae": float(mae), "rmse": float(rmse)}
 
 
 def _evaluate_predictions_on_coco(
@@ -708,71 +979,133 @@ def _evaluate_predictions_on_coco(
     """
     assert len(coco_results) > 0
 
-    if iou_type == "segm":
-        coco_results = copy.deepcopy(coco_results)
-        # When evaluating mask AP, if the results contain bbox, cocoapi will
-        # use the box area as the area of the instance, instead of the mask area.
-        # This leads to a different definition of small/medium/large.
-        # We remove the bbox field to let mask AP use mask area.
-        for c in coco_results:
-            c.pop("bbox", None)
-
-
-    coco_gt = 'path/to/val.json'
-    coco_gt = COCO(coco_gt)
-    label_dicts_gt = get_all_label_dicts_from_coco_gt(coco_gt)
+    coco_eval = _build_coco_eval(
+        coco_gt,
+        coco_results,
+        iou_type,
+        kpt_oks_sigmas=kpt_oks_sigmas,
+        use_fast_impl=use_fast_impl,
+        img_ids=img_ids,
+        max_dets_per_image=max_dets_per_image,
+    )
+    coco_eval.evaluate()
+    coco_eval.accumulate()
+    coco_eval.summarize()
 
-    converted_label_dicts_gt = convert_label_dicts(label_dicts_gt)
-    new_coco_results = convert_coco_results(coco_results)
+    return coco_eval
 
 
-    true_score_list = []
-    pred_score_list = []
+# The inputs of the workers of _evaluate_predictions_in_workers. They are set before the
+# workers are forked, so that the workers inherit them instead of unpickling copies.
+_FORKED_COCO_INPUTS = {}
 
-    for gt_label_dict in converted_label_dicts_gt:
-        print(f'gt_label_dict:{gt_label_dict}')
-        if "image_id" in gt_label_dict:
-            print(f'gt_label_dict["image_id"],length:{len(gt_label_dict["image_id"])}')
-        else:
-            print("gt_label_dict does not contain image_id")
 
-        image_id = gt_label_dict["image_id"][0]
-        pred_label_dict = next((item for item in new_coco_results if item["image_id"][0] == image_id), None)
-        if pred_label_dict is not None:
+def _evaluate_categories_on_coco(iou_type, cat_ids, kwargs):
+    """
+    Evaluate and accumulate the forked coco results of some categories.
 
-            evg_true_textarea, evg_true_totalarea = gen_area_dict(gt_label_dict)
-            evg_pre_textarea, evg_pre_totalarea = gen_area_dict(pred_label_dict)
+    Returns:
+        dict: the "precision", "recall" and "scores" of COCOeval.eval for these categories.
+    """
+    coco_gt = _FORKED_COCO_INPUTS["coco_gt"]
+    cat_set = set(cat_ids)
+    coco_results = [x for x in _FORKED_COCO_INPUTS["coco_results"] if x["category_id"] in cat_set]
+    coco_eval = _build_coco_eval(coco_gt, coco_results, iou_type, **kwargs)
+    coco_eval.params.catIds = cat_ids
+    with contextlib.redirect_stdout(io.StringIO()):
+        coco_eval.evaluate()
+        coco_eval.accumulate()
+    return {k: coco_eval.eval[k] for k in ["precision", "recall", "scores"]}
+
+
+def _evaluate_predictions_in_workers(coco_gt, coco_results, iou_types, num_workers, **kwargs):
+    """
+    Evaluate the coco results for several iou types in ``num_workers`` forked processes.
+    The precision and recall of a category do not depend on the other categories, so
+    the categories of each iou type are split into groups evaluated independently.
 
+    Args:
+        kwargs: the options of :func:`_evaluate_predictions_on_coco`.
 
-            ture_textrate_dict = compute_ptrate(image_id, evg_true_textarea, evg_true_totalarea)
-            pre_textrate_dict = compute_ptrate(image_id, evg_pre_textarea, evg_pre_totalarea)
+    Returns:
+        dict[str, COCOeval]: the summarized COCOeval of each iou type. Empty if processes
+            cannot be forked on this platform.
+    """
+    if "fork" not in mp.get_all_start_methods():
+        logging.getLogger(__name__).warning(
+            "[COCOEvaluator] Cannot fork evaluation workers, evaluating in this process."
+        )
+        return {}
 
-            evg_ture_score_dict = compt_score(ture_textrate_dict)
-            evg_pre_score_dict = compt_score(pre_textrate_dict)
+    cat_ids = sorted(coco_gt.getCatIds())
+    groups = [x.tolist() for x in np.array_split(cat_ids, min(num_workers, len(cat_ids)))]
+    _FORKED_COCO_INPUTS.update(coco_gt=coco_gt, coco_results=coco_results)
+    try:
+        with ProcessPoolExecutor(num_workers, mp_context=mp.get_context("fork")) as executor:
+            futures = {
+                iou_type: [
+                    executor.submit(_evaluate_categories_on_coco, iou_type, group, kwargs)
+                    for group in groups
+                ]
+                for iou_type in iou_types
+            }
+            results = {k: [f.result() for f in v] for k, v in futures.items()}
+    finally:
+        _FORKED_COCO_INPUTS.clear()
+
+    coco_evals = {}
+    for iou_type in iou_types:
+        coco_eval = _build_coco_eval(coco_gt, [], iou_type, **kwargs)
+        # the parameters normalized the way COCOeval.evaluate does
+        p = coco_eval.params
+        p.imgIds = list(np.unique(p.imgIds))
+        p.catIds = cat_ids
+        p.maxDets = sorted(p.maxDets)
+        # the category axis of precision and scores is [TxRxKxAxM], and of recall [TxKxAxM]
+        coco_eval.eval = {
+            "params": p,
+            "precision": np.concatenate([x["precision"] for x in results[iou_type]], axis=2),
+            "recall": np.concatenate([x["recall"] for x in results[iou_type]], axis=1),
+            "scores": np.concatenate([x["scores"] for x in results[iou_type]], axis=2),
+        }
+        coco_eval.eval["counts"] = list(coco_eval.eval["precision"].shape)
+        coco_eval.summarize()
+        coco_evals[iou_type] = coco_eval
+    return coco_evals
 
-            evg_ture_score = list(evg_ture_score_dict.values())[0]
-            evg_pre_score = list(evg_pre_score_dict.values())[0]
 
-            true_score_list.append(evg_ture_score)
-            pred_score_list.append(evg_pre_score)
+def _build_coco_eval(
+    coco_gt,
+    coco_results,
+    iou_type,
+    kpt_oks_sigmas=None,
+    use_fast_impl=True,
+    img_ids=None,
+    max_dets_per_image=None,
+):
+    """
+    Create the COCOeval object of the coco results, which may be empty.
+    """
+    if iou_type == "segm":
+        coco_results = copy.deepcopy(coco_results)
+        # When evaluating mask AP, if the results contain bbox, cocoapi will
+        # use the box area as the area of the instance, instead of the mask area.
+        # This leads to a different definition of small/medium/large.
+        # We remove the bbox field to let mask AP use mask area.
+        for c in coco_results:
+            c.pop("bbox", None)
 
-    true_scores = np.array(true_score_list)
-    pred_scores = np.array(pred_score_list)
-    # print("true_scores:", true_scores)
-    # print("pred_scores:", pred_scores)
-    rho, p = stats.spearmanr(pred_scores, true_scores)
-    mse = mean_squared_error(pred_scores, true_scores)
-    mae = mean_absolute_error(pred_scores, true_scores)
-    rmse = np.sqrt(mse)
-    result = EasyDict()
-    result.rho = rho
-    result.mae = mae
-    result.rmse = rmse
-    print(result)
+    if len(coco_results) > 0:
+        coco_dt = coco_gt.loadRes(coco_results)
+    else:
+        # loadRes cannot infer the type of empty results
+        coco_dt = COCO()
+        coco_dt.dataset = {"images": coco_gt.dataset["images"], "annotations": []}
+        coco_dt.dataset["categories"] = copy.deepcopy(coco_gt.dataset["categories"])
+        with contextlib.redirect_stdout(io.StringIO()):
+            coco_dt.createIndex()
+    coco_eval = (COCOeval_opt if use_fast_impl else COCOeval)(coco_gt, coco_dt, iou_type)
 
-    coco_dt = coco_gt.loadRes(coco_results)
-    coco_eval = (COCOeval_opt if use_fast_impl else COCOeval)(coco_gt, coco_dt, iou_type)  #iou_type:{bbox segm keypoints}
-    # print(coco_eval)
     # For COCO, the default max_dets_per_image is [1, 10, 100].
     if max_dets_per_image is None:
         max_dets_per_image = [1, 10, 100]  # Default from COCOEval
@@ -794,31 +1127,99 @@ def _evaluate_predictions_on_coco(
         if kpt_oks_sigmas:
             assert hasattr(coco_eval.params, "kpt_oks_sigmas"), "pycocotools is too old!"
             coco_eval.params.kpt_oks_sigmas = np.array(kpt_oks_sigmas)
-        # COCOAPI requires every detection and every gt to have keypoints, so
-        # we just take the first entry from both
-        num_keypoints_dt = len(coco_results[0]["keypoints"]) // 3
-        num_keypoints_gt = len(next(iter(coco_gt.anns.values()))["keypoints"]) // 3
-        num_keypoints_oks = len(coco_eval.params.kpt_oks_sigmas)
-        assert num_keypoints_oks == num_keypoints_dt == num_keypoints_gt, (
-            f"[COCOEvaluator] Prediction contain {num_keypoints_dt} keypoints. "
-            f"Ground truth contains {num_keypoints_gt} keypoints. "
-            f"The length of cfg.TEST.KEYPOINT_OKS_SIGMAS is {num_keypoints_oks}. "
-            "They have to agree with each other. For meaning of OKS, please refer to "
-            "http://cocodataset.org/#keypoints-eval."
-        )
+        if len(coco_results) > 0:
+            # COCOAPI requires every detection and every gt to have keypoints, so
+            # we just take the first entry from both
+            num_keypoints_dt = len(coco_results[0]["keypoints"]) // 3
+            num_keypoints_gt = len(next(iter(coco_gt.anns.values()))["keypoints"]) // 3
+            num_keypoints_oks = len(coco_eval.params.kpt_oks_sigmas)
+            assert num_keypoints_oks == num_keypoints_dt == num_keypoints_gt, (
+                f"[COCOEvaluator] Prediction contain {num_keypoints_dt} keypoints. "
+                f"Ground truth contains {num_keypoints_gt} keypoints. "
+                f"The length of cfg.TEST.KEYPOINT_OKS_SIGMAS is {num_keypoints_oks}. "
+                "They have to agree with each other. For meaning of OKS, please refer to "
+                "http://cocodataset.org/#keypoints-eval."
+            )
+    return coco_eval
 
-    coco_eval.evaluate()
-    coco_eval.accumulate()
-    coco_eval.summarize()
 
-    final_result={'COCOeval':coco_eval.stats.tolist(),
-                  'custom_metrics':{
-                      'rho':result.rho,
-                      'mae':result.mae,
-                      'rmse':result.rmse
-                  }}
+def _evaluate_images_on_coco(
+    coco_gt, coco_results, iou_type, img_ids, kpt_oks_sigmas=None, max_dets_per_image=None
+):
+    """
+    Match the coco results of some images to the ground truth, with the per-image evaluation
+    of the official COCOeval. The C++ per-image results of COCOeval_opt cannot be
+    inspected, so they cannot be merged with the results of other images.
+
+    Returns:
+        dict: maps (category id, area range index, image id) to the matches of the
+            detections of this image, category and area range, in the compact format
+            expected by COCOeval.accumulate. Combinations without any ground truth or
+            detection are omitted.
+    """
+    if len(img_ids) == 0:
+        return {}
+    coco_eval = _build_coco_eval(
+        coco_gt,
+        coco_results,
+        iou_type,
+        kpt_oks_sigmas=kpt_oks_sigmas,
+        use_fast_impl=False,
+        img_ids=img_ids,
+        max_dets_per_image=max_dets_per_image,
+    )
+    with contextlib.redirect_stdout(io.StringIO()):
+        coco_eval.evaluate()
+
+    p = coco_eval.params
+    cat_ids = p.catIds if p.useCats else [-1]
+    keys = itertools.product(cat_ids, range(len(p.areaRng)), p.imgIds)
+    # only what accumulate reads is kept, and the matched gt ids only matter as booleans
+    return {
+        key: {
+            "dtScores": e["dtScores"],
+            "dtMatches": e["dtMatches"] > 0,
+            "dtIgnore": e["dtIgnore"].astype(bool),
+            "gtIgnore": e["gtIgnore"].astype(bool),
+        }
+        for key, e in zip(keys, coco_eval.evalImgs)
+        if e is not None
+    }
+
+
+def _accumulate_images_on_coco(
+    coco_gt, eval_imgs, iou_type, img_ids, kpt_oks_sigmas=None, max_dets_per_image=None
+):
+    """
+    Accumulate and summarize the per-image results of :func:`_evaluate_images_on_coco`,
+    merged over disjoint sets of images.
+
+    Returns:
+        COCOeval: as if it had evaluated all the images at once.
+    """
+    coco_eval = _build_coco_eval(
+        coco_gt,
+        [],
+        iou_type,
+        kpt_oks_sigmas=kpt_oks_sigmas,
+        use_fast_impl=False,
+        img_ids=img_ids,
+        max_dets_per_image=max_dets_per_image,
+    )
+    # the parameters normalized the way COCOeval.evaluate does
+    p = coco_eval.params
+    p.imgIds = list(np.unique(p.imgIds))
+    if p.useCats:
+        p.catIds = list(np.unique(p.catIds))
+    p.maxDets = sorted(p.maxDets)
+    cat_ids = p.catIds if p.useCats else [-1]
+    keys = itertools.product(cat_ids, range(len(p.areaRng)), p.imgIds)
+    coco_eval.evalImgs = [eval_imgs.get(key) for key in keys]
+    coco_eval._paramsEval = copy.deepcopy(p)
 
-    return final_result
+    coco_eval.accumulate()
+    coco_eval.summarize()
+    return coco_eval
 
 
 class COCOevalMaxDets(COCOeval):
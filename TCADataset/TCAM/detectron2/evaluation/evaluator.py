@@ -1,5 +1,6 @@
 # Copyright (c) Facebook, Inc. and its affiliates.
 import datetime
+import inspect
 import logging
 import time
 from collections import OrderedDict, abc
@@ -100,6 +101,40 @@ class DatasetEvaluators(DatasetEvaluator):
         return results
 
 
+class ImageSubsetEvaluator(DatasetEvaluator):
+    """
+    Wrapper class to evaluate a :class:`DatasetEvaluator` on a subset of the images of its
+    dataset. The ids of the images are given to its ``evaluate(img_ids=...)``, if it
+    supports them like :class:`COCOEvaluator`, so that the other images are ignored.
+    """
+
+    def __init__(self, evaluator, img_ids):
+        """
+        Args:
+            evaluator (DatasetEvaluator): the evaluator to wrap. The evaluators combined by a
+                :class:`DatasetEvaluators` are wrapped individually.
+            img_ids (list[int]): the ids of the images.
+        """
+        super().__init__()
+        if isinstance(evaluator, DatasetEvaluators):
+            evaluator = DatasetEvaluators(
+                [ImageSubsetEvaluator(x, img_ids) for x in evaluator._evaluators]
+            )
+        self._evaluator = evaluator
+        self._img_ids = img_ids
+
+    def reset(self):
+        self._evaluator.reset()
+
+    def process(self, inputs, outputs):
+        self._evaluator.process(inputs, outputs)
+
+    def evaluate(self):
+        if "img_ids" in inspect.signature(self._evaluator.evaluate).parameters:
+            return self._evaluator.evaluate(img_ids=self._img_ids)
+        return self._evaluator.evaluate()
+
+
 def inference_on_dataset(
     model, data_loader, evaluator: Union[DatasetEvaluator, List[DatasetEvaluator], None]
 ):
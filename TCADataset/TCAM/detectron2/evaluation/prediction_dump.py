@@ -0,0 +1,240 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+"""
+A columnar format for the instance predictions of a dataset, in COCO's result format.
+
+A dump is a directory of shards, typically one per process. A shard is made of 3 files
+that are only appended to, so they can be written while the predictions are produced:
+
+* "<shard>.images.bin": one record per image, with its id, its size and the end of its
+  instances in the instance file.
+* "<shard>.instances.bin": one record per instance, with its box (in XYWH_ABS like COCO),
+  score, dataset category id and the end of its RLE counts in the counts file.
+* "<shard>.counts.bin": the compressed RLE counts of all masks, concatenated.
+
+Reading maps the instance and counts files in memory, so only the images that are
+accessed are read. Keypoints are not stored.
+"""
+import numpy as np
+import os
+from collections import OrderedDict
+
+from detectron2.utils.file_io import PathManager
+
+__all__ = ["PredictionDumpWriter", "PredictionDump", "coco_json_to_prediction_dump"]
+
+_IMAGE_DTYPE = np.dtype(
+    [("image_id", np.int64), ("height", np.int32), ("width", np.int32), ("end", np.int64)]
+)
+_INSTANCE_DTYPE = np.dtype(
+    [
+        ("bbox", np.float32, (4,)),
+        ("score", np.float32),
+        ("category_id", np.int32),
+        ("counts_end", np.int64),
+    ]
+)
+_SUFFIXES = ("images", "instances", "counts")
+
+
+def _shard_path(dirname, shard, suffix):
+    return os.path.join(dirname, f"{shard}.{suffix}.bin")
+
+
+class PredictionDumpWriter:
+    """
+    Append the predictions of images to a shard of a dump.
+    """
+
+    def __init__(self, dirname, shard="0"):
+        """
+        Args:
+            dirname (str): the directory of the dump.
+            shard (str): name of the shard. An existing shard of this name is overwritten.
+        """
+        PathManager.mkdirs(dirname)
+        self._files = {
+            k: PathManager.open(_shard_path(dirname, shard, k), "wb") for k in _SUFFIXES
+        }
+        self._num_instances = 0
+        self._num_bytes = 0
+
+    def append(self, image_id, image_size, coco_results):
+        """
+        Args:
+            image_id (int): id of the image.
+            image_size (tuple[int, int]): height and width of the image, the size of its RLEs.
+            coco_results (list[dict]): the predictions of the image in COCO's result format,
+                as returned by :func:`instances_to_coco_json`.
+        """
+        counts = [
+            x["segmentation"]["counts"] if "segmentation" in x else b"" for x in coco_results
+        ]
+        counts = [c.encode() if isinstance(c, str) else c for c in counts]
+        instances = np.empty(len(coco_results), dtype=_INSTANCE_DTYPE)
+        instances["bbox"] = np.asarray([x["bbox"] for x in coco_results]).reshape(-1, 4)
+        instances["score"] = [x["score"] for x in coco_results]
+        instances["category_id"] = [x["category_id"] for x in coco_results]
+        instances["counts_end"] = self._num_bytes + np.cumsum([len(c) for c in counts])
+
+        self._num_instances += len(coco_results)
+        self._num_bytes += sum(len(c) for c in counts)
+        image = np.array([(image_id, *image_size, self._num_instances)], dtype=_IMAGE_DTYPE)
+        self._files["counts"].write(b"".join(counts))
+        self._files["instances"].write(instances.tobytes())
+        self._files["images"].write(image.tobytes())
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _map_file(path, dtype):
+    path = PathManager.get_local_path(path)
+    if os.path.getsize(path) == 0:
+        # empty files cannot be mapped
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r")
+
+
+class PredictionDump:
+    """
+    Read the predictions of a dump written by :class:`PredictionDumpWriter`.
+    Images are indexed in the order of their shards, then in the order they were written.
+    """
+
+    def __init__(self, dirname):
+        """
+        Args:
+            dirname (str): the directory of the dump. All its shards are read.
+        """
+        suffix = ".images.bin"
+        shards = [f[: -len(suffix)] for f in PathManager.ls(dirname) if f.endswith(suffix)]
+        images, self._instances, self._counts = [], [], []
+        for shard in sorted(shards):
+            with PathManager.open(_shard_path(dirname, shard, "images"), "rb") as f:
+                images.append(np.frombuffer(f.read(), dtype=_IMAGE_DTYPE))
+            path = _shard_path(dirname, shard, "instances")
+            self._instances.append(_map_file(path, _INSTANCE_DTYPE))
+            self._counts.append(_map_file(_shard_path(dirname, shard, "counts"), np.uint8))
+
+        self._images = np.concatenate(images) if images else np.empty(0, dtype=_IMAGE_DTYPE)
+        self._shards = np.repeat(np.arange(len(images)), [len(x) for x in images])
+        # the instances of an image start where those of the previous image of its shard end
+        self._starts = np.concatenate(
+            [np.concatenate([[0], x["end"]])[:-1] for x in images] or [np.empty(0, np.int64)]
+        ).astype(np.int64)
+        self._index = None
+
+    def __len__(self):
+        return len(self._images)
+
+    @property
+    def image_ids(self):
+        """
+        ndarray: the int64 ids of the images.
+        """
+        return self._images["image_id"]
+
+    def index(self, image_id):
+        """
+        Returns:
+            int: the index of the image of this id, or None if it is not in the dump.
+        """
+        if self._index is None:
+            self._index = {k: i for i, k in enumerate(self.image_ids.tolist())}
+        return self._index.get(image_id)
+
+    def image(self, idx):
+        """
+        Returns:
+            dict: the predictions of the idx-th image, with keys "image_id", "height",
+                "width", "bbox" (float32 XYWH_ABS array of shape (N, 4)), "score", "category_id"
+                and "rles", the compressed RLEs of the masks (None for instances without one).
+        """
+        shard, start = self._shards[idx], self._starts[idx]
+        image = self._images[idx]
+        instances = self._instances[shard][start : image["end"]]
+        counts = self._counts[shard]
+
+        ends = instances["counts_end"].tolist()
+        begin = int(self._instances[shard][start - 1]["counts_end"]) if start > 0 else 0
+        blob = counts[begin : ends[-1]].tobytes() if ends else b""
+        size = [int(image["height"]), int(image["width"])]
+        rles = []
+        for a, b in zip([begin] + ends[:-1], ends):
+            rle = blob[a - begin : b - begin]
+            rles.append({"size": size, "counts": rle} if rle else None)
+        return {
+            "image_id": int(image["image_id"]),
+            "height": size[0],
+            "width": size[1],
+            "bbox": instances["bbox"],
+            "score": instances["score"],
+            "category_id": instances["category_id"],
+            "rles": rles,
+        }
+
+    def coco_results(self, idx):
+        """
+        Returns:
+            list[dict]: the predictions of the idx-th image in COCO's result format.
+        """
+        image = self.image(idx)
+        results = []
+        for bbox, score, category_id, rle in zip(
+            image["bbox"].tolist(),
+            image["score"].tolist(),
+            image["category_id"].tolist(),
+            image["rles"],
+        ):
+            result = {
+                "image_id": image["image_id"],
+                "category_id": category_id,
+                "bbox": bbox,
+                "score": score,
+            }
+            if rle is not None:
+                result["segmentation"] = {"size": rle["size"], "counts": rle["counts"].decode()}
+            results.append(result)
+        return results
+
+    def get(self, image_id):
+        """
+        Returns:
+            list[dict]: the predictions of the image of this id in COCO's result format.
+                Empty if the image is not in the dump.
+        """
+        idx = self.index(image_id)
+        return [] if idx is None else self.coco_results(idx)
+
+    def to_coco_json(self):
+        """
+        Returns:
+            list[dict]: all predictions in COCO's result format.
+        """
+        return [x for idx in range(len(self)) for x in self.coco_results(idx)]
+
+
+def coco_json_to_prediction_dump(coco_results, dirname):
+    """
+    Write predictions in COCO's result format to a dump of a single shard.
+    The size of an image is taken from its RLEs, and is 0 if it has none.
+
+    Args:
+        coco_results (list[dict]): the predictions, e.g. loaded from the
+            "coco_instances_results.json" of :class:`COCOEvaluator`.
+        dirname (str): the directory of the dump.
+    """
+    by_image = OrderedDict()
+    for result in coco_results:
+        by_image.setdefault(result["image_id"], []).append(result)
+    with PredictionDumpWriter(dirname) as writer:
+        for image_id, results in by_image.items():
+            sizes = [x["segmentation"]["size"] for x in results if "segmentation" in x]
+            writer.append(image_id, sizes[0] if sizes else (0, 0), results)
@@ -0,0 +1,74 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+"""
+Coverage statistics of the instances of an image, computed on COCO's run-length encoding.
+Masks are merged with the run arithmetic of pycocotools and never decoded to H x W arrays,
+so overlapping instances are counted once.
+"""
+import numpy as np
+import pycocotools.mask as mask_util
+
+__all__ = ["union_rle", "union_area", "rle_coverage"]
+
+
+def union_rle(rles):
+    """
+    Args:
+        rles (list[dict]): compressed COCO RLEs of the same size.
+
+    Returns:
+        dict: the RLE of the union of ``rles``. Its size is (0, 0) if ``rles`` is empty.
+    """
+    if len(rles) == 1:
+        return rles[0]
+    return mask_util.merge(rles, intersect=False)
+
+
+def union_area(rles):
+    """
+    Returns:
+        int: the number of pixels covered by any of ``rles``.
+    """
+    if len(rles) == 0:
+        return 0
+    return int(mask_util.area(union_rle(rles)))
+
+
+def rle_coverage(rles, labels, classes):
+    """
+    Compute the area covered by each class, by all instances, and by each pair of classes.
+
+    Args:
+        rles (list[dict]): compressed COCO RLEs of the instances of an image.
+        labels (list[int] or ndarray): the class of each instance.
+        classes (list[int]): the K classes to report.
+
+    Returns:
+        dict: with the following keys:
+
+        * "class_areas": int64 array of shape (K,), the union area of the instances of
+          each class.
+        * "union_area": int, the union area of all instances.
+        * "overlap": int64 array of shape (K, K), the area covered by both class i and
+          class j. Its diagonal is "class_areas".
+    """
+    labels = np.asarray(labels, dtype=np.int64).reshape(-1)
+    assert len(labels) == len(rles), f"Got {len(rles)} masks but {len(labels)} labels!"
+    classes = np.asarray(classes, dtype=np.int64).reshape(-1)
+
+    # group the instances by class with a single sort, then merge each group at once
+    order = np.argsort(labels, kind="stable")
+    bounds = np.searchsorted(labels[order], classes, side="left")
+    ends = np.searchsorted(labels[order], classes, side="right")
+    class_rles = [union_rle([rles[i] for i in order[s:e]]) for s, e in zip(bounds, ends)]
+    class_areas = np.array(
+        [mask_util.area(r) if s < e else 0 for r, s, e in zip(class_rles, bounds, ends)],
+        dtype=np.int64,
+    )
+
+    overlap = np.diag(class_areas)
+    present = np.nonzero(class_areas)[0]
+    for a, i in enumerate(present):
+        for j in present[a + 1 :]:
+            both = mask_util.merge([class_rles[i], class_rles[j]], intersect=True)
+            overlap[i, j] = overlap[j, i] = mask_util.area(both)
+    return {"class_areas": class_areas, "union_area": union_area(rles), "overlap": overlap}
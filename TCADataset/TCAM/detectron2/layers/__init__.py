@@ -1,7 +1,7 @@
 # Copyright (c) Facebook, Inc. and its affiliates.
 from .batch_norm import FrozenBatchNorm2d, get_norm, NaiveSyncBatchNorm
 from .deform_conv import DeformConv, ModulatedDeformConv
-from .mask_ops import paste_masks_in_image
+from .mask_ops import crops_to_rles, paste_masks_in_boxes, paste_masks_in_image
 from .nms import batched_nms, batched_nms_rotated, nms, nms_rotated
 from .roi_align import ROIAlign, roi_align
 from .roi_align_rotated import ROIAlignRotated, roi_align_rotated
@@ -18,6 +18,6 @@ from .wrappers import (
 )
 from .blocks import CNNBlockBase, DepthwiseSeparableConv2d
 from .aspp import ASPP
-from .boundary import get_instances_contour_interior
+from .boundary import get_instances_contour_interior, get_masks_contour_interior
 
 __all__ = [k for k in globals().keys() if not k.startswith("_")]
@@ -1,13 +1,14 @@
 # Copyright (c) Facebook, Inc. and its affiliates.
 import numpy as np
 from typing import Tuple
+import pycocotools.mask as mask_util
 import torch
 from PIL import Image
 from torch.nn import functional as F
 
 from detectron2.structures import Boxes
 
-__all__ = ["paste_masks_in_image"]
+__all__ = ["paste_masks_in_image", "paste_masks_in_boxes", "crops_to_rles"]
 
 
 BYTES_PER_FLOAT = 4
@@ -147,6 +148,130 @@ def paste_masks_in_image(
     return img_masks
 
 
+def _paste_masks_in_windows(masks, boxes, windows, crop_h: int, crop_w: int, threshold: float):
+    """
+    Paste masks in windows of size (crop_h, crop_w) at the top-left corner of ``windows``,
+    and clear the pixels outside of ``windows``.
+    """
+    N = masks.shape[0]
+    device = boxes.device
+    x0, y0, x1, y1 = torch.split(boxes, 1, dim=1)  # each is Nx1
+    img_y = windows[:, 1:2] + torch.arange(crop_h, device=device, dtype=torch.float32) + 0.5
+    img_x = windows[:, :1] + torch.arange(crop_w, device=device, dtype=torch.float32) + 0.5
+    img_y = (img_y - y0) / (y1 - y0) * 2 - 1
+    img_x = (img_x - x0) / (x1 - x0) * 2 - 1
+
+    gx = img_x[:, None, :].expand(N, crop_h, crop_w)
+    gy = img_y[:, :, None].expand(N, crop_h, crop_w)
+    grid = torch.stack([gx, gy], dim=3)
+    if not masks.dtype.is_floating_point:
+        masks = masks.float()
+    crops = F.grid_sample(masks[:, None], grid.to(masks.dtype), align_corners=False)[:, 0]
+    sizes = windows[:, 2:] - windows[:, :2]
+    inside_y = torch.arange(crop_h, device=device) < sizes[:, 1:]
+    inside_x = torch.arange(crop_w, device=device) < sizes[:, :1]
+    return (crops >= threshold) & inside_y[:, :, None] & inside_x[:, None, :]
+
+
+def paste_masks_in_boxes(
+    masks: torch.Tensor, boxes: Boxes, image_shape: Tuple[int, int], threshold: float = 0.5
+):
+    """
+    Paste a set of masks like :func:`paste_masks_in_image`, but paste each mask only in a
+    window around its box, which contains all of its foreground pixels. Together with
+    :func:`crops_to_rles`, this encodes the masks without building full-image masks.
+
+    Args:
+        masks, boxes, image_shape: see :func:`paste_masks_in_image`.
+        threshold (float): A threshold in [0, 1] for converting the (soft) masks to
+            binary masks.
+
+    Returns:
+        crops (Tensor): A bool tensor of shape (Bimg, Hcrop, Wcrop). The mask of instance i
+        within its window is at the top-left of crops[i], and is padded with False.
+        windows (Tensor): An int64 tensor of shape (Bimg, 4), the window (x0, y0, x1, y1)
+        of each instance in the image. Outside of its window, a mask is False.
+    """
+    assert masks.shape[-1] == masks.shape[-2], "Only square mask predictions are supported"
+    assert threshold >= 0, "Soft masks are not supported"
+    if not isinstance(boxes, torch.Tensor):
+        boxes = boxes.tensor
+    assert len(boxes) == len(masks), boxes.shape
+    N = len(masks)
+    img_h, img_w = image_shape
+
+    # the window that _do_paste_mask(skip_empty=True) pastes a single mask in
+    x0_int = torch.clamp(boxes[:, 0].floor() - 1, min=0)
+    y0_int = torch.clamp(boxes[:, 1].floor() - 1, min=0)
+    x1_int = torch.max(torch.clamp(boxes[:, 2].ceil() + 1, max=img_w), x0_int)
+    y1_int = torch.max(torch.clamp(boxes[:, 3].ceil() + 1, max=img_h), y0_int)
+    windows = torch.stack([x0_int, y0_int, x1_int, y1_int], dim=1).to(dtype=torch.int64)
+    sizes = windows[:, 2:] - windows[:, :2]
+    crop_w, crop_h = sizes.max(dim=0).values.tolist() if N > 0 else (0, 0)
+
+    crops = torch.zeros(N, crop_h, crop_w, dtype=torch.bool, device=boxes.device)
+    if N == 0:
+        return crops, windows
+    # As in paste_masks_in_image, CPU is most efficient when masks are pasted one by one,
+    # while GPU pastes all windows at once, padded to the largest one.
+    num_chunks = N if boxes.device.type == "cpu" else 1
+    for inds in torch.chunk(torch.arange(N, device=boxes.device), num_chunks):
+        chunk_w, chunk_h = sizes[inds].max(dim=0).values.tolist()
+        crops[inds, :chunk_h, :chunk_w] = _paste_masks_in_windows(
+            masks[inds], boxes[inds], windows[inds], chunk_h, chunk_w, threshold
+        )
+    return crops, windows
+
+
+def crops_to_rles(crops, windows, image_shape: Tuple[int, int]):
+    """
+    Encode masks given in windows of an image as full-image COCO RLEs, without pasting
+    them. COCO's RLE counts runs in column-major order, so the runs of each column of a
+    crop only need to be offset by the position of the column in the image.
+
+    Args:
+        crops (Tensor or ndarray): bool of shape (N, Hcrop, Wcrop), as returned by
+            :func:`paste_masks_in_boxes`.
+        windows (Tensor or ndarray): integers of shape (N, 4), the window (x0, y0, x1, y1)
+            of each crop in the image.
+        image_shape (tuple): height, width
+
+    Returns:
+        list[dict]: the compressed RLE of each mask, the same as ``pycocotools.mask.encode``
+        returns for the full-image mask.
+    """
+    crops = torch.as_tensor(crops)
+    windows = torch.as_tensor(windows, device=crops.device).to(dtype=torch.int64)
+    img_h, img_w = image_shape
+    N = len(crops)
+    if N == 0:
+        return []
+
+    # Pad each column with False at both ends. A change between rows r - 1 and r of a
+    # column is the start (False to True) or the end (True to False) of a run at row r.
+    # Only these positions leave the device of the crops.
+    columns = F.pad(crops.transpose(1, 2), (1, 1))
+    inst, col, row = torch.nonzero(columns[:, :, 1:] != columns[:, :, :-1], as_tuple=True)
+    pos = (windows[inst, 0] + col) * img_h + windows[inst, 1] + row
+    inst, pos = inst.cpu().numpy(), pos.cpu().numpy()
+    # A run that ends at the bottom of a column continues at the top of the next column.
+    joined = (pos[1:] == pos[:-1]) & (inst[1:] == inst[:-1])
+    keep = np.ones(len(pos), dtype=bool)
+    keep[1:][joined] = False
+    keep[:-1][joined] = False
+    inst, pos = inst[keep], pos[keep]
+
+    rles = []
+    for bounds in np.split(pos, np.searchsorted(inst, np.arange(1, N))):
+        counts = np.diff(bounds, prepend=0, append=img_h * img_w)
+        if len(bounds) > 0 and counts[-1] == 0:
+            # the last run ends at the last pixel
+            counts = counts[:-1]
+        rle = {"size": [img_h, img_w], "counts": counts.tolist()}
+        rles.append(mask_util.frPyObjects(rle, img_h, img_w))
+    return rles
+
+
 # The below are the original paste function (from Detectron1) which has
 # larger quantization error.
 # It is faster on CPU, while the aligned one is faster on GPU thanks to grid_sample.
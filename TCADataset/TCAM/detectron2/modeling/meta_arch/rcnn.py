@@ -12,7 +12,7 @@ from detectron2.utils.events import get_event_storage
 from detectron2.utils.logger import log_first_n
 
 from ..backbone import Backbone, build_backbone
-from ..postprocessing import detector_postprocess
+from ..postprocessing import detector_postprocess, mask_coverage
 from ..proposal_generator import build_proposal_generator
 from ..roi_heads import build_roi_heads
 from .build import META_ARCH_REGISTRY
@@ -40,6 +40,8 @@ class GeneralizedRCNN(nn.Module):
         pixel_std: Tuple[float],
         input_format: Optional[str] = None,
         vis_period: int = 0,
+        paste_masks: bool = True,
+        score_only: bool = False,
     ):
         """
         Args:
@@ -50,6 +52,12 @@ class GeneralizedRCNN(nn.Module):
                 the per-channel mean and std to be used to normalize the input image
             input_format: describe the meaning of channels of input. Needed by visualization
             vis_period: the period to run visualization. Set to 0 to disable.
+            paste_masks: whether to paste the predicted masks into full-image masks in the
+                outputs. See :func:`detector_postprocess`.
+            score_only: whether to only compute the areas covered by the predicted masks,
+                which is all the courseware score needs. The masks are then kept as
+                :class:`ROIMasks`, and the outputs also have the "mask_coverage" of
+                :func:`mask_coverage`.
         """
         super().__init__()
         self.backbone = backbone
@@ -58,6 +66,8 @@ class GeneralizedRCNN(nn.Module):
 
         self.input_format = input_format
         self.vis_period = vis_period
+        self.paste_masks = paste_masks
+        self.score_only = score_only
         if vis_period > 0:
             assert input_format is not None, "input_format is required for visualization!"
 
@@ -78,6 +88,8 @@ class GeneralizedRCNN(nn.Module):
             "vis_period": cfg.VIS_PERIOD,
             "pixel_mean": cfg.MODEL.PIXEL_MEAN,
             "pixel_std": cfg.MODEL.PIXEL_STD,
+            "paste_masks": cfg.TEST.PASTE_MASKS,
+            "score_only": cfg.TEST.SCORE_ONLY,
         }
 
     @property
@@ -214,7 +226,13 @@ class GeneralizedRCNN(nn.Module):
 
         if do_postprocess:
             assert not torch.jit.is_scripting(), "Scripting is not supported for postprocess."
-            return GeneralizedRCNN._postprocess(results, batched_inputs, images.image_sizes)
+            return GeneralizedRCNN._postprocess(
+                results,
+                batched_inputs,
+                images.image_sizes,
+                paste_masks=self.paste_masks and not self.score_only,
+                num_classes=self.roi_heads.num_classes if self.score_only else None,
+            )
         else:
             return results
 
@@ -228,9 +246,16 @@ class GeneralizedRCNN(nn.Module):
         return images
 
     @staticmethod
-    def _postprocess(instances, batched_inputs: List[Dict[str, torch.Tensor]], image_sizes):
+    def _postprocess(
+        instances,
+        batched_inputs: List[Dict[str, torch.Tensor]],
+        image_sizes,
+        paste_masks: bool = True,
+        num_classes: Optional[int] = None,
+    ):
         """
-        Rescale the output instances to the target size.
+        Rescale the output instances to the target size. If `num_classes` is given, also
+        compute the "mask_coverage" of the unpasted masks of each image.
         """
         # note: private function; subject to changes
         processed_results = []
@@ -239,8 +264,12 @@ class GeneralizedRCNN(nn.Module):
         ):
             height = input_per_image.get("height", image_size[0])
             width = input_per_image.get("width", image_size[1])
-            r = detector_postprocess(results_per_image, height, width)
-            processed_results.append({"instances": r})
+            r = detector_postprocess(results_per_image, height, width, paste_masks=paste_masks)
+            if num_classes is not None and r.has("pred_masks"):
+                coverage = mask_coverage(r, num_classes)
+                processed_results.append({"instances": r, "mask_coverage": coverage})
+            else:
+                processed_results.append({"instances": r})
         return processed_results
 
 
@@ -1,6 +1,6 @@
 # Copyright (c) Facebook, Inc. and its affiliates.
 import math
-from typing import List
+from typing import List, Optional
 import torch
 from torch import nn
 from torch.nn import functional as F
@@ -17,7 +17,7 @@ TODO: Correct these annotations when torchscript support `Union`.
 https://github.com/pytorch/pytorch/issues/41412
 """
 
-__all__ = ["ROIPooler"]
+__all__ = ["ROIPooler", "ROIRefineFeatures", "roi_align_bins"]
 
 
 def assign_boxes_to_levels(
@@ -97,6 +97,282 @@ def convert_boxes_to_pooler_format(box_lists: List[Boxes]):
 
     return pooler_fmt_boxes
 
+class ROIRefineFeatures:
+    """
+    High-resolution features of the boxes given to :class:`ROIPooler`, used to refine their
+    masks. They are pooled lazily, only for the boxes whose masks are refined.
+    The k-th resolution is pooled from the feature map k levels finer than the level
+    assigned to the box, or from the finest feature map.
+    """
+
+    def __init__(
+        self,
+        level_poolers: List[nn.ModuleList],
+        x: List[torch.Tensor],
+        pooler_fmt_boxes: torch.Tensor,
+        level_assignments: torch.Tensor,
+        semantic: Optional[nn.Module] = None,
+    ):
+        """
+        Args:
+            level_poolers (list[nn.ModuleList]): for each resolution, the pooler of each level.
+            x (list[Tensor]): the feature maps to pool from.
+            pooler_fmt_boxes (Tensor): (M, 5) boxes, see :func:`convert_boxes_to_pooler_format`.
+            level_assignments (Tensor): (M,) level of each box, see
+                :func:`assign_boxes_to_levels`.
+            semantic (nn.Module or None): a branch of stride-1 convolutions whose output is
+                added to the finest feature map before pooling from it. It is computed
+                lazily, and only around the boxes when their features are sampled.
+        """
+        self.level_poolers = level_poolers
+        self.x = x
+        self.pooler_fmt_boxes = pooler_fmt_boxes
+        self.level_assignments = level_assignments
+        self.semantic = semantic
+        # features of the finest level with the semantic branch, around each box
+        self._finest_crops = {}
+        self._crop_area = 0
+
+    def _full_feature_maps(self) -> List[torch.Tensor]:
+        if self.semantic is not None:
+            self.x = [self.x[0] + self.semantic(self.x[0])] + list(self.x[1:])
+            self.semantic = None
+        return self.x
+
+    def __len__(self):
+        return len(self.pooler_fmt_boxes)
+
+    def __call__(self, box_inds: torch.Tensor) -> List[torch.Tensor]:
+        """
+        Args:
+            box_inds (Tensor): indices of the boxes to pool the features of.
+
+        Returns:
+            list[Tensor]: for each resolution, a tensor of shape (len(box_inds), C, S, S),
+                where S is the output size of its poolers.
+        """
+        x = self._full_feature_maps()
+        pooler_fmt_boxes = self.pooler_fmt_boxes[box_inds]
+        level_assignments = self.level_assignments[box_inds]
+        num_channels = x[0].shape[1]
+        dtype, device = x[0].dtype, x[0].device
+
+        outputs = []
+        for level_poolers in self.level_poolers:
+            level_assignments = torch.clamp(level_assignments - 1, min=0)
+            output_size = level_poolers[0].output_size
+            output = torch.zeros(
+                (len(box_inds), num_channels) + tuple(output_size), dtype=dtype, device=device
+            )
+            for level, pooler in enumerate(level_poolers):
+                inds = nonzero_tuple(level_assignments == level)[0]
+                output.index_put_((inds,), pooler(x[level], pooler_fmt_boxes[inds]))
+            outputs.append(output)
+        return outputs
+
+    def sample(self, k: int, box_inds: torch.Tensor, bins: torch.Tensor) -> torch.Tensor:
+        """
+        Sample the features of the k-th resolution at some bins of the boxes. This is
+        the same as ``self(box_inds)[k]`` at these bins, but only the sampled bins are
+        computed.
+
+        Args:
+            k (int): index of the resolution.
+            box_inds (Tensor): (P,) index of the box of each bin.
+            bins (Tensor): (P, 2) row and column of each bin in the output of the resolution.
+
+        Returns:
+            Tensor: (P, C) features of the bins.
+        """
+        level_assignments = torch.clamp(self.level_assignments[box_inds] - (k + 1), min=0)
+        output = self.x[0].new_zeros((len(box_inds), self.x[0].shape[1]))
+        for level, pooler in enumerate(self.level_poolers[k]):
+            inds = nonzero_tuple(level_assignments == level)[0]
+            if len(inds) == 0:
+                continue
+            if level == 0 and self.semantic is not None:
+                output[inds] = self._sample_finest(pooler, box_inds[inds], bins[inds])
+                continue
+            output[inds] = roi_align_bins(
+                self.x[level],
+                self.pooler_fmt_boxes[box_inds[inds]],
+                bins[inds],
+                pooler.output_size,
+                pooler.spatial_scale,
+                pooler.sampling_ratio,
+                pooler.aligned,
+            )
+        return output
+
+    def _sample_finest(self, pooler: ROIAlign, box_inds: torch.Tensor, bins: torch.Tensor):
+        """
+        Sample bins from the finest feature map, computing the semantic branch only on
+        crops around the boxes. The crops are extended by the receptive field of the
+        branch, so the results are the same as computing it on the whole feature map.
+        """
+        x = self.x[0]
+        height, width = x.shape[-2:]
+        margin = sum(
+            m.dilation[0] * (m.kernel_size[0] // 2)
+            for m in self.semantic.modules()
+            if isinstance(m, nn.Conv2d)
+        )
+        offset = 0.5 if pooler.aligned else 0.0
+        boxes, point_boxes = torch.unique(box_inds, return_inverse=True)
+        windows = []
+        for box in (self.pooler_fmt_boxes[boxes] * pooler.spatial_scale - offset).tolist():
+            # rows and columns sampled by the bilinear interpolation of the box
+            y0 = min(max(math.floor(box[2]) - 1, 0), height - 1)
+            x0 = min(max(math.floor(box[1]) - 1, 0), width - 1)
+            y1 = min(max(math.ceil(max(box[4], box[2] + 1)) + 2, y0 + 1), height)
+            x1 = min(max(math.ceil(max(box[3], box[1] + 1)) + 2, x0 + 1), width)
+            windows.append((y0, y1, x0, x1))
+        crop_area = self._crop_area + sum(
+            (min(y1 + margin, height) - max(y0 - margin, 0))
+            * (min(x1 + margin, width) - max(x0 - margin, 0))
+            for box_ind, (y0, y1, x0, x1) in zip(boxes.tolist(), windows)
+            if box_ind not in self._finest_crops
+        )
+        if crop_area >= x.shape[0] * height * width:
+            # the crops are not cheaper than the whole feature map
+            rois = self.pooler_fmt_boxes[box_inds]
+            return roi_align_bins(
+                self._full_feature_maps()[0],
+                rois,
+                bins,
+                pooler.output_size,
+                pooler.spatial_scale,
+                pooler.sampling_ratio,
+                pooler.aligned,
+            )
+
+        self._crop_area = crop_area
+        output = x.new_zeros((len(box_inds), x.shape[1]))
+        for i, (box_ind, (y0, y1, x0, x1)) in enumerate(zip(boxes.tolist(), windows)):
+            if box_ind not in self._finest_crops:
+                image_ind = int(self.pooler_fmt_boxes[box_ind, 0])
+                ext_y0, ext_x0 = max(y0 - margin, 0), max(x0 - margin, 0)
+                ext_y1, ext_x1 = min(y1 + margin, height), min(x1 + margin, width)
+                crop = x[image_ind : image_ind + 1, :, ext_y0:ext_y1, ext_x0:ext_x1]
+                semantic = self.semantic(crop)[
+                    :, :, y0 - ext_y0 : y1 - ext_y0, x0 - ext_x0 : x1 - ext_x0
+                ]
+                crop = x[image_ind : image_ind + 1, :, y0:y1, x0:x1]
+                self._finest_crops[box_ind] = crop + semantic
+            inds = nonzero_tuple(point_boxes == i)[0]
+            rois = self.pooler_fmt_boxes[box_inds[inds]].clone()
+            rois[:, 0] = 0
+            rois[:, 1::2] -= x0 / pooler.spatial_scale
+            rois[:, 2::2] -= y0 / pooler.spatial_scale
+            output[inds] = roi_align_bins(
+                self._finest_crops[box_ind],
+                rois,
+                bins[inds],
+                pooler.output_size,
+                pooler.spatial_scale,
+                pooler.sampling_ratio,
+                pooler.aligned,
+            )
+        return output
+
+
+def _bilinear_interpolate(input: torch.Tensor, batch_inds, y, x):
+    """
+    Bilinear interpolation of NHWC `input` at points (y, x) of images `batch_inds`,
+    with the border handling of ROIAlign.
+    """
+    height, width = input.shape[1:3]
+    empty = (y < -1.0) | (y > height) | (x < -1.0) | (x > width)
+    y = y.clamp(min=0)
+    x = x.clamp(min=0)
+    y_low = y.long()
+    x_low = x.long()
+    y_border = y_low >= height - 1
+    x_border = x_low >= width - 1
+    y_low = torch.where(y_border, torch.full_like(y_low, height - 1), y_low)
+    x_low = torch.where(x_border, torch.full_like(x_low, width - 1), x_low)
+    y_high = torch.where(y_border, y_low, y_low + 1)
+    x_high = torch.where(x_border, x_low, x_low + 1)
+    y = torch.where(y_border, y_low.to(y.dtype), y)
+    x = torch.where(x_border, x_low.to(x.dtype), x)
+
+    ly = (y - y_low)[:, None]
+    lx = (x - x_low)[:, None]
+    hy = 1.0 - ly
+    hx = 1.0 - lx
+    value = (
+        hy * hx * input[batch_inds, y_low, x_low]
+        + hy * lx * input[batch_inds, y_low, x_high]
+        + ly * hx * input[batch_inds, y_high, x_low]
+        + ly * lx * input[batch_inds, y_high, x_high]
+    )
+    return value * (~empty)[:, None]
+
+
+def roi_align_bins(
+    input: torch.Tensor,
+    rois: torch.Tensor,
+    bins: torch.Tensor,
+    output_size,
+    spatial_scale: float,
+    sampling_ratio: int,
+    aligned: bool = True,
+):
+    """
+    Compute the output of :class:`ROIAlign` at one bin of each box, with point-wise
+    bilinear sampling instead of dense output grids.
+
+    Args:
+        input (Tensor): NCHW feature map.
+        rois (Tensor): (P, 5) boxes, in the format of :class:`ROIAlign`.
+        bins (Tensor): (P, 2) row and column of the bin of each box.
+        output_size, spatial_scale, sampling_ratio, aligned: see :class:`ROIAlign`.
+
+    Returns:
+        Tensor: (P, C), equal to ``ROIAlign(...)(input, rois)[arange(P), :, rows, cols]``.
+    """
+    if isinstance(output_size, int):
+        output_size = (output_size, output_size)
+    num_bins, num_channels = len(rois), input.shape[1]
+    if num_bins == 0:
+        return input.new_zeros((0, num_channels))
+
+    rois = rois.to(dtype=input.dtype)
+    offset = 0.5 if aligned else 0.0
+    start_w = rois[:, 1] * spatial_scale - offset
+    start_h = rois[:, 2] * spatial_scale - offset
+    roi_w = rois[:, 3] * spatial_scale - offset - start_w
+    roi_h = rois[:, 4] * spatial_scale - offset - start_h
+    if not aligned:
+        roi_w = roi_w.clamp(min=1.0)
+        roi_h = roi_h.clamp(min=1.0)
+    bin_h = roi_h / output_size[0]
+    bin_w = roi_w / output_size[1]
+    if sampling_ratio > 0:
+        grid_h = torch.full_like(bins[:, 0], sampling_ratio)
+        grid_w = torch.full_like(bins[:, 1], sampling_ratio)
+    else:
+        grid_h = torch.ceil(bin_h).long().clamp(min=0)
+        grid_w = torch.ceil(bin_w).long().clamp(min=0)
+    count = (grid_h * grid_w).clamp(min=1).to(input.dtype)
+
+    # NHWC so that the features of a point are contiguous
+    input = input.permute(0, 2, 3, 1)
+    batch_inds = rois[:, 0].long()
+    y0 = start_h + bins[:, 0] * bin_h
+    x0 = start_w + bins[:, 1] * bin_w
+    step_h = bin_h / grid_h.clamp(min=1)
+    step_w = bin_w / grid_w.clamp(min=1)
+    output = input.new_zeros((num_bins, num_channels))
+    for iy in range(int(grid_h.max())):
+        y = y0 + (iy + 0.5) * step_h
+        for ix in range(int(grid_w.max())):
+            x = x0 + (ix + 0.5) * step_w
+            valid = (iy < grid_h) & (ix < grid_w)
+            output = output + _bilinear_interpolate(input, batch_inds, y, x) * valid[:, None]
+    return output / count[:, None]
+
+
 def weights_init(m):
     if isinstance(m, nn.Conv2d):
         torch.nn.init.xavier_uniform_(m.weight)
@@ -115,6 +391,7 @@ class ROIPooler(nn.Module):
         pooler_type,
         canonical_box_size=224,
         canonical_level=4,
+        semantic_on_rois=True,
     ):
         """
         Args:
@@ -141,6 +418,9 @@ class ROIPooler(nn.Module):
                 Note that the actual input feature maps given to this module may not have
                 sufficiently many levels for the input boxes. If the boxes are too large or too
                 small for the input feature maps, the closest level will be used.
+            semantic_on_rois (bool): when the output size is larger than 7, whether to compute
+                the semantic branch in inference only around the boxes whose features are
+                sampled, instead of on the whole finest feature map. The results are the same.
         """
         super().__init__()
 
@@ -230,6 +510,7 @@ class ROIPooler(nn.Module):
         self.canonical_level = canonical_level
         assert canonical_box_size > 0
         self.canonical_box_size = canonical_box_size
+        self.semantic_on_rois = semantic_on_rois
     
     def forward(self, x: List[torch.Tensor], box_lists: List[Boxes]):
         """
@@ -245,6 +526,8 @@ class ROIPooler(nn.Module):
             Tensor:
                 A tensor of shape (M, C, output_size, output_size) where M is the total number of
                 boxes aggregated over all N batch images and C is the number of channels in `x`.
+                When the output size is larger than 7, a tuple of this tensor, a
+                :class:`ROIRefineFeatures` of the boxes and the output of the semantic branch.
         """
         num_level_assignments = len(self.level_poolers)
 
@@ -266,22 +549,6 @@ class ROIPooler(nn.Module):
         level_assignments = assign_boxes_to_levels(
             box_lists, self.min_level, self.max_level, self.canonical_box_size, self.canonical_level
         )
-        
-        if self.training:
-            LIMIT = 30 
-        else:
-            LIMIT = 10 
-            
-        if self.output_size[0] > 7:
-            level_assignments_d = level_assignments.clone()[:LIMIT]
-            level_assignments_d[level_assignments_d>=1] -=1
-            
-            level_assignments_d_l = level_assignments_d.clone()
-            level_assignments_d_l[level_assignments_d_l>=1] -=1
-            
-            level_assignments_d_l_l = level_assignments_d_l.clone()
-            level_assignments_d_l_l[level_assignments_d_l_l>=1] -=1
-
 
         num_boxes = pooler_fmt_boxes.size(0)
         num_channels = x[0].shape[1]
@@ -291,47 +558,29 @@ class ROIPooler(nn.Module):
         output = torch.zeros(
             (num_boxes, num_channels, output_size, output_size), dtype=dtype, device=device
         )
-        if self.output_size[0] > 7:
-            
-            if num_boxes > LIMIT:
-                num_boxes = LIMIT
 
-            output_d = torch.zeros(
-                (num_boxes, num_channels, output_size*2, output_size*2), dtype=dtype, device=device
-            )
-            output_d_l = torch.zeros(
-                (num_boxes, num_channels, output_size*2*2, output_size*2*2), dtype=dtype, device=device
-            )
-            output_d_l_l = torch.zeros(
-                (num_boxes, num_channels, output_size*2*2*2, output_size*2*2*2), dtype=dtype, device=device
-            )
-            
         for level, pooler in enumerate(self.level_poolers):
             inds = nonzero_tuple(level_assignments == level)[0]
             pooler_fmt_boxes_level = pooler_fmt_boxes[inds]
             output.index_put_((inds,), pooler(x[level], pooler_fmt_boxes_level))
 
         if self.output_size[0] > 7:
-            semantic_x1 = self.conv_norm_relus_semantic(x[0])
-            x[0] = x[0] + semantic_x1
-
-            pooler_fmt_boxes = pooler_fmt_boxes[:LIMIT]
-            for level, pooler in enumerate(self.level_poolers_d):
-                inds = nonzero_tuple(level_assignments_d == level)[0]
-                pooler_fmt_boxes_level = pooler_fmt_boxes[inds]
-                
-                output_d.index_put_((inds,), pooler(x[level], pooler_fmt_boxes_level))
-            
-            for level, pooler in enumerate(self.level_poolers_d_l):
-                inds = nonzero_tuple(level_assignments_d_l == level)[0]
-                pooler_fmt_boxes_level = pooler_fmt_boxes[inds]
-                output_d_l.index_put_((inds,), pooler(x[level], pooler_fmt_boxes_level))
-
-            for level, pooler in enumerate(self.level_poolers_d_l_l):
-                inds = nonzero_tuple(level_assignments_d_l_l == level)[0]
-                pooler_fmt_boxes_level = pooler_fmt_boxes[inds]
-                output_d_l_l.index_put_((inds,), pooler(x[level], pooler_fmt_boxes_level))
-
-            return output, output_d, output_d_l, output_d_l_l, semantic_x1
+            if self.training or not self.semantic_on_rois:
+                semantic_x1 = self.conv_norm_relus_semantic(x[0])
+                x = [x[0] + semantic_x1] + list(x[1:])
+                semantic = None
+            else:
+                # the output of the semantic branch is only used by the training loss
+                semantic_x1 = None
+                semantic = self.conv_norm_relus_semantic
+
+            refine_features = ROIRefineFeatures(
+                [self.level_poolers_d, self.level_poolers_d_l, self.level_poolers_d_l_l],
+                x,
+                pooler_fmt_boxes,
+                level_assignments,
+                semantic,
+            )
+            return output, refine_features, semantic_x1
 
         return output
@@ -1,4 +1,6 @@
 # Copyright (c) Facebook, Inc. and its affiliates.
+import numpy as np
+import pycocotools.mask as mask_util
 import torch
 from torch.nn import functional as F
 
@@ -7,7 +9,11 @@ from detectron2.structures import Instances, ROIMasks
 
 # perhaps should rename to "resize_instance"
 def detector_postprocess(
-    results: Instances, output_height: int, output_width: int, mask_threshold: float = 0.5
+    results: Instances,
+    output_height: int,
+    output_width: int,
+    mask_threshold: float = 0.5,
+    paste_masks: bool = True,
 ):
     """
     Resize the output instances.
@@ -23,6 +29,9 @@ def detector_postprocess(
             `results.image_size` contains the input image resolution the detector sees.
             This object might be modified in-place.
         output_height, output_width: the desired output resolution.
+        paste_masks (bool): whether to paste the "pred_masks" into full-image bitmasks.
+            If False, they are returned as :class:`ROIMasks` within the output boxes,
+            which e.g. :meth:`ROIMasks.to_rles` can encode without pasting them.
 
     Returns:
         Instances: the resized output from the model, based on the output resolution
@@ -68,9 +77,12 @@ def detector_postprocess(
             roi_masks = ROIMasks(results.pred_masks[:, 0, :, :])
         # print('output_height:', output_height)
         # print('output_width:', output_width)
-        results.pred_masks = roi_masks.to_bitmasks(
-            results.pred_boxes, output_height, output_width, mask_threshold
-        ).tensor  # TODO return ROIMasks/BitMask object in the future
+        if paste_masks:
+            results.pred_masks = roi_masks.to_bitmasks(
+                results.pred_boxes, output_height, output_width, mask_threshold
+            ).tensor  # TODO return ROIMasks/BitMask object in the future
+        else:
+            results.pred_masks = roi_masks
 
     if results.has("pred_keypoints"):
         results.pred_keypoints[:, :, 0] *= scale_x
@@ -79,6 +91,53 @@ def detector_postprocess(
     return results
 
 
+def mask_coverage(results: Instances, num_classes: int, mask_threshold: float = 0.5):
+    """
+    Compute the areas covered by the predicted masks of an image, without pasting them into
+    full-image masks. Each mask is only pasted in a window around its box, and the masks of
+    each class are merged on their COCO RLEs, so that overlapping pixels are counted once.
+    The "pred_mask_areas" and "pred_mask_rles" fields of ``results`` are set to the area and
+    the COCO RLE of each mask, so that e.g. the RLEs need not be encoded again.
+
+    Args:
+        results (Instances): the output of :func:`detector_postprocess` with
+            ``paste_masks=False``, whose "pred_masks" are :class:`ROIMasks`.
+        num_classes (int): number of classes of the predictions.
+        mask_threshold (float): see :func:`detector_postprocess`.
+
+    Returns:
+        dict: with the following keys:
+
+        * "class_rles": dict[int, dict], the RLE of the union of the masks of each predicted
+          class.
+        * "class_areas": int64 array of shape (num_classes,), the area of each union.
+        * "union_area": int, the area covered by any mask.
+    """
+    from detectron2.evaluation.rle_coverage import union_area, union_rle
+    from detectron2.layers import crops_to_rles
+
+    image_shape = results.image_size
+    crops, windows = results.pred_masks.to_crops(
+        results.pred_boxes.tensor, *image_shape, threshold=mask_threshold
+    )
+    results.pred_mask_areas = crops.sum(dim=(1, 2))
+    rles = crops_to_rles(crops, windows, image_shape)
+    results.pred_mask_rles = rles
+
+    classes = results.pred_classes.tolist()
+    class_rles = {
+        c: union_rle([rle for rle, k in zip(rles, classes) if k == c]) for c in sorted(set(classes))
+    }
+    class_areas = np.zeros(num_classes, dtype=np.int64)
+    for c, rle in class_rles.items():
+        class_areas[c] = mask_util.area(rle)
+    return {
+        "class_rles": class_rles,
+        "class_areas": class_areas,
+        "union_area": union_area(list(class_rles.values())),
+    }
+
+
 def sem_seg_postprocess(result, img_size, output_height, output_width):
     """
     Return semantic segmentation predictions in the original resolution.
@@ -1,5 +1,5 @@
 # Copyright (c) Facebook, Inc. and its affiliates.
-from typing import List
+from typing import List, Optional
 import fvcore.nn.weight_init as weight_init
 import torch
 from torch import nn
@@ -9,16 +9,17 @@ import numpy as np
 import copy
 import math
 
-from detectron2.layers import get_instances_contour_interior
+from detectron2.layers import get_masks_contour_interior
 from pytorch_toolbelt import losses as L
 
 from kornia.morphology import dilation
 from kornia.filters import blur_pool2d
 
 from detectron2.layers.roi_align import ROIAlign
+from detectron2.modeling.poolers import ROIRefineFeatures
 from detectron2.config import configurable
-from detectron2.layers import Conv2d, ConvTranspose2d, ShapeSpec, cat, get_norm
-from detectron2.structures import Instances
+from detectron2.layers import Conv2d, ConvTranspose2d, ShapeSpec, cat, get_norm, nonzero_tuple
+from detectron2.structures import CroppedBitMasks, Instances
 from detectron2.utils.events import get_event_storage
 from detectron2.utils.registry import Registry
 
@@ -145,8 +146,149 @@ def crop_and_resize_my(bit_masks, boxes: torch.Tensor, mask_size: int, sfact: in
     return output
 
 
+def _linear_source_indices(input_size: int, output_size: int, device: torch.device):
+    """
+    The two source indices and weights of each output index along one axis in
+    ``F.interpolate(mode="bilinear", align_corners=False)``.
+    """
+    if input_size == output_size:
+        index = torch.arange(output_size, device=device)
+        weight = torch.ones(output_size, device=device)
+        return index, index, weight, weight * 0
+    scale = torch.tensor(input_size, dtype=torch.float32) / output_size
+    src = ((torch.arange(output_size, dtype=torch.float32) + 0.5) * scale - 0.5).clamp(min=0)
+    index0 = src.long().clamp(max=input_size - 1)
+    index1 = (index0 + 1).clamp(max=input_size - 1)
+    weight1 = (src - index0).clamp(0, 1)
+    return index0.to(device), index1.to(device), (1 - weight1).to(device), weight1.to(device)
+
+
+def _window_starts(support_start, support_end, size, margin=0):
+    """
+    Place a window of a common length at every support [start, end) of an axis of length
+    ``size``. The windows stay inside the axis, and contain their support with ``margin``
+    zeros around it unless they are cut by the axis border.
+    """
+    length = min(int((support_end - support_start).max()) + 2 * margin, size)
+    starts = (support_start - margin).clamp(min=0).clamp(max=size - length)
+    return starts, length
+
+
+def _resample_windows(x, in_starts, indices, out_starts, out_length, dim):
+    """
+    Resample windows ``x`` of shape (M, A, B) along ``dim``, where window m starts at
+    ``in_starts[m]`` of the input axis and values outside the windows are zero.
+
+    Args:
+        indices: the output of :func:`_linear_source_indices` for the axis.
+        out_starts, out_length: the output windows.
+    """
+    pos = out_starts[:, None] + torch.arange(out_length, device=x.device)
+    pad_index = x.shape[dim]
+    x = F.pad(x, (0, 1) if dim == 2 else (0, 0, 0, 1))
+    output = 0
+    for src, weight in zip(indices[:2], indices[2:]):
+        local = src[pos] - in_starts[:, None]
+        local = torch.where((local >= 0) & (local < pad_index), local, pad_index)
+        if dim == 1:
+            local = local[:, :, None].expand(-1, -1, x.shape[2])
+            weight = weight[pos][:, :, None]
+        else:
+            local = local[:, None, :].expand(-1, x.shape[1], -1)
+            weight = weight[pos][:, None, :]
+        output = output + x.gather(dim, local) * weight
+    return output
+
+
+def get_incoherent_mask_cropped(bitmasks: CroppedBitMasks, sfact):
+    """
+    Compute :func:`get_incoherent_mask` of the full-image masks in ``bitmasks``, only
+    in a window around each mask. The incoherent mask is zero outside the windows,
+    which have a margin of zeros unless cut by the image border, so ROIAlign on a
+    window gives the same result as on the full-image incoherent mask.
+
+    Returns:
+        Tensor: (N, Hw, Ww), the incoherent mask of each instance in its window.
+        Tensor: (N, 2), the (x, y) position of each window in the incoherent mask of
+            size (H // sfact, W // sfact).
+    """
+    device = bitmasks.device
+    boxes = bitmasks.boxes[bitmasks.index]
+    mask = bitmasks.crops_to_tensor()[bitmasks.index].float()
+
+    # The windows of each step along an axis (dim 1 for y, 2 for x). A step is nonzero
+    # only at outputs whose source indices hit nonzero inputs.
+    windows = {}
+    for dim, size in ((1, bitmasks.image_size[0]), (2, bitmasks.image_size[1])):
+        down = _linear_source_indices(size, size // sfact, device)
+        up = _linear_source_indices(size // sfact, size, device)
+        crop_start = boxes[:, 2 - dim].contiguous()
+        crop_end = boxes[:, 4 - dim].contiguous()
+        start = torch.searchsorted(down[1], crop_start)
+        end = torch.searchsorted(down[0], crop_end)
+        small = _window_starts(start, end, size // sfact)
+        start = torch.minimum(torch.searchsorted(up[1], start), crop_start)
+        end = torch.maximum(torch.searchsorted(up[0], end), crop_end)
+        residue = _window_starts(start, end, size)
+        start = torch.searchsorted(down[1], start)
+        end = torch.searchsorted(down[0], end)
+        uncertain = _window_starts(start, end, size // sfact, margin=1)
+        windows[dim] = {
+            "mask": (crop_start, None),
+            "small": small,
+            "residue": residue,
+            "uncertain": uncertain,
+            "down": down,
+            "up": up,
+            "identity": _linear_source_indices(size, size, device),
+        }
+
+    def resample(x, src, dst, indices):
+        # resample along x before y, in the same order as F.interpolate
+        for dim in (2, 1):
+            w = windows[dim]
+            x = _resample_windows(x, w[src][0], w[indices], w[dst][0], w[dst][1], dim)
+        return x
+
+    mask_small = resample(mask, "mask", "small", "down")
+    mask_recover = resample(mask_small, "small", "residue", "up")
+    mask_residue = (resample(mask, "mask", "residue", "identity") - mask_recover).abs()
+    mask_uncertain = resample(mask_residue, "residue", "uncertain", "down")
+    mask_uncertain[mask_uncertain >= 0.01] = 1.0
+    window_starts = torch.stack([windows[2]["uncertain"][0], windows[1]["uncertain"][0]], 1)
+    return mask_uncertain, window_starts
+
+
+def crop_and_resize_incoherent(bitmasks: CroppedBitMasks, boxes, mask_size, sfact):
+    """
+    The same as ``crop_and_resize_my(get_incoherent_mask(masks), boxes, mask_size, sfact)``
+    of the full-image masks, computed from the crops. The incoherent mask of an object is
+    computed once for all boxes matched to it.
+
+    Returns:
+        Tensor: A bool tensor of shape (N, mask_size, mask_size).
+    """
+    assert len(boxes) == len(bitmasks), "{} != {}".format(len(boxes), len(bitmasks))
+    device = bitmasks.device
+    if len(boxes) == 0:
+        return torch.zeros(0, mask_size, mask_size, dtype=torch.bool, device=device)
+    used, inverse = torch.unique(bitmasks.index, return_inverse=True)
+    unique_masks = CroppedBitMasks(
+        bitmasks.data, bitmasks.offsets, bitmasks.boxes, bitmasks.image_size, used
+    )
+    mask_uncertain, window_starts = get_incoherent_mask_cropped(unique_masks, sfact)
+    boxes = boxes.to(device=device) / float(sfact) - window_starts[inverse].repeat(1, 2)
+    rois = torch.cat([inverse.to(dtype=boxes.dtype)[:, None], boxes], dim=1)  # Nx5
+    output = (
+        ROIAlign((mask_size, mask_size), 1.0, 0, aligned=True)
+        .forward(mask_uncertain[:, None, :, :], rois)
+        .squeeze(1)
+    )
+    return output >= 0.05
+
+
 @torch.jit.unused
-def mask_rcnn_loss(pred_mask_logits: torch.Tensor, pred_mask_logits_uncertain: torch.Tensor, pred_boundary_logits: torch.Tensor, x_hr: torch.Tensor, x_hr_l: torch.Tensor, x_hr_ll: torch.Tensor, x_c: torch.Tensor, x_p2_s: torch.Tensor, transfomer_encoder: torch.nn.Module, instances: List[Instances], vis_period: int = 0):
+def mask_rcnn_loss(pred_mask_logits: torch.Tensor, pred_mask_logits_uncertain: torch.Tensor, pred_boundary_logits: torch.Tensor, refine_features: ROIRefineFeatures, x_c: torch.Tensor, x_p2_s: torch.Tensor, transfomer_encoder: torch.nn.Module, instances: List[Instances], vis_period: int = 0, refine_inds: Optional[torch.Tensor] = None):
     """
     Compute the mask prediction loss defined in the Mask R-CNN paper.
 
@@ -160,6 +302,8 @@ def mask_rcnn_loss(pred_mask_logits: torch.Tensor, pred_mask_logits_uncertain: t
             correspondence with the pred_mask_logits. The ground-truth labels (class, box, mask,
             ...) associated with each instance are stored in fields.
         vis_period (int): the period (in steps) to dump visualization.
+        refine_features (ROIRefineFeatures): high-resolution features of the boxes.
+        refine_inds (Tensor or None): indices of the masks that are refined. All masks if None.
 
     Returns:
         mask_loss (Tensor): A scalar tensor containing the loss.
@@ -189,12 +333,21 @@ def mask_rcnn_loss(pred_mask_logits: torch.Tensor, pred_mask_logits_uncertain: t
                 dtype=torch.int64)
             gt_classes.append(gt_classes_per_image)
 
-        semantic_mask_s = F.interpolate((instances_per_image.gt_masks_bit.tensor.sum(0) >= 1).float().unsqueeze(0).unsqueeze(0), (x_p2_s[index:index+1].shape[-2], x_p2_s[index:index+1].shape[-1]))
+        sfact = 2
+        gt_masks_bit = instances_per_image.gt_masks_bit
+        if isinstance(gt_masks_bit, CroppedBitMasks):
+            # targets computed from the crops, without full-image masks
+            semantic_mask_s = gt_masks_bit.union_mask(x_p2_s.shape[-2:]).float()[None, None]
+            gt_masks_per_image_uncertain = crop_and_resize_incoherent(
+                gt_masks_bit, instances_per_image.proposal_boxes.tensor, mask_side_len, sfact
+            ).to(device=pred_mask_logits.device)
+        else:
+            semantic_mask_s = F.interpolate((gt_masks_bit.tensor.sum(0) >= 1).float().unsqueeze(0).unsqueeze(0), (x_p2_s[index:index+1].shape[-2], x_p2_s[index:index+1].shape[-1]))
+            mask_uncertain = get_incoherent_mask(gt_masks_bit.tensor.unsqueeze(1), sfact)
+            gt_masks_per_image_uncertain = crop_and_resize_my(mask_uncertain.squeeze(
+                1), instances_per_image.proposal_boxes.tensor, mask_side_len, sfact).to(device=pred_mask_logits.device)
         gt_semantic_mask_s.append(semantic_mask_s)
 
-        sfact = 2
-        mask_uncertain = get_incoherent_mask(
-            instances_per_image.gt_masks_bit.tensor.unsqueeze(1), sfact)
         gt_masks_per_image = instances_per_image.gt_masks.crop_and_resize(
             instances_per_image.proposal_boxes.tensor, mask_side_len
         ).to(device=pred_mask_logits.device)
@@ -210,18 +363,7 @@ def mask_rcnn_loss(pred_mask_logits: torch.Tensor, pred_mask_logits_uncertain: t
             instances_per_image.proposal_boxes.tensor, int(mask_side_len * 0.5)
         ).to(device=pred_mask_logits.device)
 
-        gt_masks_per_image_uncertain = crop_and_resize_my(mask_uncertain.squeeze(
-            1), instances_per_image.proposal_boxes.tensor, mask_side_len, sfact).to(device=pred_mask_logits.device)
-        
-        boundary_ls = []
-        for mask in gt_masks_per_image:
-            mask_b = mask.data.cpu().numpy()
-            boundary, inside_mask, weight = get_instances_contour_interior(mask_b)
-            boundary = torch.from_numpy(boundary).to(device=mask.device).unsqueeze(0)
-
-            boundary_ls.append(boundary)
-
-        gt_boundary.append(cat(boundary_ls, dim=0))
+        gt_boundary.append(get_masks_contour_interior(gt_masks_per_image)[0])
 
         gt_masks.append(gt_masks_per_image)
         gt_masks_s.append(gt_masks_per_image_s)
@@ -296,12 +438,13 @@ def mask_rcnn_loss(pred_mask_logits: torch.Tensor, pred_mask_logits_uncertain: t
         # pred_mask_logits_uncertain, gt_masks_uncertain, pred_mask_logits_uncertain.shape[0]) + F.binary_cross_entropy(pred_mask_logits_uncertain, gt_masks_uncertain, reduction="mean")
         pred_mask_logits_uncertain, gt_masks_uncertain, pred_mask_logits_uncertain.shape[0]) + F.binary_cross_entropy_with_logits(pred_mask_logits_uncertain, gt_masks_uncertain, reduction="mean")
 
-    LIMIT = 30  #
+    if refine_inds is None:
+        refine_inds = torch.arange(total_num_masks, device=pred_mask_logits.device)
 
-    pred_mask_logits_uncertain = pred_mask_logits_uncertain[:LIMIT] 
-    pred_mask_logits_uncertain_lg = pred_mask_logits_uncertain_lg[:LIMIT]
-    pred_mask_logits_uncertain_lg_l = pred_mask_logits_uncertain_lg_l[:LIMIT]
-    pred_mask_logits = pred_mask_logits[:LIMIT]
+    pred_mask_logits_uncertain = pred_mask_logits_uncertain[refine_inds]
+    pred_mask_logits_uncertain_lg = pred_mask_logits_uncertain_lg[refine_inds]
+    pred_mask_logits_uncertain_lg_l = pred_mask_logits_uncertain_lg_l[refine_inds]
+    pred_mask_logits = pred_mask_logits[refine_inds]
 
 
     mask_uncertain_bool = (pred_mask_logits_uncertain.detach() >= 0.125)
@@ -319,181 +462,221 @@ def mask_rcnn_loss(pred_mask_logits: torch.Tensor, pred_mask_logits_uncertain: t
     pred_mask_logits_bool_large_l = F.interpolate(
         pred_mask_logits_bool.float().unsqueeze(1), (112, 112), mode='bilinear').squeeze(1)
 
+    # sample SAMPLE_NUM uncertain points of each box at each resolution. The boxes with
+    # less than 10 uncertain points at any resolution are not refined.
+    SAMPLE_NUM = 150
+    num_boxes = pred_mask_logits.shape[0]
+    point_box_inds = torch.arange(num_boxes, device=pred_mask_logits.device).repeat_interleave(
+        SAMPLE_NUM
+    )
+    valid_box = torch.ones(num_boxes, dtype=torch.bool, device=pred_mask_logits.device)
+    uncertain_pos = []
+    uncertain_masks = (
+        mask_uncertain_bool, mask_uncertain_bool_lg.squeeze(1), mask_uncertain_bool_lg_l.squeeze(1)
+    )
+    for mask in uncertain_masks:
+        point_inds, num_points = sample_mask_points(mask, SAMPLE_NUM)
+        valid_box &= num_points >= 10
+        point_inds = point_inds.flatten()
+        uncertain_pos.append(
+            (point_box_inds, point_inds // mask.shape[-1], point_inds % mask.shape[-1])
+        )
+    points = sample_uncertain_points(
+        refine_features,
+        refine_inds,
+        uncertain_pos,
+        [mask_side_len, mask_side_len * 2, mask_side_len * 4],
+    )
 
-    uncertain_pos = torch.nonzero(
-        mask_uncertain_bool.squeeze(1), as_tuple=True)
-    uncertain_pos_lg = torch.nonzero(
-        mask_uncertain_bool_lg.squeeze(1), as_tuple=True)
-    uncertain_pos_lg_l = torch.nonzero(
-        mask_uncertain_bool_lg_l.squeeze(1), as_tuple=True)
-
-    x_hr = x_hr[:LIMIT]
-    x_hr_l = x_hr_l[:LIMIT]
-    x_hr_ll = x_hr_ll[:LIMIT]
-
-    uncertain_feats = x_hr.permute(0, 2, 3, 1)[uncertain_pos]
-    uncertain_feats_l = x_hr_l.permute(0, 2, 3, 1)[uncertain_pos_lg]
-    uncertain_feats_ll = x_hr_ll.permute(0, 2, 3, 1)[uncertain_pos_lg_l]
+    select_box_feats, select_box_feats_pos, select_gt_boxs_labels = [], [], []
+    for (feats, feats_pos), pos, gt, coarse_labels in zip(
+        points,
+        uncertain_pos,
+        (gt_masks[refine_inds], gt_masks_l[refine_inds], gt_masks_ll[refine_inds]),
+        (pred_mask_logits_bool, pred_mask_logits_bool_large, pred_mask_logits_bool_large_l),
+    ):
+        feats = torch.cat((feats, coarse_labels[pos].unsqueeze(-1)), dim=1)
+        select_box_feats.append(feats.view(num_boxes, SAMPLE_NUM, -1))
+        select_box_feats_pos.append(feats_pos.view(num_boxes, SAMPLE_NUM, -1))
+        select_gt_boxs_labels.append(gt[pos].view(num_boxes, SAMPLE_NUM))
+    select_box_feats = torch.cat(select_box_feats, dim=1)
+    select_box_feats_pos = torch.cat(select_box_feats_pos, dim=1)
+    select_gt_boxs_labels = torch.cat(select_gt_boxs_labels, dim=1)
+
+    gt_masks_s = gt_masks_s[refine_inds].flatten(1)
+    x_c_pos = pos_embed(x_c).flatten(2)[refine_inds]
+    x_c = x_c.flatten(2)[refine_inds]
+    x_c_cat = torch.cat((x_c, pred_mask_logits_bool_small.flatten(2)), dim=1)
+    num_tokens = x_c_cat.shape[2]
+
+    # the sequence of a box is its RoI tokens followed by its points; the points of
+    # the boxes that are not refined are masked out
+    select_box_feats_cat = torch.cat(
+        (x_c_cat, select_box_feats.permute(0, 2, 1)), dim=2).unsqueeze(-1)
+    select_box_feats_cat_pos = torch.cat(
+        (x_c_pos, select_box_feats_pos.permute(0, 2, 1)), dim=2).permute(2, 0, 1)
+    padding_mask = torch.zeros(
+        select_box_feats_cat.shape[0], select_box_feats_cat.shape[2], dtype=torch.bool,
+        device=select_box_feats_cat.device)
+    padding_mask[:, num_tokens:] = ~valid_box[:, None]
+    select_gt_boxs_labels = torch.cat((gt_masks_s, select_gt_boxs_labels), dim=1)
 
-    x_hr_pos = pos_embed(x_hr)
-    x_hr_pos_l = pos_embed(x_hr_l)
-    x_hr_pos_ll = pos_embed(x_hr_ll)
+    encoded_feats = transfomer_encoder(
+        select_box_feats_cat, select_box_feats_cat_pos, key_padding_mask=padding_mask
+    ).permute(1, 2, 0).unsqueeze(-1)
+    selected_pred = transfomer_encoder.conv_r1(
+        encoded_feats).squeeze(1).squeeze(-1)
 
-    uncertain_feats_pos = x_hr_pos.permute(0, 2, 3, 1)[uncertain_pos]
-    uncertain_feats_pos_l = x_hr_pos_l.permute(0, 2, 3, 1)[uncertain_pos_lg]
-    uncertain_feats_pos_ll = x_hr_pos_ll.permute(0, 2, 3, 1)[uncertain_pos_lg_l]
-    
-    gt_masks = gt_masks[:LIMIT]
-    gt_masks_l = gt_masks_l[:LIMIT]
-    gt_masks_ll = gt_masks_ll[:LIMIT]
+    # the loss of the refined boxes, or of the RoI tokens of all boxes if none is refined
+    refine_errors = (selected_pred - select_gt_boxs_labels).abs()
+    num_valid = valid_box.sum()
+    mask_loss_refine = torch.where(
+        num_valid > 0,
+        (refine_errors * valid_box[:, None]).sum()
+        / (num_valid * refine_errors.shape[1]).clamp(min=1),
+        refine_errors[:, :num_tokens].sum() / max(num_boxes * num_tokens, 1),
+    )
 
-    uncertain_labels = gt_masks[uncertain_pos].unsqueeze(-1)
-    uncertain_labels_l = gt_masks_l[uncertain_pos_lg].unsqueeze(-1)
-    uncertain_labels_ll = gt_masks_ll[uncertain_pos_lg_l].unsqueeze(-1)
+    return mask_loss, mask_loss_uncertain, mask_loss_refine, semantic_loss, bound_loss
 
-    pred_coarse_labels = pred_mask_logits_bool[uncertain_pos]
-    pred_coarse_labels_l = pred_mask_logits_bool_large[uncertain_pos_lg]
-    pred_coarse_labels_ll = pred_mask_logits_bool_large_l[uncertain_pos_lg_l]
+def select_refine_boxes(
+    num_boxes_per_image: List[int],
+    max_boxes_per_image: int,
+    priority: Optional[torch.Tensor] = None,
+    device=None,
+):
+    """
+    Select the boxes of each image whose masks are refined.
 
-    gt_masks_s = gt_masks_s[:LIMIT].flatten(1)
+    Args:
+        num_boxes_per_image (list[int]): the number of boxes of each image.
+        max_boxes_per_image (int): the maximum number of boxes selected in each image,
+            or -1 to select all boxes.
+        priority (Tensor or None): (M,) the priority of each box of all images. The boxes of
+            an image with the highest priorities are selected. If None, the first boxes
+            of each image are selected.
 
-    number_pts = [(uncertain_pos[0] == ci).sum().item()
-                  for ci in range(pred_mask_logits.shape[0])]
-    number_pts_l = [(uncertain_pos_lg[0] == ci).sum().item()
-                  for ci in range(pred_mask_logits.shape[0])]
-    number_pts_ll = [(uncertain_pos_lg_l[0] == ci).sum().item()
-                  for ci in range(pred_mask_logits.shape[0])]
+    Returns:
+        Tensor: sorted indices of the selected boxes among the boxes of all images.
+    """
+    if priority is not None:
+        device = priority.device
+    counts = torch.as_tensor(num_boxes_per_image, dtype=torch.int64, device=device)
+    num_boxes = int(counts.sum())
+    if max_boxes_per_image < 0:
+        return torch.arange(num_boxes, device=device)
+
+    image_inds = torch.repeat_interleave(torch.arange(len(counts), device=device), counts)
+    first = torch.cumsum(counts, dim=0) - counts
+    if priority is None:
+        rank = torch.arange(num_boxes, device=device) - first[image_inds]
+    else:
+        # sort by priority, then stably by image, to rank the boxes within each image
+        order = torch.sort(priority, descending=True, stable=True)[1]
+        order = order[torch.sort(image_inds[order], stable=True)[1]]
+        rank = torch.empty_like(order)
+        rank[order] = torch.arange(num_boxes, device=device) - first[image_inds[order]]
+    return nonzero_tuple(rank < max_boxes_per_image)[0]
 
 
-    number_pts = torch.cumsum(torch.tensor(number_pts), dim=0)
-    number_pts_l = torch.cumsum(torch.tensor(number_pts_l), dim=0)
-    number_pts_ll = torch.cumsum(torch.tensor(number_pts_ll), dim=0)
+def sample_mask_points(masks, num_points):
+    """
+    Sample `num_points` points of each mask uniformly without replacement, for all masks
+    at once: the points are the top-k of random keys, which are -1 outside of the mask.
+    For masks with less than `num_points` points, the random permutation of their
+    points is repeated.
 
-    SAMPLE_NUM = 150
-    uncertain_feats_box_list = []
-    uncertain_feats_box_list_pos = []
-    select_gt_box_list = []
-    select_coarse_labels_list = []
-
-    valid_box_pos = [True for i in range(len(number_pts))]
-
-    for box_i in range(len(number_pts)):
-        if box_i == 0:
-            uncertain_feats_s = uncertain_feats[0: number_pts[box_i]]
-            uncertain_feats_s_l = uncertain_feats_l[0: number_pts_l[box_i]]
-            uncertain_feats_s_ll = uncertain_feats_ll[0: number_pts_ll[box_i]]
-
-            uncertain_feats_pos_s = uncertain_feats_pos[0: number_pts[box_i]]
-            uncertain_feats_pos_s_l = uncertain_feats_pos_l[0: number_pts_l[box_i]]
-            uncertain_feats_pos_s_ll = uncertain_feats_pos_ll[0: number_pts_ll[box_i]]
-
-            uncertain_labels_s = uncertain_labels[0: number_pts[box_i]]
-            uncertain_labels_s_l = uncertain_labels_l[0: number_pts_l[box_i]]
-            uncertain_labels_s_ll = uncertain_labels_ll[0: number_pts_ll[box_i]]
-
-            pred_coarse_labels_s = pred_coarse_labels[0: number_pts[box_i]]
-            pred_coarse_labels_s_l = pred_coarse_labels_l[0: number_pts_l[box_i]]
-            pred_coarse_labels_s_ll = pred_coarse_labels_ll[0: number_pts_ll[box_i]]
-        else:
-            uncertain_feats_s = uncertain_feats[number_pts[box_i-1]:number_pts[box_i]]
-            uncertain_feats_s_l = uncertain_feats_l[number_pts_l[box_i-1]:number_pts_l[box_i]]
-            uncertain_feats_s_ll = uncertain_feats_ll[number_pts_ll[box_i-1]:number_pts_ll[box_i]]
+    Args:
+        masks (Tensor): (B, H, W) bool masks.
+        num_points (int): the number of points sampled from each mask.
 
-            uncertain_feats_pos_s = uncertain_feats_pos[number_pts[box_i-1]:number_pts[box_i]]
-            uncertain_feats_pos_s_l = uncertain_feats_pos_l[number_pts_l[box_i-1]:number_pts_l[box_i]]
-            uncertain_feats_pos_s_ll = uncertain_feats_pos_ll[number_pts_ll[box_i-1]:number_pts_ll[box_i]]
+    Returns:
+        Tensor: (B, num_points) indices of the points in the flattened masks. They are
+            meaningless for empty masks.
+        Tensor: (B,) the number of points of each mask.
+    """
+    masks = masks.flatten(1)
+    counts = masks.sum(dim=1)
+    keys = torch.rand(masks.shape, device=masks.device).masked_fill_(~masks, -1.0)
+    order = keys.topk(min(num_points, masks.shape[1]), dim=1)[1]
+    repeat_inds = torch.arange(num_points, device=masks.device) % counts.clamp(min=1)[:, None]
+    return torch.gather(order, 1, repeat_inds), counts
 
-            uncertain_labels_s = uncertain_labels[number_pts[box_i-1]:number_pts[box_i]]
-            uncertain_labels_s_l = uncertain_labels_l[number_pts_l[box_i-1]:number_pts_l[box_i]]
-            uncertain_labels_s_ll = uncertain_labels_ll[number_pts_ll[box_i-1]:number_pts_ll[box_i]]
 
-            pred_coarse_labels_s = pred_coarse_labels[number_pts[box_i-1]:number_pts[box_i]]
-            pred_coarse_labels_s_l = pred_coarse_labels_l[number_pts_l[box_i-1]:number_pts_l[box_i]]
-            pred_coarse_labels_s_ll = pred_coarse_labels_ll[number_pts_ll[box_i-1]:number_pts_ll[box_i]]
+def sample_uncertain_points(refine_features, refine_inds, uncertain_pos, sizes):
+    """
+    Sample the high-resolution features and the position embeddings of the uncertain
+    points of the refined boxes, without pooling dense high-resolution features.
 
+    Args:
+        refine_features (ROIRefineFeatures): high-resolution features of all boxes.
+        refine_inds (Tensor): (B,) indices of the refined boxes among all boxes.
+        uncertain_pos (list[tuple[Tensor]]): for each resolution, the (box, row, column)
+            indices of its uncertain points, where box is an index into `refine_inds`.
+        sizes (list[int]): the size of each resolution.
 
-        if uncertain_feats_s.size()[0] < 10 or uncertain_feats_s_l.size()[0] < 10 or uncertain_feats_s_ll.size()[0] < 10:
-            valid_box_pos[box_i] = False
-            continue
+    Returns:
+        list[tuple[Tensor, Tensor]]: for each resolution, the features (P, C) and position
+            embeddings (P, C) of its uncertain points.
+    """
+    points = []
+    for k, ((box_inds, rows, cols), size) in enumerate(zip(uncertain_pos, sizes)):
+        feats = refine_features.sample(
+            k, refine_inds[box_inds], torch.stack((rows, cols), dim=1)
+        )
+        feats_pos = pos_embed(feats.new_empty((1, feats.shape[1], size, size)))
+        points.append((feats, feats_pos[0].permute(1, 2, 0)[rows, cols]))
+    return points
 
-        rand_inx = torch.randperm(uncertain_feats_s.size()[0])
-        if len(rand_inx) < SAMPLE_NUM:
-            rand_inx = rand_inx.repeat(15)[:SAMPLE_NUM]
-        
-        rand_inx_l = torch.randperm(uncertain_feats_s_l.size()[0])
-        if len(rand_inx_l) < SAMPLE_NUM:
-            rand_inx_l = rand_inx_l.repeat(15)[:SAMPLE_NUM]
-        
-        rand_inx_ll = torch.randperm(uncertain_feats_s_ll.size()[0])
-        if len(rand_inx_ll) < SAMPLE_NUM:
-            rand_inx_ll = rand_inx_ll.repeat(15)[:SAMPLE_NUM]
-
-        uncertain_feats_s = uncertain_feats_s[rand_inx][:SAMPLE_NUM]
-        uncertain_feats_s_l = uncertain_feats_s_l[rand_inx_l][:SAMPLE_NUM]
-        uncertain_feats_s_ll = uncertain_feats_s_ll[rand_inx_ll][:SAMPLE_NUM]
-        uncertain_feats_s = torch.cat((uncertain_feats_s, uncertain_feats_s_l, uncertain_feats_s_ll), dim=0)
-
-        uncertain_feats_pos_s = uncertain_feats_pos_s[rand_inx][:SAMPLE_NUM]
-        uncertain_feats_pos_s_l = uncertain_feats_pos_s_l[rand_inx_l][:SAMPLE_NUM]
-        uncertain_feats_pos_s_ll = uncertain_feats_pos_s_ll[rand_inx_ll][:SAMPLE_NUM]
-        uncertain_feats_pos_s = torch.cat((uncertain_feats_pos_s, uncertain_feats_pos_s_l, uncertain_feats_pos_s_ll), dim=0)
-        
-        uncertain_labels_s = uncertain_labels_s[rand_inx][:SAMPLE_NUM]
-        uncertain_labels_s_l = uncertain_labels_s_l[rand_inx_l][:SAMPLE_NUM]
-        uncertain_labels_s_ll = uncertain_labels_s_ll[rand_inx_ll][:SAMPLE_NUM]
-        uncertain_labels_s = torch.cat((uncertain_labels_s, uncertain_labels_s_l, uncertain_labels_s_ll), dim=0)
-
-        pred_coarse_labels_s = pred_coarse_labels_s[rand_inx][:SAMPLE_NUM]
-        pred_coarse_labels_s_l = pred_coarse_labels_s_l[rand_inx_l][:SAMPLE_NUM]
-        pred_coarse_labels_s_ll = pred_coarse_labels_s_ll[rand_inx_ll][:SAMPLE_NUM]
-        pred_coarse_labels_s = torch.cat((pred_coarse_labels_s, pred_coarse_labels_s_l, pred_coarse_labels_s_ll), dim=0)
-
-        uncertain_feats_box_list.append(uncertain_feats_s)
-        uncertain_feats_box_list_pos.append(uncertain_feats_pos_s)
-        select_gt_box_list.append(uncertain_labels_s)
-        select_coarse_labels_list.append(pred_coarse_labels_s)
-
-    x_c_pos1 = pos_embed(x_c).flatten(2)[:LIMIT]
-    x_c_pos = x_c_pos1[valid_box_pos].permute(2, 0, 1)
-
-    x_c = x_c.flatten(2)[:LIMIT]
-
-    pred_mask_logits_bool_small = pred_mask_logits_bool_small.flatten(2)
-    x_c_cat = torch.cat((x_c, pred_mask_logits_bool_small), dim=1).unsqueeze(-1)
-
-    if len(uncertain_feats_box_list) == 0:
-        encoded_feats = transfomer_encoder(
-            x_c_cat, x_c_pos1.permute(2, 0, 1)).permute(1, 2, 0).unsqueeze(-1)
-        selected_pred = transfomer_encoder.conv_r1(
-            encoded_feats).squeeze(1).squeeze(-1)
-        
-        mask_loss_refine = F.l1_loss(selected_pred, gt_masks_s)
-        return mask_loss, mask_loss_uncertain, mask_loss_refine, semantic_loss, bound_loss
 
-    select_box_feats = torch.stack(uncertain_feats_box_list)
-    select_box_feats_pos = torch.stack(uncertain_feats_box_list_pos)
-    select_gt_boxs_labels = torch.stack(select_gt_box_list).squeeze(-1)
-    select_coarse_labels = torch.stack(select_coarse_labels_list).unsqueeze(-1)
-    select_box_feats_cat = torch.cat(
-        (select_box_feats, select_coarse_labels), dim=2)
+def refine_uncertain_points(encoder, box_feats, box_pos, points):
+    """
+    Predict the mask at the uncertain points of every box with the transformer encoder.
+    The sequence of a box is its RoI tokens followed by its points of all levels. The
+    sequences of all boxes are padded into one batch with a key padding mask, so the
+    encoder runs once for all boxes.
 
-    select_box_feats_cat = select_box_feats_cat.unsqueeze(
-        -1).permute(0, 2, 1, 3)
-    select_box_feats_pos = select_box_feats_pos.permute(1, 0, 2)
-    select_box_feats_cat_pos = torch.cat(
-        (x_c_pos, select_box_feats_pos), dim=0)
-    select_box_feats_cat = torch.cat(
-        (x_c_cat[valid_box_pos], select_box_feats_cat), dim=2)
-    select_gt_boxs_labels = torch.cat(
-        (gt_masks_s[valid_box_pos], select_gt_boxs_labels), dim=1)
+    Args:
+        encoder (TransformerEncoder):
+        box_feats (Tensor): (B, C + 1, T), features of the T RoI tokens of each box.
+        box_pos (Tensor): (B, C, T), position embeddings of the RoI tokens.
+        points (list[tuple]): for each level, a tuple of (box index (P,), features
+            (P, C + 1), position embeddings (P, C)) of its points. Points must be
+            sorted by box index, e.g. the output of ``torch.nonzero``.
 
-    encoded_feats = transfomer_encoder(
-        select_box_feats_cat, select_box_feats_cat_pos).permute(1, 2, 0).unsqueeze(-1)
-    selected_pred = transfomer_encoder.conv_r1(
-        encoded_feats).squeeze(1).squeeze(-1)
-    mask_loss_refine = F.l1_loss(selected_pred, select_gt_boxs_labels)
+    Returns:
+        list[Tensor]: for each level, the predictions of its points, of shape (P,).
+    """
+    num_boxes, _, num_tokens = box_feats.shape
+    device = box_feats.device
+    counts = [torch.bincount(inds, minlength=num_boxes) for inds, _, _ in points]
+    lengths = num_tokens + sum(counts)
+    max_length = int(lengths.max()) if num_boxes > 0 else num_tokens
+    if max_length == num_tokens:
+        return [box_feats.new_zeros((0,)) for _ in points]
+
+    src = box_feats.new_zeros((num_boxes, max_length, box_feats.shape[1]))
+    pos = box_pos.new_zeros((num_boxes, max_length, box_pos.shape[1]))
+    src[:, :num_tokens] = box_feats.transpose(1, 2)
+    pos[:, :num_tokens] = box_pos.transpose(1, 2)
+    # the position of each point in the sequence of its box
+    seq_inds = []
+    start = torch.full((num_boxes,), num_tokens, dtype=torch.int64, device=device)
+    for (inds, feats, feats_pos), count in zip(points, counts):
+        first = torch.cumsum(count, dim=0) - count
+        seq_inds_level = start[inds] + torch.arange(len(inds), device=device) - first[inds]
+        src[inds, seq_inds_level] = feats
+        pos[inds, seq_inds_level] = feats_pos
+        seq_inds.append(seq_inds_level)
+        start = start + count
+    padding_mask = torch.arange(max_length, device=device)[None, :] >= lengths[:, None]
+
+    encoded_feats = encoder(
+        src.permute(0, 2, 1).unsqueeze(-1), pos.permute(1, 0, 2), key_padding_mask=padding_mask
+    )
+    preds = encoder.conv_r1(encoded_feats.permute(1, 2, 0).unsqueeze(-1))[:, 0, :, 0]
+    return [preds[inds, seq_inds_level] for (inds, _, _), seq_inds_level in zip(points, seq_inds)]
 
-    return mask_loss, mask_loss_uncertain, mask_loss_refine, semantic_loss, bound_loss
 
 class BaseMaskRCNNHead(nn.Module):
     """
@@ -501,21 +684,44 @@ class BaseMaskRCNNHead(nn.Module):
     """
 
     @configurable
-    def __init__(self, *, loss_weight: float = 1.0, vis_period: int = 0):
+    def __init__(
+        self,
+        *,
+        loss_weight: float = 1.0,
+        vis_period: int = 0,
+        refine_boxes_per_image_train: int = 15,
+        refine_boxes_per_image_test: int = 10,
+        refine_order: str = "score",
+    ):
         """
         NOTE: this interface is experimental.
 
         Args:
             loss_weight (float): multiplier of the loss
             vis_period (int): visualization period
+            refine_boxes_per_image_train (int): maximum number of boxes per image whose masks
+                are refined in training, or -1 for all boxes.
+            refine_boxes_per_image_test (int): maximum number of boxes per image whose masks
+                are refined in inference, or -1 for all boxes.
+            refine_order (str): which boxes are refined in inference, the ones with the
+                highest "score", "area" or "uncertainty".
         """
         super().__init__()
         self.vis_period = vis_period
         self.loss_weight = loss_weight
+        self.refine_boxes_per_image_train = refine_boxes_per_image_train
+        self.refine_boxes_per_image_test = refine_boxes_per_image_test
+        assert refine_order in ["score", "area", "uncertainty"], refine_order
+        self.refine_order = refine_order
 
     @classmethod
     def from_config(cls, cfg, input_shape):
-        return {"vis_period": cfg.VIS_PERIOD}
+        return {
+            "vis_period": cfg.VIS_PERIOD,
+            "refine_boxes_per_image_train": cfg.MODEL.ROI_MASK_HEAD.REFINE.BOXES_PER_IMAGE_TRAIN,
+            "refine_boxes_per_image_test": cfg.MODEL.ROI_MASK_HEAD.REFINE.BOXES_PER_IMAGE_TEST,
+            "refine_order": cfg.MODEL.ROI_MASK_HEAD.REFINE.ORDER,
+        }
 
     def forward(self, x, instances: List[Instances]):
         """
@@ -531,15 +737,28 @@ class BaseMaskRCNNHead(nn.Module):
         Returns:
             A dict of losses in training. The predicted "instances" in inference.
         """
-        x, x_uncertain, x_bo, x_hr, x_hr_l, x_hr_ll, x_c, x_p2_s, encoder = self.layers(x)
+        x, x_uncertain, x_bo, refine_features, x_c, x_p2_s, encoder = self.layers(x)
+        num_boxes_per_image = [len(i) for i in instances]
 
         if self.training:
+            refine_inds = select_refine_boxes(
+                num_boxes_per_image, self.refine_boxes_per_image_train, device=x.device
+            )
             loss_masks, loss_mask_uncertains, loss_mask_refine, loss_semantic, loss_bound = mask_rcnn_loss(
-                x, x_uncertain, x_bo, x_hr, x_hr_l, x_hr_ll, x_c, x_p2_s, encoder, instances, self.vis_period)
+                x, x_uncertain, x_bo, refine_features, x_c, x_p2_s, encoder, instances, self.vis_period, refine_inds)
             return {"loss_mask": loss_masks * self.loss_weight, "loss_mask_uncertain": loss_mask_uncertains * self.loss_weight * 0.5, "loss_mask_refine": loss_mask_refine, "loss_semantic": loss_semantic, "loss_bound": loss_bound * 0.5}
         else:
-            LIMIT = 10
-            pred_mask_logits_uncertain = x_uncertain[:, 0][:LIMIT]
+            if self.refine_order == "score":
+                priority = cat([i.scores for i in instances])
+            elif self.refine_order == "area":
+                priority = cat([i.pred_boxes.area() for i in instances])
+            else:
+                priority = x_uncertain.flatten(1).mean(dim=1)
+            refine_inds = select_refine_boxes(
+                num_boxes_per_image, self.refine_boxes_per_image_test, priority
+            )
+
+            pred_mask_logits_uncertain = x_uncertain[:, 0][refine_inds]
             pred_mask_logits_uncertain_lg = F.interpolate(pred_mask_logits_uncertain.unsqueeze(1), (56, 56))
             pred_mask_logits_uncertain_lg_l = F.interpolate(pred_mask_logits_uncertain.unsqueeze(1), (112, 112))
             pred_mask_logits = x
@@ -547,152 +766,77 @@ class BaseMaskRCNNHead(nn.Module):
             num_masks = pred_mask_logits.shape[0]
             class_pred = cat([i.pred_classes for i in instances])
             indices = torch.arange(num_masks, device=class_pred.device)
-            x_c = x_c[:LIMIT]
+            x_c = x_c[refine_inds]
 
             mask_probs_pred = pred_mask_logits[indices, class_pred][:, None].sigmoid()
 
             
             mask_uncertain_bool = (pred_mask_logits_uncertain.detach() >= 1e-6) 
             mask_uncertain_bool_lg = (pred_mask_logits_uncertain_lg.detach() >= 0.125).squeeze(1) 
-            mask_uncertain_bool_lg_l = (pred_mask_logits_uncertain_lg_l.detach() >= 0.8).squeeze(1).cpu() 
+            mask_uncertain_bool_lg_l = (pred_mask_logits_uncertain_lg_l.detach() >= 0.8).squeeze(1)
 
             if mask_uncertain_bool_lg_l.shape[0] > 0 and self.vis_period == 100:
-                kernel = torch.ones(3, 3)
+                kernel = torch.ones(3, 3, device=mask_uncertain_bool_lg_l.device)
                 mask_uncertain_bool_lg_l = dilation(mask_uncertain_bool_lg_l.unsqueeze(1).float(), kernel).squeeze(1).bool()
        
             pred_mask_logits_bool_ori = F.interpolate(
                 mask_probs_pred.float(), (112, 112), mode='bilinear')
                 
-            pred_mask_logits_bool = mask_probs_pred[:LIMIT]
+            pred_mask_logits_bool = mask_probs_pred[refine_inds]
             pred_mask_logits_bool_small = F.interpolate(
                 pred_mask_logits_bool.float(), (14, 14), mode='bilinear')
             pred_mask_logits_bool_large = F.interpolate(
                 pred_mask_logits_bool.float(), (56, 56), mode='bilinear')
-            pred_mask_logits_bool_large_l = pred_mask_logits_bool_ori[:LIMIT]
+            pred_mask_logits_bool_large_l = pred_mask_logits_bool_ori[refine_inds]
 
             uncertain_pos = torch.nonzero(mask_uncertain_bool, as_tuple=True)
             uncertain_pos_lg = torch.nonzero(mask_uncertain_bool_lg, as_tuple=True)
             uncertain_pos_lg_l = torch.nonzero(mask_uncertain_bool_lg_l, as_tuple=True)
 
-            uncertain_feats = x_hr.permute(0, 2, 3, 1)[uncertain_pos]
-            uncertain_feats_lg = x_hr_l.permute(0, 2, 3, 1)[uncertain_pos_lg]
-            uncertain_feats_lg_l = x_hr_ll.permute(0, 2, 3, 1)[uncertain_pos_lg_l]
-            x_hr_pos = pos_embed(x_hr)
-            x_hr_pos_l = pos_embed(x_hr_l)
-            x_hr_pos_ll = pos_embed(x_hr_ll)
-            uncertain_feats_pos = x_hr_pos.permute(0, 2, 3, 1)[uncertain_pos]
-            uncertain_feats_pos_l = x_hr_pos_l.permute(0, 2, 3, 1)[uncertain_pos_lg]
-            uncertain_feats_pos_ll = x_hr_pos_ll.permute(0, 2, 3, 1)[uncertain_pos_lg_l]
+            (
+                (uncertain_feats, uncertain_feats_pos),
+                (uncertain_feats_lg, uncertain_feats_pos_l),
+                (uncertain_feats_lg_l, uncertain_feats_pos_ll),
+            ) = sample_uncertain_points(
+                refine_features,
+                refine_inds,
+                [uncertain_pos, uncertain_pos_lg, uncertain_pos_lg_l],
+                [28, 56, 112],
+            )
             pred_coarse_labels = pred_mask_logits_bool.squeeze(1)[uncertain_pos]
             pred_coarse_labels_large = pred_mask_logits_bool_large.squeeze(1)[uncertain_pos_lg]
             pred_coarse_labels_large_l = pred_mask_logits_bool_large_l.squeeze(1)[uncertain_pos_lg_l]
             
-            number_pts = [(uncertain_pos[0] == ci).sum().item() for ci in range(pred_mask_logits_bool.shape[0])]
-            number_pts = torch.cumsum(torch.tensor(number_pts), dim=0)
-
-            number_pts_l = [(uncertain_pos_lg[0] == ci).sum().item() for ci in range(pred_mask_logits_bool.shape[0])]
-            number_pts_l = torch.cumsum(torch.tensor(number_pts_l), dim=0)
-
-            number_pts_ll = [(uncertain_pos_lg_l[0] == ci).sum().item() for ci in range(pred_mask_logits_bool.shape[0])]
-            number_pts_ll = torch.cumsum(torch.tensor(number_pts_ll), dim=0)
-
-
-            selected_pred_list = []
-            selected_pred_list_hr = []
-            selected_pred_list_hr_l = []
-
-            for box_i in range(len(number_pts)):
-                if box_i == 0:
-                    uncertain_feats_s = uncertain_feats[0: number_pts[box_i]]
-                    uncertain_feats_s_l = uncertain_feats_lg[0: number_pts_l[box_i]]
-                    uncertain_feats_s_ll = uncertain_feats_lg_l[0: number_pts_ll[box_i]]
-
-                    uncertain_feats_pos_s = uncertain_feats_pos[0: number_pts[box_i]]
-                    uncertain_feats_pos_s_l = uncertain_feats_pos_l[0: number_pts_l[box_i]]
-                    uncertain_feats_pos_s_ll = uncertain_feats_pos_ll[0: number_pts_ll[box_i]]
-
-                    pred_coarse_labels_s = pred_coarse_labels[0: number_pts[box_i]]
-                    pred_coarse_labels_l = pred_coarse_labels_large[0: number_pts_l[box_i]]
-                    pred_coarse_labels_ll = pred_coarse_labels_large_l[0: number_pts_ll[box_i]]
-                else:
-                    uncertain_feats_s = uncertain_feats[number_pts[box_i-1]:number_pts[box_i]]
-                    uncertain_feats_s_l = uncertain_feats_lg[number_pts_l[box_i-1]:number_pts_l[box_i]]
-                    uncertain_feats_s_ll = uncertain_feats_lg_l[number_pts_ll[box_i-1]:number_pts_ll[box_i]]
-
-                    uncertain_feats_pos_s = uncertain_feats_pos[number_pts[box_i-1]:number_pts[box_i]]
-                    uncertain_feats_pos_s_l = uncertain_feats_pos_l[number_pts_l[box_i-1]:number_pts_l[box_i]]
-                    uncertain_feats_pos_s_ll = uncertain_feats_pos_ll[number_pts_ll[box_i-1]:number_pts_ll[box_i]]
-
-                    pred_coarse_labels_s = pred_coarse_labels[number_pts[box_i-1]:number_pts[box_i]]
-                    pred_coarse_labels_l = pred_coarse_labels_large[number_pts_l[box_i-1]:number_pts_l[box_i]]
-                    pred_coarse_labels_ll = pred_coarse_labels_large_l[number_pts_ll[box_i-1]:number_pts_ll[box_i]]
-                
-                low_num = uncertain_feats_s.shape[0]
-                mid_num = uncertain_feats_s_l.shape[0]
-
-                uncertain_feats_s = torch.cat((uncertain_feats_s, uncertain_feats_s_l, uncertain_feats_s_ll), dim=0)
-                uncertain_feats_pos_s = torch.cat((uncertain_feats_pos_s, uncertain_feats_pos_s_l, uncertain_feats_pos_s_ll), dim=0)
-                pred_coarse_labels_s = torch.cat((pred_coarse_labels_s, pred_coarse_labels_l, pred_coarse_labels_ll), dim=0)
-
-                x_c_pos_i = pos_embed(x_c).flatten(2)[box_i:box_i+1].permute(2, 0, 1)
-                x_c_i = x_c.flatten(2)[box_i:box_i+1]
-
-
-                pred_mask_logits_bool_small_i = pred_mask_logits_bool_small[box_i:box_i+1].flatten(2)
-                
-                x_c_cat_i = torch.cat((x_c_i, pred_mask_logits_bool_small_i), dim=1).unsqueeze(-1)
-                
-                select_box_feats = uncertain_feats_s.unsqueeze(0)
-                select_box_feats_pos = uncertain_feats_pos_s.unsqueeze(0)
-                select_coarse_labels = pred_coarse_labels_s.unsqueeze(0).unsqueeze(-1)
-                select_box_feats_cat = torch.cat((select_box_feats, select_coarse_labels), dim=2)
-                select_box_feats_cat = select_box_feats_cat.unsqueeze(-1).permute(0, 2, 1, 3)
-                select_box_feats_pos = select_box_feats_pos.permute(1, 0, 2)
-                select_box_feats_cat_pos = torch.cat((x_c_pos_i, select_box_feats_pos), dim=0)
-                select_box_feats_cat = torch.cat((x_c_cat_i, select_box_feats_cat), dim=2)
-
-                encoded_feats = encoder(select_box_feats_cat, select_box_feats_cat_pos).permute(1, 2, 0).unsqueeze(-1)
-                selected_pred_res = encoder.conv_r1(encoded_feats).flatten()
-                selected_pred = selected_pred_res[x_c_cat_i.shape[2]:x_c_cat_i.shape[2]+low_num]
-                selected_pred_hr = selected_pred_res[x_c_cat_i.shape[2]+low_num: x_c_cat_i.shape[2] + low_num + mid_num]
-                selected_pred_hr_l = selected_pred_res[x_c_cat_i.shape[2]+low_num + mid_num:]
-
-                selected_pred_list.append(selected_pred)
-                selected_pred_list_hr.append(selected_pred_hr)
-                selected_pred_list_hr_l.append(selected_pred_hr_l)
-                
-            select_num = 0
-            for sel_p in selected_pred_list:
-                select_num += sel_p.shape[0]
+            x_c_cat = torch.cat((x_c.flatten(2), pred_mask_logits_bool_small.flatten(2)), dim=1)
+            x_c_pos = pos_embed(x_c).flatten(2)
+            points = [
+                (pos[0], torch.cat((feats, labels[:, None]), dim=1), feats_pos)
+                for pos, feats, feats_pos, labels in (
+                    (uncertain_pos, uncertain_feats, uncertain_feats_pos, pred_coarse_labels),
+                    (uncertain_pos_lg, uncertain_feats_lg, uncertain_feats_pos_l, pred_coarse_labels_large),
+                    (uncertain_pos_lg_l, uncertain_feats_lg_l, uncertain_feats_pos_ll, pred_coarse_labels_large_l),
+                )
+            ]
+            selected_pred, selected_pred_hr, selected_pred_hr_l = refine_uncertain_points(
+                encoder, x_c_cat, x_c_pos, points
+            )
 
-            if select_num > 0: # switch for modification
-                selected_pred_list_cat = torch.cat(selected_pred_list)
-                pred_mask_logits_bool.squeeze(1)[uncertain_pos] = selected_pred_list_cat
-            
-            num_boxes_per_image = [len(i) for i in instances]
-        
-            select_num_hr = 0
-            for sel_p in selected_pred_list_hr:
-                select_num_hr += sel_p.shape[0]
+            if len(selected_pred) > 0: # switch for modification
+                pred_mask_logits_bool.squeeze(1)[uncertain_pos] = selected_pred
 
-            if select_num_hr > 0: 
+            if len(selected_pred_hr) > 0:
                 pred_mask_logits_bool = F.interpolate(pred_mask_logits_bool, (56, 56), mode='bilinear', align_corners=True)
-                selected_pred_list_cat_hr = torch.cat(selected_pred_list_hr)
-                pred_mask_logits_bool.squeeze(1)[uncertain_pos_lg] = selected_pred_list_cat_hr
-
-            select_num_hr_l = 0
-            for sel_p in selected_pred_list_hr_l:
-                select_num_hr_l += sel_p.shape[0]
+                pred_mask_logits_bool.squeeze(1)[uncertain_pos_lg] = selected_pred_hr
 
             pred_mask_logits_bool = F.interpolate(pred_mask_logits_bool, (112, 112), mode='bilinear', align_corners=True)
-            if select_num_hr_l > 0: 
-                selected_pred_list_cat_hr_l = torch.cat(selected_pred_list_hr_l)
-                pred_mask_logits_bool.squeeze(1)[uncertain_pos_lg_l] = selected_pred_list_cat_hr_l
+            if len(selected_pred_hr_l) > 0:
+                pred_mask_logits_bool.squeeze(1)[uncertain_pos_lg_l] = selected_pred_hr_l
             
             if pred_mask_logits_bool.shape[0] > 0 and self.vis_period == 100:
                 pred_mask_logits_bool = blur_pool2d(pred_mask_logits_bool, 7, stride=1)
 
-            pred_mask_logits_bool_ori[:LIMIT] = pred_mask_logits_bool
+            # the masks of the other boxes are the coarse masks, upsampled
+            pred_mask_logits_bool_ori[refine_inds] = pred_mask_logits_bool
             mask_probs_pred = pred_mask_logits_bool_ori.split(num_boxes_per_image, dim=0)
 
             for prob, ins in zip(mask_probs_pred, instances):
@@ -831,11 +975,8 @@ class MaskRCNNConvUpsampleHead(BaseMaskRCNNHead):
     def layers(self, x_list):
         x = x_list[0]
         x_c = x.clone() 
-        x_hr = x_list[1] 
-        x_hr_l = x_list[2] 
-        x_hr_ll = x_list[3] 
-    
-        x_p2_s = x_list[4] 
+        refine_features = x_list[1]
+        x_p2_s = x_list[2]
         B, C, H, W = x.size()
         x_uncertain = x.clone().detach() # whether to detach this one
 
@@ -861,7 +1002,7 @@ class MaskRCNNConvUpsampleHead(BaseMaskRCNNHead):
             x_bo = F.relu(self.deconv_bo(x_bo))
             bound = self.predictor_bo(x_bo)
 
-        return mask, mask_uncertain, bound, x_hr, x_hr_l, x_hr_ll, x_c, x_p2_s, self.encoder
+        return mask, mask_uncertain, bound, refine_features, x_c, x_p2_s, self.encoder
 
 
 def build_mask_head(cfg, input_shape):
@@ -908,10 +1049,12 @@ class TransformerEncoderLayer(nn.Module):
     def with_pos_embed(self, tensor, pos):
         return tensor if pos is None else tensor + pos
 
-    def forward(self, src, pos):
+    def forward(self, src, pos, key_padding_mask=None):
         q = k = self.with_pos_embed(src, pos)
         # q = k = src
-        src2 = self.self_attn(q, k, value=src)[0]
+        src2 = self.self_attn(
+            q, k, value=src, key_padding_mask=key_padding_mask, need_weights=False
+        )[0]
         src = src + self.dropout1(src2)
         src = self.norm1(src)
         src2 = self.linear2(self.dropout(self.activation(self.linear1(src))))
@@ -939,12 +1082,12 @@ class TransformerEncoder(nn.Module):
             if p.dim() > 1:
                 nn.init.xavier_uniform_(p)
 
-    def forward(self, src, pos=None):
+    def forward(self, src, pos=None, key_padding_mask=None):
         src = self.conv_fuse(src).squeeze(-1)
         src = src.permute(2, 0, 1)
         output = src
         for layer in self.layers:
-            output = layer(output, pos)
+            output = layer(output, pos, key_padding_mask=key_padding_mask)
 
         if self.norm is not None:
             output = self.norm(output)
@@ -672,8 +672,8 @@ class StandardROIHeads(ROIHeads):
                 output_size=pooler_resolution,
                 scales=pooler_scales,
                 sampling_ratio=sampling_ratio,
-                pooler_type=pooler_type
-                # is_training=self.training
+                pooler_type=pooler_type,
+                semantic_on_rois=cfg.MODEL.ROI_MASK_HEAD.REFINE.SEMANTIC_ON_ROIS,
             )
             if pooler_type
             else None
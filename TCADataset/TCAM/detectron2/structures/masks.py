@@ -2,10 +2,11 @@
 import copy
 import itertools
 import numpy as np
-from typing import Any, Iterator, List, Union
+from typing import Any, Iterator, List, Optional, Tuple, Union
 import pycocotools.mask as mask_util
 import torch
 from torch import device
+from torch.nn import functional as F
 
 from detectron2.layers.roi_align import ROIAlign
 from detectron2.utils.memory import retry_if_cuda_oom
@@ -514,8 +515,16 @@ class ROIMasks:
     @torch.jit.unused
     def to_bitmasks(self, boxes: torch.Tensor, height, width, threshold=0.5):
         """
+        Paste the masks into full-image bitmasks.
+
         Args:
+            boxes (Tensor): Nx4, the ROI box of each mask in the image, in XYXY_ABS format.
+            height, width (int): the size of the image.
+            threshold (float): a threshold in [0, 1] for converting the soft masks to
+                binary masks.
 
+        Returns:
+            BitMasks: the N x height x width bitmasks.
         """
         from detectron2.layers import paste_masks_in_image
 
@@ -527,3 +536,274 @@ class ROIMasks:
             threshold=threshold,
         )
         return BitMasks(bitmasks)
+
+    @torch.jit.unused
+    def to_rles(self, boxes: torch.Tensor, height, width, threshold=0.5) -> List[dict]:
+        """
+        Encode the masks pasted in the boxes as full-image COCO RLEs, without building
+        full-image bitmasks.
+
+        Args:
+            boxes, height, width, threshold: see :meth:`to_bitmasks`.
+
+        Returns:
+            list[dict]: the same as ``pycocotools.mask.encode`` returns for the bitmasks
+            of :meth:`to_bitmasks`.
+        """
+        from detectron2.layers import crops_to_rles
+
+        crops, windows = self.to_crops(boxes, height, width, threshold)
+        return crops_to_rles(crops, windows, (height, width))
+
+    @torch.jit.unused
+    def to_crops(self, boxes: torch.Tensor, height, width, threshold=0.5):
+        """
+        Paste the masks only in a window around their boxes, as the bitmasks of
+        :meth:`to_bitmasks` would have them.
+
+        Args:
+            boxes, height, width, threshold: see :meth:`to_bitmasks`.
+
+        Returns:
+            Tensor, Tensor: the crops and windows of the masks, see
+            :func:`detectron2.layers.paste_masks_in_boxes`.
+        """
+        from detectron2.layers import paste_masks_in_boxes
+
+        return retry_if_cuda_oom(paste_masks_in_boxes)(
+            self.tensor, boxes.to(self.device), (height, width), threshold=threshold
+        )
+
+
+class CroppedBitMasks:
+    """
+    This class stores the bitmasks of all objects in one image, each cropped to the
+    tight box around its foreground pixels. It represents the same masks as a
+    :class:`BitMasks` of shape (N, H, W), with far less memory when objects are small.
+
+    The crops are stored once, in a flat bool tensor. Indexing only selects crops,
+    so the many proposals matched to the same object share its crop.
+
+    Attributes:
+        data: flat bool Tensor, the concatenation of all crops in row-major order.
+        offsets: int64 Tensor of M + 1 elements, where crop m is
+            ``data[offsets[m]:offsets[m + 1]]``.
+        boxes: int64 Tensor of shape (M, 4), the crop box (x0, y0, x1, y1) of each crop.
+        image_size: (H, W), the size of the full-image masks.
+        index: int64 Tensor of N elements, the crop of each instance.
+    """
+
+    def __init__(
+        self,
+        data: torch.Tensor,
+        offsets: torch.Tensor,
+        boxes: torch.Tensor,
+        image_size: Tuple[int, int],
+        index: Optional[torch.Tensor] = None,
+    ):
+        """
+        Args:
+            data, offsets, boxes, image_size: see the attributes.
+            index: the crop of each instance. Defaults to all crops, in order.
+        """
+        assert offsets.shape == (len(boxes) + 1,), (offsets.shape, boxes.shape)
+        self.data = data
+        self.offsets = offsets
+        self.boxes = boxes
+        self.image_size = tuple(image_size)
+        if index is None:
+            index = torch.arange(len(boxes), device=boxes.device)
+        self.index = index
+
+    @staticmethod
+    def from_segmentations(
+        segmentations: List[Union[List[np.ndarray], dict, np.ndarray]], height: int, width: int
+    ) -> "CroppedBitMasks":
+        """
+        Args:
+            segmentations (list): the segmentation of each instance, as polygons
+                (list[ndarray]), COCO-style RLE (dict) or a HxW binary mask (ndarray).
+            height, width (int): the image size.
+        """
+        crops, boxes = [], []
+        for segm in segmentations:
+            if isinstance(segm, list):
+                # Polygons rasterized in a smaller image that is only clipped at the
+                # bottom and right are identical to the full-image rasterization.
+                coords = np.concatenate([np.asarray(p).reshape(-1, 2) for p in segm])
+                x1 = int(min(max(np.ceil(coords[:, 0].max()) + 2, 0), width))
+                y1 = int(min(max(np.ceil(coords[:, 1].max()) + 2, 0), height))
+                mask = (
+                    polygons_to_bitmask(segm, y1, x1)
+                    if x1 > 0 and y1 > 0
+                    else np.zeros((0, 0), dtype=np.bool_)
+                )
+            elif isinstance(segm, dict):
+                mask = mask_util.decode(segm).astype(np.bool_)
+            elif isinstance(segm, np.ndarray):
+                assert segm.ndim == 2, "Expect segmentation of 2 dimensions, got {}.".format(
+                    segm.ndim
+                )
+                mask = segm.astype(np.bool_)
+            else:
+                raise ValueError(
+                    "Cannot convert segmentation of type '{}' to CroppedBitMasks!"
+                    "Supported types are: polygons as list[list[float] or ndarray],"
+                    " COCO-style RLE as a dict, or a binary segmentation mask "
+                    " in a 2D numpy array of shape HxW.".format(type(segm))
+                )
+            ys, xs = np.nonzero(mask)
+            if len(ys) == 0:
+                boxes.append([0, 0, 0, 0])
+                crops.append(np.zeros((0,), dtype=np.bool_))
+                continue
+            x0, y0, x1, y1 = xs.min(), ys.min(), xs.max() + 1, ys.max() + 1
+            boxes.append([x0, y0, x1, y1])
+            crops.append(mask[y0:y1, x0:x1].ravel())
+
+        sizes = [len(c) for c in crops]
+        return CroppedBitMasks(
+            torch.from_numpy(np.concatenate(crops) if crops else np.zeros((0,), np.bool_)),
+            torch.from_numpy(np.cumsum([0] + sizes, dtype=np.int64)),
+            torch.as_tensor(np.asarray(boxes, dtype=np.int64).reshape(-1, 4)),
+            (height, width),
+        )
+
+    @torch.jit.unused
+    def to(self, *args: Any, **kwargs: Any) -> "CroppedBitMasks":
+        return CroppedBitMasks(
+            self.data.to(*args, **kwargs),
+            self.offsets.to(*args, **kwargs),
+            self.boxes.to(*args, **kwargs),
+            self.image_size,
+            self.index.to(*args, **kwargs),
+        )
+
+    @property
+    def device(self) -> torch.device:
+        return self.data.device
+
+    @torch.jit.unused
+    def __getitem__(self, item: Union[int, slice, torch.Tensor]) -> "CroppedBitMasks":
+        """
+        Returns:
+            CroppedBitMasks: Create a new :class:`CroppedBitMasks` by indexing, which
+            shares the crops with this object.
+
+        The following usage are allowed:
+
+        1. `new_masks = masks[3]`: return a `CroppedBitMasks` which contains only one mask.
+        2. `new_masks = masks[2:10]`: return a slice of masks.
+        3. `new_masks = masks[vector]`, where vector is a torch.BoolTensor
+           with `length = len(masks)`, or an integer tensor of indices.
+        """
+        if isinstance(item, int):
+            index = self.index[item].view(1)
+        else:
+            index = self.index[item]
+        return CroppedBitMasks(self.data, self.offsets, self.boxes, self.image_size, index)
+
+    @torch.jit.unused
+    def __repr__(self) -> str:
+        s = self.__class__.__name__ + "("
+        s += "num_instances={}, num_crops={})".format(len(self), len(self.boxes))
+        return s
+
+    def __len__(self) -> int:
+        return self.index.shape[0]
+
+    def nonempty(self) -> torch.Tensor:
+        """
+        Find masks that are non-empty.
+
+        Returns:
+            Tensor: a BoolTensor which represents
+                whether each mask is empty (False) or non-empty (True).
+        """
+        return (self.offsets[1:] > self.offsets[:-1])[self.index]
+
+    def get_bounding_boxes(self) -> Boxes:
+        """
+        Returns:
+            Boxes: tight bounding boxes around bitmasks.
+            If a mask is empty, it's bounding box will be all zero.
+        """
+        return Boxes(self.boxes[self.index].to(dtype=torch.float32))
+
+    def crops_to_tensor(self) -> torch.Tensor:
+        """
+        Returns:
+            Tensor: a bool tensor of shape (M, Hc, Wc), all crops padded at the bottom
+            and right to the same size. Crop m is at the top-left of ``tensor[m]``,
+            and covers ``boxes[m]`` of the image.
+        """
+        sizes = self.boxes[:, 2:] - self.boxes[:, :2]
+        num_crops = len(self.boxes)
+        max_w, max_h = sizes.max(dim=0).values.tolist() if num_crops else (0, 0)
+        tensor = torch.zeros(num_crops, max_h, max_w, dtype=torch.bool, device=self.device)
+        crop_inds = torch.repeat_interleave(
+            torch.arange(num_crops, device=self.device), self.offsets[1:] - self.offsets[:-1]
+        )
+        pos = torch.arange(len(self.data), device=self.device) - self.offsets[crop_inds]
+        crop_w = sizes[crop_inds, 0]
+        tensor[crop_inds, pos // crop_w, pos % crop_w] = self.data
+        return tensor
+
+    def to_bitmasks(self) -> BitMasks:
+        """
+        Returns:
+            BitMasks: the full-image masks.
+        """
+        crops = self.crops_to_tensor()
+        height, width = self.image_size
+        tensor = torch.zeros(len(self.boxes), height, width, dtype=torch.bool, device=self.device)
+        for m, (x0, y0, x1, y1) in enumerate(self.boxes.tolist()):
+            tensor[m, y0:y1, x0:x1] = crops[m, : y1 - y0, : x1 - x0]
+        return BitMasks(tensor[self.index])
+
+    def union_mask(self, output_size: Tuple[int, int]) -> torch.Tensor:
+        """
+        Compute the union of all masks, resized to ``output_size`` by nearest
+        interpolation, without pasting the masks into the full image.
+        It equals ``F.interpolate(tensor.any(0)[None, None].float(), output_size)[0, 0] > 0``,
+        where ``tensor`` is the full-image masks.
+
+        Args:
+            output_size (int, int): the output (height, width).
+
+        Returns:
+            Tensor: a bool tensor of shape ``output_size``.
+        """
+        if len(self.index) == 0:
+            return torch.zeros(output_size, dtype=torch.bool, device=self.device)
+        used = torch.unique(self.index)
+        crops, boxes = self.crops_to_tensor()[used], self.boxes[used]
+        num_crops = len(used)
+        # Resample both axes by gathering the source pixel of each output pixel.
+        # Pixels outside of a crop read from a zero padding at the end of the axis.
+        for dim in (1, 2):
+            src = _nearest_source_indices(self.image_size[dim - 1], output_size[dim - 1])
+            src = src.to(device=self.device)
+            start, end = boxes[:, 2 - dim, None], boxes[:, 4 - dim, None]
+            pad_index = crops.shape[dim]
+            index = torch.where((src >= start) & (src < end), src - start, pad_index)
+            crops = F.pad(crops, (0, 1) if dim == 2 else (0, 0, 0, 1))
+            if dim == 1:
+                index = index[:, :, None].expand(num_crops, -1, crops.shape[2])
+            else:
+                index = index[:, None, :].expand(num_crops, crops.shape[1], -1)
+            crops = crops.gather(dim, index)
+        return crops.any(dim=0)
+
+
+def _nearest_source_indices(input_size: int, output_size: int) -> torch.Tensor:
+    """
+    The source index of each output index in ``F.interpolate(mode="nearest")``.
+    """
+    if output_size == input_size:
+        return torch.arange(output_size)
+    if output_size == 2 * input_size:
+        return torch.arange(output_size) // 2
+    scale = torch.tensor(input_size, dtype=torch.float32) / output_size
+    src = (torch.arange(output_size, dtype=torch.float32) * scale).floor().long()
+    return src.clamp(max=input_size - 1)
@@ -13,6 +13,8 @@ def add_swint_config(cfg):
     cfg.MODEL.SWINT.MLP_RATIO = 4
     cfg.MODEL.SWINT.DROP_PATH_RATE = 0.2
     cfg.MODEL.SWINT.APE = False
+    # use F.scaled_dot_product_attention in the window attention (PyTorch >= 2.1)
+    cfg.MODEL.SWINT.FUSED_ATTN = False
     cfg.MODEL.BACKBONE.FREEZE_AT = -1
 
     # addation
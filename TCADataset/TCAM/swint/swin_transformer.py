@@ -3,6 +3,9 @@
 # modified from https://github.com/SwinTransformer/Swin-Transformer-Object-Detection/blob/master/mmdet/models/backbones/swin_transformer.py
 # --------------------------------------------------------
 
+import logging
+from functools import lru_cache
+
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
@@ -14,6 +17,10 @@ from detectron2.modeling.backbone import Backbone
 from detectron2.modeling.backbone.build import BACKBONE_REGISTRY
 from detectron2.modeling.backbone.fpn import FPN, LastLevelMaxPool, LastLevelP6P7
 from detectron2.layers import ShapeSpec
+from detectron2.utils.env import TORCH_VERSION
+
+# F.scaled_dot_product_attention with a custom scale
+_SDPA_AVAILABLE = TORCH_VERSION >= (2, 1)
 
 
 class Mlp(nn.Module):
@@ -67,6 +74,39 @@ def window_reverse(windows, window_size, H, W):
     return x
 
 
+@lru_cache(maxsize=32)
+def compute_attn_mask(Hp, Wp, window_size, shift_size, device):
+    """ Compute the attention mask for SW-MSA of a padded feature map.
+    The masks are cached by LRU, as multi-scale training and inference only
+    pad feature maps to a few sizes. They must not be modified in place.
+    Args:
+        Hp, Wp (int): Height and width of the feature map, multiples of window_size.
+        window_size (int): Window size.
+        shift_size (int): Shift size for SW-MSA.
+        device (torch.device): Device of the mask.
+    Returns:
+        attn_mask: (0/-100) mask with shape of (num_windows, Wh*Ww, Wh*Ww)
+    """
+    img_mask = torch.zeros((1, Hp, Wp, 1), device=device)  # 1 Hp Wp 1
+    h_slices = (slice(0, -window_size),
+                slice(-window_size, -shift_size),
+                slice(-shift_size, None))
+    w_slices = (slice(0, -window_size),
+                slice(-window_size, -shift_size),
+                slice(-shift_size, None))
+    cnt = 0
+    for h in h_slices:
+        for w in w_slices:
+            img_mask[:, h, w, :] = cnt
+            cnt += 1
+
+    mask_windows = window_partition(img_mask, window_size)  # nW, window_size, window_size, 1
+    mask_windows = mask_windows.view(-1, window_size * window_size)
+    attn_mask = mask_windows.unsqueeze(1) - mask_windows.unsqueeze(2)
+    attn_mask = attn_mask.masked_fill(attn_mask != 0, float(-100.0)).masked_fill(attn_mask == 0, float(0.0))
+    return attn_mask
+
+
 class WindowAttention(nn.Module):
     """ Window based multi-head self attention (W-MSA) module with relative position bias.
     It supports both of shifted and non-shifted window.
@@ -78,11 +118,19 @@ class WindowAttention(nn.Module):
         qk_scale (float | None, optional): Override default qk scale of head_dim ** -0.5 if set
         attn_drop (float, optional): Dropout ratio of attention weight. Default: 0.0
         proj_drop (float, optional): Dropout ratio of output. Default: 0.0
+        fused_attn (bool, optional): If True, use F.scaled_dot_product_attention with the relative position
+            bias and the mask as its additive mask, instead of materializing the attention weights.
+            Requires PyTorch >= 2.1, otherwise the attention is not fused. Default: False
     """
 
-    def __init__(self, dim, window_size, num_heads, qkv_bias=True, qk_scale=None, attn_drop=0., proj_drop=0.):
+    def __init__(self, dim, window_size, num_heads, qkv_bias=True, qk_scale=None, attn_drop=0., proj_drop=0.,
+                 fused_attn=False):
 
         super().__init__()
+        if fused_attn and not _SDPA_AVAILABLE:
+            logging.getLogger(__name__).warning(
+                "Fused attention requires PyTorch >= 2.1, using unfused attention instead.")
+        self.fused_attn = fused_attn and _SDPA_AVAILABLE
         self.dim = dim
         self.window_size = window_size  # Wh, Ww
         self.num_heads = num_heads
@@ -114,6 +162,34 @@ class WindowAttention(nn.Module):
         trunc_normal_(self.relative_position_bias_table, std=.02)
         self.softmax = nn.Softmax(dim=-1)
 
+        # bias gathered from the table once it does not need gradients, and the
+        # version of the table it was gathered from
+        self._frozen_bias = None
+        self._frozen_bias_key = None
+
+    def relative_position_bias(self):
+        """ Gather the relative position bias of the tokens of a window.
+        In eval mode without gradients, it is computed once and reused until the
+        table changes, e.g. by loading a checkpoint.
+        Returns:
+            relative_position_bias: (1, nH, Wh*Ww, Wh*Ww)
+        """
+        table = self.relative_position_bias_table
+        frozen = not self.training and not (torch.is_grad_enabled() and table.requires_grad)
+        key = (table.data_ptr(), table._version, table.dtype, table.device)
+        if frozen and self._frozen_bias_key == key:
+            return self._frozen_bias
+
+        relative_position_bias = table[self.relative_position_index.view(-1)].view(
+            self.window_size[0] * self.window_size[1], self.window_size[0] * self.window_size[1], -1)  # Wh*Ww,Wh*Ww,nH
+        relative_position_bias = relative_position_bias.permute(2, 0, 1).contiguous().unsqueeze(0)  # 1, nH, Wh*Ww, Wh*Ww
+        if frozen:
+            self._frozen_bias = relative_position_bias.detach()
+            self._frozen_bias_key = key
+        else:
+            self._frozen_bias = self._frozen_bias_key = None
+        return relative_position_bias
+
     def forward(self, x, mask=None):
         """ Forward function.
         Args:
@@ -124,29 +200,50 @@ class WindowAttention(nn.Module):
         qkv = self.qkv(x).reshape(B_, N, 3, self.num_heads, C // self.num_heads).permute(2, 0, 3, 1, 4)
         q, k, v = qkv[0], qkv[1], qkv[2]  # make torchscript happy (cannot use tensor as tuple)
 
-        q = q * self.scale
-        attn = (q @ k.transpose(-2, -1))
+        if self.fused_attn:
+            x = self._fused_attention(q, k, v, mask)
+        else:
+            q = q * self.scale
+            attn = (q @ k.transpose(-2, -1))
 
-        relative_position_bias = self.relative_position_bias_table[self.relative_position_index.view(-1)].view(
-            self.window_size[0] * self.window_size[1], self.window_size[0] * self.window_size[1], -1)  # Wh*Ww,Wh*Ww,nH
-        relative_position_bias = relative_position_bias.permute(2, 0, 1).contiguous()  # nH, Wh*Ww, Wh*Ww
-        attn = attn + relative_position_bias.unsqueeze(0)
+            attn = attn + self.relative_position_bias()
 
-        if mask is not None:
-            nW = mask.shape[0]
-            attn = attn.view(B_ // nW, nW, self.num_heads, N, N) + mask.unsqueeze(1).unsqueeze(0)
-            attn = attn.view(-1, self.num_heads, N, N)
-            attn = self.softmax(attn)
-        else:
-            attn = self.softmax(attn)
+            if mask is not None:
+                nW = mask.shape[0]
+                attn = attn.view(B_ // nW, nW, self.num_heads, N, N) + mask.unsqueeze(1).unsqueeze(0)
+                attn = attn.view(-1, self.num_heads, N, N)
+                attn = self.softmax(attn)
+            else:
+                attn = self.softmax(attn)
 
-        attn = self.attn_drop(attn)
+            attn = self.attn_drop(attn)
+            x = attn @ v
 
-        x = (attn @ v).transpose(1, 2).reshape(B_, N, C)
+        x = x.transpose(1, 2).reshape(B_, N, C)
         x = self.proj(x)
         x = self.proj_drop(x)
         return x
 
+    def _fused_attention(self, q, k, v, mask=None):
+        """ Attention of F.scaled_dot_product_attention, with the relative position bias and
+        the mask folded into one additive mask.
+        Args:
+            q, k, v: queries, keys and values with shape of (num_windows*B, nH, Wh*Ww, head_dim)
+            mask: (0/-100) mask with shape of (num_windows, Wh*Ww, Wh*Ww) or None
+        Returns:
+            x: (num_windows*B, nH, Wh*Ww, head_dim)
+        """
+        attn_mask = self.relative_position_bias()  # 1, nH, Wh*Ww, Wh*Ww
+        if mask is not None:
+            nW = mask.shape[0]
+            attn_mask = attn_mask + mask.unsqueeze(1)  # nW, nH, Wh*Ww, Wh*Ww
+            if q.shape[0] > nW:
+                # the fused kernels only broadcast the batch of 4-dim masks
+                attn_mask = attn_mask.repeat(q.shape[0] // nW, 1, 1, 1)
+        dropout_p = self.attn_drop.p if self.training else 0.
+        return F.scaled_dot_product_attention(
+            q, k, v, attn_mask=attn_mask.to(q.dtype), dropout_p=dropout_p, scale=self.scale)
+
 
 class SwinTransformerBlock(nn.Module):
     """ Swin Transformer Block.
@@ -163,11 +260,12 @@ class SwinTransformerBlock(nn.Module):
         drop_path (float, optional): Stochastic depth rate. Default: 0.0
         act_layer (nn.Module, optional): Activation layer. Default: nn.GELU
         norm_layer (nn.Module, optional): Normalization layer.  Default: nn.LayerNorm
+        fused_attn (bool, optional): If True, fuse the attention, see WindowAttention. Default: False
     """
 
     def __init__(self, dim, num_heads, window_size=7, shift_size=0,
                  mlp_ratio=4., qkv_bias=True, qk_scale=None, drop=0., attn_drop=0., drop_path=0.,
-                 act_layer=nn.GELU, norm_layer=nn.LayerNorm):
+                 act_layer=nn.GELU, norm_layer=nn.LayerNorm, fused_attn=False):
         super().__init__()
         self.dim = dim
         self.num_heads = num_heads
@@ -179,7 +277,8 @@ class SwinTransformerBlock(nn.Module):
         self.norm1 = norm_layer(dim)
         self.attn = WindowAttention(
             dim, window_size=to_2tuple(self.window_size), num_heads=num_heads,
-            qkv_bias=qkv_bias, qk_scale=qk_scale, attn_drop=attn_drop, proj_drop=drop)
+            qkv_bias=qkv_bias, qk_scale=qk_scale, attn_drop=attn_drop, proj_drop=drop,
+            fused_attn=fused_attn)
 
         self.drop_path = DropPath(drop_path) if drop_path > 0. else nn.Identity()
         self.norm2 = norm_layer(dim)
@@ -305,6 +404,7 @@ class BasicLayer(nn.Module):
         norm_layer (nn.Module, optional): Normalization layer. Default: nn.LayerNorm
         downsample (nn.Module | None, optional): Downsample layer at the end of the layer. Default: None
         use_checkpoint (bool): Whether to use checkpointing to save memory. Default: False.
+        fused_attn (bool): If True, fuse the attention, see WindowAttention. Default: False.
     """
 
     def __init__(self,
@@ -320,7 +420,8 @@ class BasicLayer(nn.Module):
                  drop_path=0.,
                  norm_layer=nn.LayerNorm,
                  downsample=None,
-                 use_checkpoint=False):
+                 use_checkpoint=False,
+                 fused_attn=False):
         super().__init__()
         self.window_size = window_size
         self.shift_size = window_size // 2
@@ -340,7 +441,8 @@ class BasicLayer(nn.Module):
                 drop=drop,
                 attn_drop=attn_drop,
                 drop_path=drop_path[i] if isinstance(drop_path, list) else drop_path,
-                norm_layer=norm_layer)
+                norm_layer=norm_layer,
+                fused_attn=fused_attn)
             for i in range(depth)])
 
         # patch merging layer
@@ -359,23 +461,7 @@ class BasicLayer(nn.Module):
         # calculate attention mask for SW-MSA
         Hp = int(np.ceil(H / self.window_size)) * self.window_size
         Wp = int(np.ceil(W / self.window_size)) * self.window_size
-        img_mask = torch.zeros((1, Hp, Wp, 1), device=x.device)  # 1 Hp Wp 1
-        h_slices = (slice(0, -self.window_size),
-                    slice(-self.window_size, -self.shift_size),
-                    slice(-self.shift_size, None))
-        w_slices = (slice(0, -self.window_size),
-                    slice(-self.window_size, -self.shift_size),
-                    slice(-self.shift_size, None))
-        cnt = 0
-        for h in h_slices:
-            for w in w_slices:
-                img_mask[:, h, w, :] = cnt
-                cnt += 1
-
-        mask_windows = window_partition(img_mask, self.window_size)  # nW, window_size, window_size, 1
-        mask_windows = mask_windows.view(-1, self.window_size * self.window_size)
-        attn_mask = mask_windows.unsqueeze(1) - mask_windows.unsqueeze(2)
-        attn_mask = attn_mask.masked_fill(attn_mask != 0, float(-100.0)).masked_fill(attn_mask == 0, float(0.0))
+        attn_mask = compute_attn_mask(Hp, Wp, self.window_size, self.shift_size, x.device)
 
         for blk in self.blocks:
             blk.H, blk.W = H, W
@@ -459,6 +545,7 @@ class SwinTransformer(Backbone):
         frozen_stages (int): Stages to be frozen (stop grad and set eval mode).
             -1 means not freezing any parameters.
         use_checkpoint (bool): Whether to use checkpointing to save memory. Default: False.
+        fused_attn (bool): If True, fuse the attention, see WindowAttention. Default: False.
     """
 
     def __init__(self,
@@ -480,6 +567,7 @@ class SwinTransformer(Backbone):
                  patch_norm=True,
                  frozen_stages=-1,
                  use_checkpoint=False,
+                 fused_attn=False,
                  out_features=None):
         super(SwinTransformer, self).__init__()
 
@@ -530,7 +618,8 @@ class SwinTransformer(Backbone):
                 drop_path=dpr[sum(depths[:i_layer]):sum(depths[:i_layer + 1])],
                 norm_layer=norm_layer,
                 downsample=PatchMerging if (i_layer < self.num_layers - 1) else None,
-                use_checkpoint=use_checkpoint)
+                use_checkpoint=use_checkpoint,
+                fused_attn=fused_attn)
             self.layers.append(layer)
 
             stage = f'stage{i_layer+2}'
@@ -652,6 +741,7 @@ def build_swint_backbone(cfg, input_shape):
         ape=cfg.MODEL.SWINT.APE,
         patch_norm=True,
         frozen_stages=cfg.MODEL.BACKBONE.FREEZE_AT,
+        fused_attn=cfg.MODEL.SWINT.FUSED_ATTN,
         out_features=out_features
     )
 
@@ -7,14 +7,76 @@ import numpy as np
 import os
 import tempfile
 import unittest
+from unittest import mock
 import torch
+import pycocotools.mask as mask_util
 from pycocotools.coco import COCO
 from pycocotools.cocoeval import COCOeval
 
-from detectron2.data import DatasetCatalog
+from detectron2.data import DatasetCatalog, MetadataCatalog
+from detectron2.data.datasets import register_coco_instances
 from detectron2.evaluation import COCOEvaluator
+from detectron2.evaluation.coco_evaluation import (
+    _accumulate_images_on_coco,
+    _evaluate_images_on_coco,
+    _evaluate_predictions_in_workers,
+    _evaluate_predictions_on_coco,
+    _coverage_courseware_areas,
+    _rle_courseware_areas,
+    compt_score,
+    compute_ptrate,
+    courseware_areas,
+    instances_to_coco_json,
+)
 from detectron2.evaluation.fast_eval_api import COCOeval_opt
-from detectron2.structures import Boxes, Instances
+from detectron2.modeling import detector_postprocess, mask_coverage
+from detectron2.structures import Boxes, Instances, ROIMasks, polygons_to_bitmask
+
+
+def _courseware_gt(num_images, seed=0):
+    # category 2 and 3 are the text classes
+    categories = [{"id": k, "name": str(k)} for k in [1, 2, 3, 4]]
+    images = [
+        {"id": k, "file_name": f"{k}.jpg", "height": 20, "width": 30} for k in range(num_images)
+    ]
+    rng = np.random.RandomState(seed)
+    annotations = []
+    for image in images[1:]:
+        for category_id in rng.randint(1, 5, size=3).tolist():
+            x, y = rng.randint(0, 10, size=2).tolist()
+            w, h = rng.randint(1, 10, size=2).tolist()
+            polygon = [x, y, x + w, y, x + w, y + h, x, y + h]
+            annotations.append(
+                {
+                    "id": len(annotations) + 1,
+                    "image_id": image["id"],
+                    "category_id": category_id,
+                    "bbox": [x, y, w, h],
+                    "area": w * h,
+                    "segmentation": [polygon],
+                    "iscrowd": 0,
+                }
+            )
+    return {"categories": categories, "images": images, "annotations": annotations}
+
+
+def _random_predictions(gt, image_id, seed=0):
+    # jittered copies of the ground truth of the image, and a few random instances
+    torch.manual_seed(seed)
+    anns = [a for a in gt["annotations"] if a["image_id"] == image_id]
+    boxes = torch.tensor([a["bbox"] for a in anns], dtype=torch.float32).reshape(-1, 4)
+    boxes[:, 2:] += boxes[:, :2]
+    boxes = torch.cat([boxes + torch.randn(len(anns), 4) * 0.3, torch.rand(3, 4) * 10])
+    boxes[:, 2:] = torch.max(boxes[:, 2:], boxes[:, :2] + 1)
+
+    pred = Instances((20, 30))
+    pred.pred_boxes = Boxes(boxes)
+    pred.scores = torch.rand(len(boxes))
+    pred.pred_classes = torch.tensor([a["category_id"] - 1 for a in anns] + [0, 1, 2])
+    pred.pred_masks = torch.zeros(len(boxes), 20, 30, dtype=torch.bool)
+    for mask, (x0, y0, x1, y1) in zip(pred.pred_masks, boxes.round().int().tolist()):
+        mask[max(y0, 0) : y1, max(x0, 0) : x1] = True
+    return pred
 
 
 class TestCOCOeval(unittest.TestCase):
@@ -137,3 +199,230 @@ class TestCOCOeval(unittest.TestCase):
         evaluator.process(inputs, [output, output])
         with self.assertRaises(AssertionError):
             evaluator.evaluate()
+
+    def test_courseware_areas(self):
+        pred = Instances((37, 51))
+        pred.pred_boxes = Boxes(torch.rand(7, 4))
+        pred.scores = torch.rand(7)
+        pred.pred_classes = torch.tensor([0, 2, 3, 1, 2, 4, 2])
+        pred.pred_masks = torch.rand(7, 37, 51) > torch.rand(7, 1, 1)
+        text_classes = [2, 3]
+
+        # areas covered by the decoded RLEs
+        masks = [mask_util.decode(r["segmentation"]) for r in instances_to_coco_json(pred, 0)]
+        masks = np.stack(masks).astype(bool)
+        is_text = np.isin(pred.pred_classes.numpy(), text_classes)
+        text_area, total_area = float(masks[is_text].any(0).sum()), float(masks.any(0).sum())
+        self.assertEqual(courseware_areas(pred, text_classes), (text_area, total_area))
+        self.assertEqual(courseware_areas(pred, []), (0.0, total_area))
+
+    def test_roi_masks_to_coco_json(self):
+        pred = Instances((37, 51))
+        pred.pred_boxes = Boxes(torch.tensor([[0.0, 0.0, 51.0, 37.0], [3.2, 5.1, 20.7, 30.0]] * 3))
+        pred.scores = torch.rand(6)
+        pred.pred_classes = torch.tensor([0, 2, 3, 1, 2, 4])
+        pred.pred_masks = ROIMasks(torch.rand(6, 28, 28))
+        pasted = Instances(pred.image_size, **pred.get_fields())
+        pasted.pred_masks = pred.pred_masks.to_bitmasks(pred.pred_boxes, 37, 51).tensor
+
+        self.assertEqual(instances_to_coco_json(pred, 1), instances_to_coco_json(pasted, 1))
+        self.assertEqual(
+            _rle_courseware_areas(instances_to_coco_json(pred, 1), [2, 3]),
+            courseware_areas(pasted, [2, 3]),
+        )
+
+    def test_mask_coverage(self):
+        raw = Instances((30, 40))
+        raw.pred_boxes = Boxes(torch.tensor([[0.0, 0.0, 40.0, 30.0], [3.2, 5.1, 20.7, 29.0]] * 3))
+        raw.scores = torch.rand(6)
+        raw.pred_classes = torch.tensor([0, 2, 3, 1, 2, 2])
+        raw.pred_masks = torch.rand(6, 1, 28, 28)
+        pred = detector_postprocess(copy.deepcopy(raw), 74, 101, paste_masks=False)
+        pasted = detector_postprocess(raw, 74, 101)
+        self.assertIsInstance(pred.pred_masks, ROIMasks)
+
+        coverage = mask_coverage(pred, num_classes=5)
+        masks = pasted.pred_masks
+        self.assertTrue(torch.equal(pred.pred_mask_areas, masks.sum(dim=(1, 2))))
+        class_areas = [masks[pasted.pred_classes == c].any(dim=0).sum().item() for c in range(5)]
+        self.assertEqual(coverage["class_areas"].tolist(), class_areas)
+        self.assertEqual(coverage["union_area"], masks.any(dim=0).sum().item())
+        self.assertEqual(sorted(coverage["class_rles"]), [0, 1, 2, 3])
+        # the RLEs of mask_coverage are reused, instead of pasting the masks again
+        with mock.patch.object(ROIMasks, "to_rles", side_effect=AssertionError):
+            self.assertEqual(instances_to_coco_json(pred, 1), instances_to_coco_json(pasted, 1))
+        for text_classes in [[2, 3], [4], []]:
+            self.assertEqual(
+                _coverage_courseware_areas(coverage, text_classes),
+                courseware_areas(pasted, text_classes),
+            )
+        # the masks can still be pasted, on demand
+        bitmasks = pred.pred_masks.to_bitmasks(pred.pred_boxes.tensor, *pred.image_size)
+        self.assertTrue(torch.equal(bitmasks.tensor, masks))
+
+    def test_courseware_score(self):
+        gt = _courseware_gt(6)
+        annotations = gt["annotations"]
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            json_file = os.path.join(tmpdir, "gt.json")
+            with open(json_file, "w") as f:
+                json.dump(gt, f)
+            dataset = "courseware_score_test"
+            register_coco_instances(dataset, {}, json_file, tmpdir)
+            try:
+                inputs = DatasetCatalog.get(dataset)
+                with contextlib.redirect_stdout(io.StringIO()):
+                    evaluator = COCOEvaluator(dataset, tasks=("bbox", "segm"), distributed=False)
+                evaluator.reset()
+
+                true_scores, pred_scores = [], []
+                for input in inputs[:-1]:
+                    pred = Instances((20, 30))
+                    pred.pred_boxes = Boxes(torch.tensor([[0.0, 0.0, 30.0, 20.0]] * 4))
+                    pred.scores = torch.rand(4)
+                    pred.pred_classes = torch.arange(4)
+                    pred.pred_masks = torch.rand(4, 20, 30) > torch.rand(4, 1, 1)
+                    evaluator.process([input], [{"instances": pred}])
+
+                    masks = pred.pred_masks
+                    pred_scores.append(compt_score(masks[1:3].any(0).sum() / masks.any(0).sum()))
+                    true_masks = np.zeros((4, 20, 30), dtype=bool)
+                    for a in annotations:
+                        if a["image_id"] == input["image_id"]:
+                            mask = polygons_to_bitmask(a["segmentation"], 20, 30)
+                            true_masks[a["category_id"] - 1] |= mask
+                    total_area = true_masks.any(0).sum()
+                    text_area = true_masks[1:3].any(0).sum()
+                    true_scores.append(compt_score(text_area / total_area if total_area else 0))
+
+                with contextlib.redirect_stdout(io.StringIO()):
+                    results = evaluator.evaluate()
+            finally:
+                DatasetCatalog.remove(dataset)
+                MetadataCatalog.remove(dataset)
+
+        true_scores, pred_scores = np.array(true_scores), np.array(pred_scores)
+        for task in ["bbox", "segm"]:
+            self.assertIn("AP", results[task])
+            self.assertAlmostEqual(results[task]["mae"], np.abs(true_scores - pred_scores).mean())
+            self.assertAlmostEqual(
+                results[task]["rmse"], np.sqrt(np.square(true_scores - pred_scores).mean())
+            )
+
+    def test_compt_score(self):
+        def reference(rate):
+            # the rubric before the score bands were configurable
+            if 0.9 <= rate <= 1:
+                return 1
+            elif 0 <= rate < 0.1 or 0.8 <= rate < 0.9:
+                return 3
+            elif 0.1 <= rate < 0.2 or 0.7 <= rate < 0.8:
+                return 5
+            elif 0.2 <= rate < 0.3 or 0.6 <= rate < 0.7:
+                return 7
+            elif 0.3 <= rate < 0.4:
+                return 15
+            elif 0.4 <= rate < 0.5:
+                return 12
+            elif 0.5 <= rate < 0.6:
+                return 9
+            return 0
+
+        rates = np.concatenate([np.linspace(-0.5, 1.5, 2001), np.arange(11) / 10, [np.nan]])
+        rates = np.concatenate([rates, np.nextafter(rates, -np.inf), np.nextafter(rates, np.inf)])
+        scores = compt_score(rates)
+        self.assertEqual(scores.dtype, np.int64)
+        self.assertEqual(scores.tolist(), [reference(x) for x in rates.tolist()])
+
+        bands = ([0.0, 0.5], [1, 2])
+        scores = compt_score([-0.1, 0, 0.49, 0.5, 1, 1.01], bands)
+        self.assertEqual(scores.tolist(), [0, 1, 1, 2, 2, 0])
+        self.assertEqual(compute_ptrate([3, 0, 5], [4, 0, 5]).tolist(), [0.75, 0.0, 1.0])
+
+    def test_shard_evaluation(self):
+        gt = _courseware_gt(12)
+        coco_results = []
+        for image_id in range(11):
+            pred = _random_predictions(gt, image_id, seed=image_id)
+            for result in instances_to_coco_json(pred, image_id):
+                result["category_id"] += 1
+                coco_results.append(result)
+        with contextlib.redirect_stdout(io.StringIO()):
+            coco_gt = COCO()
+            coco_gt.dataset = gt
+            coco_gt.createIndex()
+
+            for task in ["bbox", "segm"]:
+                expected = _evaluate_predictions_on_coco(
+                    coco_gt, coco_results, task, use_fast_impl=False
+                )
+                # image 11 has no detections, so its shard only contains ground truth
+                eval_imgs = {}
+                for shard in [[0, 5, 7], [1, 2, 3, 4], [6, 8, 9, 10], [11], []]:
+                    results = [x for x in coco_results if x["image_id"] in shard]
+                    eval_imgs.update(_evaluate_images_on_coco(coco_gt, results, task, shard))
+                coco_eval = _accumulate_images_on_coco(coco_gt, eval_imgs, task, list(range(12)))
+
+                self.assertGreater(expected.stats[0], 0.1)
+                self.assertTrue(np.array_equal(coco_eval.stats, expected.stats))
+                for k in ["precision", "recall", "scores"]:
+                    self.assertTrue(np.array_equal(coco_eval.eval[k], expected.eval[k]))
+
+    def test_shard_evaluation_results(self):
+        gt = _courseware_gt(8)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            json_file = os.path.join(tmpdir, "gt.json")
+            with open(json_file, "w") as f:
+                json.dump(gt, f)
+            dataset = "shard_evaluation_test"
+            register_coco_instances(dataset, {}, json_file, tmpdir)
+            try:
+                inputs = DatasetCatalog.get(dataset)
+                results = []
+                for shard_evaluation in [False, True]:
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        evaluator = COCOEvaluator(
+                            dataset,
+                            distributed=False,
+                            use_fast_impl=False,
+                            shard_evaluation=shard_evaluation,
+                        )
+                        evaluator.reset()
+                        # the last image has no prediction
+                        for input in inputs[:-1]:
+                            pred = _random_predictions(gt, input["image_id"], seed=1)
+                            evaluator.process([input], [{"instances": pred}])
+                        results.append(evaluator.evaluate())
+            finally:
+                DatasetCatalog.remove(dataset)
+                MetadataCatalog.remove(dataset)
+
+        self.assertEqual(sorted(results[1].keys()), ["bbox", "segm"])
+        np.testing.assert_equal(results[1], results[0])
+
+    def test_evaluate_in_workers(self):
+        gt = _courseware_gt(12)
+        coco_results = []
+        for image_id in range(12):
+            for result in instances_to_coco_json(_random_predictions(gt, image_id), image_id):
+                result["category_id"] += 1
+                coco_results.append(result)
+        with contextlib.redirect_stdout(io.StringIO()):
+            coco_gt = COCO()
+            coco_gt.dataset = gt
+            coco_gt.createIndex()
+
+            for use_fast_impl in [True, False]:
+                # 4 categories are split into 3 groups
+                coco_evals = _evaluate_predictions_in_workers(
+                    coco_gt, coco_results, ["bbox", "segm"], 3, use_fast_impl=use_fast_impl
+                )
+                for task in ["bbox", "segm"]:
+                    expected = _evaluate_predictions_on_coco(
+                        coco_gt, coco_results, task, use_fast_impl=use_fast_impl
+                    )
+                    coco_eval = coco_evals[task]
+                    self.assertTrue(np.array_equal(coco_eval.stats, expected.stats))
+                    for k in ["precision", "recall", "scores"]:
+                        self.assertTrue(np.array_equal(coco_eval.eval[k], expected.eval[k]))
@@ -1,8 +1,10 @@
 # Copyright (c) Facebook, Inc. and its affiliates.
 
+import json
 import os
 import pickle
 import sys
+import tempfile
 import unittest
 from functools import partial
 import torch
@@ -11,13 +13,17 @@ from iopath.common.file_io import LazyPath
 from detectron2 import model_zoo
 from detectron2.config import instantiate
 from detectron2.data import (
+    ColumnarDatasetDicts,
     DatasetFromList,
     MapDataset,
+    SerializedList,
     ToIterableDataset,
     build_batch_data_loader,
     build_detection_train_loader,
 )
+from detectron2.data.datasets.cache import load_dataset_dicts_with_cache
 from detectron2.data.samplers import InferenceSampler, TrainingSampler
+from detectron2.structures import BoxMode
 
 
 def _a_slow_func(x):
@@ -39,6 +45,128 @@ class TestDatasetFromList(unittest.TestCase):
             self.assertEqual(os.fspath(path), _a_slow_func(i))
 
 
+class TestSerializedList(unittest.TestCase):
+    def test_serialized_list(self):
+        data = [{"image_id": i, "annotations": [{"bbox": [i, i, 1, 1]}]} for i in range(10)]
+        lst = SerializedList(data)
+        self.assertEqual(len(lst), 10)
+        self.assertEqual(list(lst), data)
+        self.assertEqual(lst[-1], data[-1])
+        self.assertEqual(list(lst[2:5]), data[2:5])
+        self.assertEqual(list(lst.select([7, 1])), [data[7], data[1]])
+        lst[0]["image_id"] = 100
+        self.assertEqual(lst[0]["image_id"], 0)
+
+        with tempfile.TemporaryDirectory() as d:
+            lst.save(os.path.join(d, "lst"))
+            loaded = SerializedList.load(os.path.join(d, "lst"))
+            self.assertEqual(list(loaded), data)
+            subset = pickle.loads(pickle.dumps(loaded.select([3, 4])))
+            self.assertEqual(list(subset), data[3:5])
+
+            ds = DatasetFromList(loaded, copy=False)
+            self.assertEqual(len(ds), 10)
+            self.assertEqual(ds[3], data[3])
+
+
+class TestColumnarDatasetDicts(unittest.TestCase):
+    def _data(self):
+        return [
+            {
+                "file_name": "img{}.jpg".format(i),
+                "image_id": i,
+                "height": 10 + i,
+                "width": 20,
+                "annotations": [
+                    {
+                        "bbox": [i, i, 1.5, 2],
+                        "bbox_mode": BoxMode.XYWH_ABS,
+                        "category_id": k,
+                        "segmentation": [[0, 0, 1, 0, 1, 1.5]] * k,
+                        "bg_object_segmentation": [],
+                        "extra": k if k % 2 else "x",
+                    }
+                    for k in range(i % 3)
+                ],
+            }
+            for i in range(10)
+        ] + [{"file_name": "no_anno.jpg", "image_id": 10, "height": 1, "width": 1}]
+
+    def _assert_equal(self, dicts, expected):
+        for record, exp in zip(dicts, expected):
+            exp = dict(exp)
+            annos = record.pop("annotations", None)
+            exp_annos = exp.pop("annotations", None)
+            self.assertEqual(record, exp)
+            self.assertEqual(annos is None, exp_annos is None)
+            for anno, exp_anno in zip(annos or [], exp_annos or []):
+                anno, exp_anno = dict(anno), dict(exp_anno)
+                segm = anno.pop("segmentation")
+                exp_segm = exp_anno.pop("segmentation")
+                self.assertEqual([p.tolist() for p in segm], exp_segm)
+                self.assertEqual(anno, exp_anno)
+        self.assertEqual(len(dicts), len(expected))
+
+    def test_columnar(self):
+        data = self._data()
+        lst = ColumnarDatasetDicts(data)
+        self.assertEqual(len(lst), len(data))
+        self._assert_equal(list(lst), data)
+        self._assert_equal([lst[-1]], [data[-1]])
+        self.assertIsInstance(lst[1]["annotations"][0]["bbox_mode"], BoxMode)
+        with self.assertRaises(ValueError):
+            lst[2]["annotations"][1]["segmentation"][0][0] = 100
+        with self.assertRaises(IndexError):
+            lst[len(data)]
+
+        with tempfile.TemporaryDirectory() as d:
+            lst.save(os.path.join(d, "lst"))
+            loaded = ColumnarDatasetDicts.load(os.path.join(d, "lst"))
+            self._assert_equal(list(loaded), data)
+            self._assert_equal(list(pickle.loads(pickle.dumps(loaded))), data)
+
+        ds = DatasetFromList(data, copy=False, serialize="columnar")
+        self.assertEqual(len(ds), len(data))
+        self._assert_equal([ds[4]], [data[4]])
+
+
+class TestDatasetCache(unittest.TestCase):
+    def test_cache(self):
+        calls = []
+
+        def loader(json_file, image_root):
+            calls.append(json_file)
+            with open(json_file) as f:
+                return [{"file_name": os.path.join(image_root, x)} for x in json.load(f)]
+
+        with tempfile.TemporaryDirectory() as d:
+            json_file = os.path.join(d, "a.json")
+            with open(json_file, "w") as f:
+                json.dump(["1.jpg", "2.jpg"], f)
+            cache_dir = os.path.join(d, "cache")
+
+            for _ in range(2):
+                dicts = load_dataset_dicts_with_cache(
+                    "a", loader, json_file, "root", cache_dir=cache_dir
+                )
+                self.assertIsInstance(dicts, SerializedList)
+                self.assertEqual(
+                    list(dicts), [{"file_name": "root/1.jpg"}, {"file_name": "root/2.jpg"}]
+                )
+            self.assertEqual(len(calls), 1)
+
+            # different options or annotations invalidate the cache
+            load_dataset_dicts_with_cache("a", loader, json_file, "root2", cache_dir=cache_dir)
+            self.assertEqual(len(calls), 2)
+            with open(json_file, "w") as f:
+                json.dump(["3.jpg"], f)
+            dicts = load_dataset_dicts_with_cache(
+                "a", loader, json_file, "root", cache_dir=cache_dir
+            )
+            self.assertEqual(list(dicts), [{"file_name": "root/3.jpg"}])
+            self.assertEqual(len(calls), 3)
+
+
 class TestMapDataset(unittest.TestCase):
     @staticmethod
     def map_func(x):
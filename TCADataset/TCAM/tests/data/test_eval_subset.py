@@ -0,0 +1,144 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+import json
+import os
+import tempfile
+import unittest
+from collections import Counter
+
+from detectron2.data import DatasetCatalog, MetadataCatalog, get_eval_subset, stratified_subset
+from detectron2.config import get_cfg
+from detectron2.data.datasets import register_coco_instances
+from detectron2.engine import DefaultTrainer
+from detectron2.evaluation import DatasetEvaluator, DatasetEvaluators, ImageSubsetEvaluator
+
+
+def _dataset_dicts(num_images):
+    # class 3 is rare, and the images of even ids are "math"
+    return [
+        {
+            "image_id": k,
+            "annotations": [{"category_id": 3 if k % 10 == 0 else k % 2, "iscrowd": 0}],
+        }
+        for k in range(num_images)
+    ]
+
+
+class _Evaluator(DatasetEvaluator):
+    def evaluate(self):
+        return {"all": None}
+
+
+class _SubsetEvaluator(DatasetEvaluator):
+    def evaluate(self, img_ids=None):
+        return {"subset": img_ids}
+
+
+class _Trainer(DefaultTrainer):
+    loaders = []
+
+    @classmethod
+    def build_test_loader(cls, cfg, dataset_name, image_ids=None):
+        cls.loaders.append((dataset_name, image_ids))
+        return []
+
+
+def _write_gt(json_file, num_images):
+    categories = [{"id": k, "name": str(k)} for k in [1, 2, 3, 4]]
+    images = [
+        {"id": k, "file_name": f"{k}.jpg", "height": 20, "width": 30, "subject": k % 3}
+        for k in range(num_images)
+    ]
+    annotations = [
+        {
+            "id": k + 1,
+            "image_id": k,
+            "category_id": 1,
+            "bbox": [1, 1, 5, 5],
+            "area": 25.0,
+            "iscrowd": 0,
+        }
+        for k in range(num_images)
+    ]
+    gt = {"categories": categories, "images": images, "annotations": annotations}
+    with open(json_file, "w") as f:
+        json.dump(gt, f)
+
+
+class TestEvalSubset(unittest.TestCase):
+    def test_stratified_subset(self):
+        dicts = _dataset_dicts(100)
+        groups = ["math" if k % 2 == 0 else "art" for k in range(100)]
+        subset = stratified_subset(dicts, 20, groups, seed=3)
+        self.assertEqual(subset, sorted(set(subset)))
+        self.assertEqual(len(subset), 20)
+        self.assertEqual(subset, stratified_subset(dicts, 20, groups, seed=3))
+        self.assertNotEqual(subset, stratified_subset(dicts, 20, groups, seed=4))
+
+        counts = Counter(groups[k] for k in subset)
+        self.assertEqual(counts, {"math": 10, "art": 10})
+        # 10 images have the rare class, so 2 of them are sampled
+        self.assertEqual(sum(k % 10 == 0 for k in subset), 2)
+
+        self.assertEqual(stratified_subset(dicts, 200), list(range(100)))
+        self.assertEqual(len(stratified_subset(dicts, 7)), 7)
+
+    def test_get_eval_subset(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            json_file = os.path.join(tmpdir, "gt.json")
+            _write_gt(json_file, 30)
+            dataset = "eval_subset_test"
+            register_coco_instances(dataset, {}, json_file, tmpdir)
+            try:
+                cache_file = os.path.join(tmpdir, "out", "subset.json")
+                image_ids = get_eval_subset(dataset, 9, cache_file)
+                self.assertEqual(len(image_ids), 9)
+                self.assertEqual(Counter(k % 3 for k in image_ids), {0: 3, 1: 3, 2: 3})
+                with open(cache_file) as f:
+                    self.assertEqual(json.load(f)["image_ids"], image_ids)
+
+                # the cache is used
+                with open(cache_file, "w") as f:
+                    json.dump({"dataset": dataset, "size": 9, "group_key": "subject",
+                               "seed": 0, "image_ids": [1, 2]}, f)  # fmt: skip
+                self.assertEqual(get_eval_subset(dataset, 9, cache_file), [1, 2])
+                # and overwritten with other arguments
+                self.assertEqual(len(get_eval_subset(dataset, 12, cache_file)), 12)
+                with open(cache_file) as f:
+                    self.assertEqual(json.load(f)["size"], 12)
+            finally:
+                DatasetCatalog.remove(dataset)
+                MetadataCatalog.remove(dataset)
+
+    def test_trainer_test_subset(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            json_file = os.path.join(tmpdir, "gt.json")
+            _write_gt(json_file, 30)
+            dataset = "eval_subset_trainer_test"
+            register_coco_instances(dataset, {}, json_file, tmpdir)
+            try:
+                cfg = get_cfg()
+                cfg.OUTPUT_DIR = tmpdir
+                cfg.DATASETS.TEST = (dataset,)
+                cfg.TEST.EVAL_SUBSET.SIZE = 6
+                _Trainer.loaders = []
+                # the subsets are loaded by the same, overridable, build_test_loader
+                results = _Trainer.test(cfg, None, [_SubsetEvaluator()], subset=True)
+                image_ids = results["subset"]
+                self.assertEqual(len(image_ids), 6)
+                _Trainer.test(cfg, None, [_Evaluator()])
+                self.assertEqual(_Trainer.loaders, [(dataset, image_ids), (dataset, None)])
+            finally:
+                DatasetCatalog.remove(dataset)
+                MetadataCatalog.remove(dataset)
+
+    def test_image_subset_evaluator(self):
+        evaluator = ImageSubsetEvaluator(_SubsetEvaluator(), [1, 2])
+        self.assertEqual(evaluator.evaluate(), {"subset": [1, 2]})
+        evaluator = ImageSubsetEvaluator(_Evaluator(), [1, 2])
+        self.assertEqual(evaluator.evaluate(), {"all": None})
+        evaluator = ImageSubsetEvaluator(DatasetEvaluators([_SubsetEvaluator(), _Evaluator()]), [3])
+        self.assertEqual(evaluator.evaluate(), {"subset": [3], "all": None})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+import contextlib
+import io
+import json
+import numpy as np
+import os
+import tempfile
+import unittest
+import torch
+
+from detectron2.data import DatasetCatalog, MetadataCatalog
+from detectron2.data.datasets import register_coco_instances
+from detectron2.evaluation import COCOEvaluator, PredictionDump, PredictionDumpWriter
+from detectron2.evaluation.coco_evaluation import instances_to_coco_json
+from detectron2.evaluation.prediction_dump import coco_json_to_prediction_dump
+from detectron2.structures import Boxes, Instances
+
+
+def _random_instances(num_instances, height=20, width=30):
+    pred = Instances((height, width))
+    xy = torch.rand(num_instances, 2) * torch.tensor([width / 2, height / 2])
+    pred.pred_boxes = Boxes(torch.cat([xy, xy + torch.rand(num_instances, 2) * 10], 1))
+    pred.scores = torch.rand(num_instances)
+    pred.pred_classes = torch.randint(0, 4, (num_instances,))
+    pred.pred_masks = torch.rand(num_instances, height, width) > torch.rand(num_instances, 1, 1)
+    return pred
+
+
+class TestPredictionDump(unittest.TestCase):
+    def test_coco_json_roundtrip(self):
+        coco_results = []
+        for image_id, n in zip([4, 1, 7, 2], [3, 0, 5, 1]):
+            coco_results.extend(instances_to_coco_json(_random_instances(n), image_id))
+        # an instance without mask
+        coco_results[-1].pop("segmentation")
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            coco_json_to_prediction_dump(coco_results, tmpdir)
+            dump = PredictionDump(tmpdir)
+            self.assertEqual(dump.image_ids.tolist(), [4, 7, 2])
+            self.assertEqual(dump.to_coco_json(), coco_results)
+            self.assertEqual(json.dumps(dump.to_coco_json()), json.dumps(coco_results))
+            self.assertEqual(dump.get(1), [])
+            self.assertEqual(dump.get(7), [x for x in coco_results if x["image_id"] == 7])
+
+            image = dump.image(dump.index(7))
+            self.assertEqual((image["height"], image["width"]), (20, 30))
+            self.assertEqual(image["bbox"].shape, (5, 4))
+            self.assertIsNone(dump.image(dump.index(2))["rles"][0])
+
+    def test_shards(self):
+        expected = {}
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for shard, image_ids in [("0", [3, 0]), ("1", []), ("2", [5, 1, 9])]:
+                with PredictionDumpWriter(tmpdir, shard) as writer:
+                    for image_id in image_ids:
+                        results = instances_to_coco_json(_random_instances(image_id), image_id)
+                        writer.append(image_id, (20, 30), results)
+                        expected[image_id] = results
+
+            dump = PredictionDump(tmpdir)
+            self.assertEqual(dump.image_ids.tolist(), [3, 0, 5, 1, 9])
+            for image_id, results in expected.items():
+                self.assertEqual(dump.get(image_id), results)
+            self.assertEqual(len(dump), 5)
+
+    def test_evaluator_dump(self):
+        categories = [{"id": k, "name": str(k)} for k in [1, 2, 3, 4]]
+        images = [{"id": k, "file_name": f"{k}.jpg", "height": 20, "width": 30} for k in range(4)]
+        annotation = {"id": 1, "image_id": 1, "category_id": 2, "bbox": [1, 1, 5, 5]}
+        annotation.update(area=25.0, segmentation=[[1, 1, 6, 1, 6, 6, 1, 6]], iscrowd=0)
+        gt = {"categories": categories, "images": images, "annotations": [annotation]}
+        with tempfile.TemporaryDirectory() as tmpdir:
+            json_file = os.path.join(tmpdir, "gt.json")
+            with open(json_file, "w") as f:
+                json.dump(gt, f)
+            dataset = "prediction_dump_test"
+            register_coco_instances(dataset, {}, json_file, tmpdir)
+            try:
+                inputs = DatasetCatalog.get(dataset)
+                outputs = [{"instances": _random_instances(k + 2)} for k in range(len(inputs))]
+                for columnar_dump in [False, True]:
+                    output_dir = os.path.join(tmpdir, str(columnar_dump))
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        evaluator = COCOEvaluator(
+                            dataset,
+                            tasks=("bbox", "segm"),
+                            distributed=False,
+                            output_dir=output_dir,
+                            columnar_dump=columnar_dump,
+                        )
+                        evaluator.reset()
+                        for input, output in zip(inputs, outputs):
+                            evaluator.process([input], [output])
+                        evaluator.evaluate()
+            finally:
+                DatasetCatalog.remove(dataset)
+                MetadataCatalog.remove(dataset)
+
+            with open(os.path.join(tmpdir, "False", "coco_instances_results.json")) as f:
+                expected = json.load(f)
+            self.assertEqual(sorted(os.listdir(os.path.join(tmpdir, "True"))), ["predictions"])
+            dump = PredictionDump(os.path.join(tmpdir, "True", "predictions"))
+            self.assertEqual(dump.to_coco_json(), expected)
+            self.assertTrue(np.array_equal(dump.image_ids, [0, 1, 2, 3]))
+
+
+if __name__ == "__main__":
+    unittest.main()
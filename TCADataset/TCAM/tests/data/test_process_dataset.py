@@ -0,0 +1,108 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+import copy
+import numpy as np
+import unittest
+from unittest import mock
+from skimage import measure
+
+from detectron2.data.datasets.process_dataset import (
+    bb_intersection_over_union,
+    build_bg_object_segmentation,
+    pairwise_bb_intersection_over_union,
+)
+from detectron2.structures import BoxMode, polygons_to_bitmask
+
+
+def reference_bg_object_segmentation(record):
+    """
+    The original full-image implementation, used as ground truth.
+    """
+    h, w = record["height"], record["width"]
+    objs = record["annotations"]
+    bitmasks = [polygons_to_bitmask(obj["segmentation"], h, w).astype(int) for obj in objs]
+    boxes = [
+        [o["bbox"][0], o["bbox"][1], o["bbox"][0] + o["bbox"][2], o["bbox"][1] + o["bbox"][3]]
+        for o in objs
+    ]
+    box_masks = []
+    for box in boxes:
+        box_mask = np.zeros((h, w), dtype=int)
+        box_mask[int(box[1]) : int(box[3]), int(box[0]) : int(box[2])] = 1
+        box_masks.append(box_mask)
+
+    results = []
+    for i, a_box in enumerate(boxes):
+        union = np.zeros((h, w), dtype=int)
+        for j, b_box in enumerate(boxes):
+            if i != j and bb_intersection_over_union(a_box, b_box) > 0.05:
+                union += box_masks[i] * bitmasks[j]
+        union[union > 1] = 1
+        segms = []
+        if np.count_nonzero(union) > 20:
+            for contour in measure.find_contours(union, 0):
+                if contour.shape[0] > 500:
+                    contour = np.flip(contour, axis=1)[::10, :]
+                elif contour.shape[0] > 200:
+                    contour = np.flip(contour, axis=1)[::5, :]
+                elif contour.shape[0] > 100:
+                    contour = np.flip(contour, axis=1)[::3, :]
+                elif contour.shape[0] > 50:
+                    contour = np.flip(contour, axis=1)[::2, :]
+                else:
+                    contour = np.flip(contour, axis=1)
+                segms.append(contour.ravel().tolist())
+        results.append(segms)
+    return results
+
+
+def random_record(rng, image_id):
+    h, w = rng.randint(60, 200, size=2).tolist()
+    annos = []
+    for _ in range(rng.randint(1, 8)):
+        cx, cy = rng.uniform(0, w), rng.uniform(0, h)
+        num_points = rng.randint(3, 12)
+        radius = rng.uniform(5, min(h, w) / 2, size=num_points)
+        angle = np.sort(rng.uniform(0, 2 * np.pi, size=num_points))
+        poly = np.stack([cx + radius * np.cos(angle), cy + radius * np.sin(angle)], axis=1)
+        x0, y0 = poly.min(axis=0)
+        x1, y1 = poly.max(axis=0)
+        annos.append(
+            {
+                "bbox": [float(x0), float(y0), float(x1 - x0), float(y1 - y0)],
+                "bbox_mode": BoxMode.XYWH_ABS,
+                "segmentation": [poly.ravel().tolist()],
+                "category_id": 0,
+            }
+        )
+    return {"image_id": image_id, "height": h, "width": w, "annotations": annos}
+
+
+class TestBgObjectSegmentation(unittest.TestCase):
+    def test_pairwise_iou(self):
+        rng = np.random.RandomState(0)
+        boxes = rng.uniform(0, 100, size=(10, 4))
+        boxes[:, 2:] += boxes[:, :2]
+        ious = pairwise_bb_intersection_over_union(boxes)
+        for i in range(len(boxes)):
+            for j in range(len(boxes)):
+                self.assertEqual(ious[i, j], bb_intersection_over_union(boxes[i], boxes[j]))
+
+    def test_matches_reference(self):
+        rng = np.random.RandomState(42)
+        dicts = [random_record(rng, k) for k in range(40)]
+        expected = [reference_bg_object_segmentation(r) for r in dicts]
+
+        for num_workers in [0, 2]:
+            output = build_bg_object_segmentation(copy.deepcopy(dicts), num_workers=num_workers)
+            self.assertGreater(sum(len(s) for segms in expected for s in segms), 0)
+            for record, segms in zip(output, expected):
+                output_segms = [a["bg_object_segmentation"] for a in record["annotations"]]
+                self.assertEqual(output_segms, segms)
+
+        # a single worker by default on a single CPU, which runs in the current process
+        with mock.patch("multiprocessing.cpu_count", return_value=1), mock.patch(
+            "multiprocessing.Pool", side_effect=AssertionError
+        ):
+            output = build_bg_object_segmentation(copy.deepcopy(dicts))
+        output_segms = [[a["bg_object_segmentation"] for a in r["annotations"]] for r in output]
+        self.assertEqual(output_segms, expected)
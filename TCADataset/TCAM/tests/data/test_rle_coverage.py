@@ -0,0 +1,32 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+import numpy as np
+import unittest
+import pycocotools.mask as mask_util
+
+from detectron2.evaluation.rle_coverage import rle_coverage, union_area
+
+
+class TestRLECoverage(unittest.TestCase):
+    def test_matches_dense(self):
+        rng = np.random.RandomState(0)
+        for num_instances in [0, 1, 2, 9]:
+            h, w = rng.randint(5, 40, size=2).tolist()
+            masks = np.zeros((num_instances, h, w), dtype=np.uint8)
+            for mask in masks:
+                y0, x0 = rng.randint(0, h), rng.randint(0, w)
+                y1, x1 = rng.randint(y0, h + 1), rng.randint(x0, w + 1)
+                mask[y0:y1, x0:x1] = rng.rand(y1 - y0, x1 - x0) > 0.3
+            labels = rng.randint(0, 4, size=num_instances)
+            rles = [mask_util.encode(np.asfortranarray(m)) for m in masks]
+            classes = [3, 0, 5, 1]
+
+            class_masks = np.zeros((len(classes), h, w), dtype=np.int64)
+            for i, k in enumerate(classes):
+                class_masks[i] = masks[labels == k].any(0)
+            expected_overlap = np.einsum("ihw,jhw->ij", class_masks, class_masks)
+
+            coverage = rle_coverage(rles, labels, classes)
+            self.assertEqual(coverage["class_areas"].tolist(), class_masks.sum((1, 2)).tolist())
+            self.assertEqual(coverage["overlap"].tolist(), expected_overlap.tolist())
+            self.assertEqual(coverage["union_area"], int(masks.any(0).sum()))
+            self.assertEqual(union_area(rles), coverage["union_area"])
@@ -0,0 +1,74 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+import numpy as np
+import unittest
+import torch
+from fvcore.common.benchmark import benchmark
+
+from detectron2.layers import get_instances_contour_interior, get_masks_contour_interior
+
+
+def random_masks(n, size=28, seed=0):
+    rng = np.random.RandomState(seed)
+    masks = rng.rand(n, size, size) > rng.rand(n, 1, 1)
+    masks[0] = True
+    masks[1] = False
+    return masks
+
+
+class TestBoundary(unittest.TestCase):
+    def test_contour_interior(self):
+        masks = random_masks(100)
+        contour, interior = get_masks_contour_interior(torch.from_numpy(masks))
+        self.assertEqual(contour.dtype, torch.uint8)
+        for k, mask in enumerate(masks):
+            expected_contour, expected_interior, _ = get_instances_contour_interior(mask)
+            self.assertTrue(np.array_equal(contour[k].numpy(), expected_contour))
+            self.assertTrue(np.array_equal(interior[k].numpy(), expected_interior))
+
+    @unittest.skipIf(not torch.cuda.is_available(), "CUDA not available")
+    def test_contour_interior_cuda(self):
+        masks = torch.from_numpy(random_masks(100))
+        output = get_masks_contour_interior(masks.cuda())
+        for x, y in zip(output, get_masks_contour_interior(masks)):
+            self.assertTrue(torch.equal(x.cpu(), y))
+
+
+def benchmark_boundary():
+    masks = torch.from_numpy(random_masks(256))
+
+    def func_numpy(device):
+        m = masks.to(device=device)
+
+        def bench():
+            # the per-mask implementation previously used by mask_rcnn_loss
+            boundary = [
+                torch.from_numpy(get_instances_contour_interior(x.cpu().numpy())[0]).to(device)
+                for x in m
+            ]
+            torch.stack(boundary)
+            if device.type == "cuda":
+                torch.cuda.synchronize()
+
+        return bench
+
+    def func_batched(device):
+        m = masks.to(device=device)
+
+        def bench():
+            get_masks_contour_interior(m)
+            if device.type == "cuda":
+                torch.cuda.synchronize()
+
+        return bench
+
+    specs = [{"device": torch.device("cpu")}]
+    if torch.cuda.is_available():
+        specs.append({"device": torch.device("cuda")})
+
+    benchmark(func_numpy, "contour_numpy", specs, num_iters=10, warmup_iters=2)
+    benchmark(func_batched, "contour_batched", specs, num_iters=10, warmup_iters=2)
+
+
+if __name__ == "__main__":
+    benchmark_boundary()
+    unittest.main()
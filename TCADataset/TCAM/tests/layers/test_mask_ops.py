@@ -4,6 +4,7 @@
 import contextlib
 import io
 import numpy as np
+import pycocotools.mask as mask_util
 import unittest
 from collections import defaultdict
 import torch
@@ -15,8 +16,10 @@ from torch.nn import functional as F
 
 from detectron2.data import MetadataCatalog
 from detectron2.layers.mask_ops import (
+    crops_to_rles,
     pad_masks,
     paste_mask_in_image_old,
+    paste_masks_in_boxes,
     paste_masks_in_image,
     scale_boxes,
 )
@@ -165,6 +168,32 @@ class TestMaskCropPaste(unittest.TestCase):
         self.assertTrue(torch.equal(out, scripted_out))
 
 
+class TestPasteInBoxes(unittest.TestCase):
+    def test_paste_in_boxes_to_rle(self):
+        torch.manual_seed(0)
+        image_shape = (61, 47)
+        boxes = random_boxes(30, 70)
+        # boxes touching the borders of the image, spanning all of it, and empty
+        boxes[:4] = torch.tensor(
+            [[0, 0, 47, 61], [0, 0, 10, 61], [30.5, 20.2, 47, 61], [3.3, 40, 3.3, 50.1]]
+        )
+        boxes[:, 0::2] = boxes[:, 0::2].clamp(max=47)
+        boxes[:, 1::2] = boxes[:, 1::2].clamp(max=61)
+        masks = torch.rand(30, 28, 28)
+        masks[0] = 1.0
+
+        expected = paste_masks_in_image(masks, Boxes(boxes), image_shape)
+        crops, windows = paste_masks_in_boxes(masks, Boxes(boxes), image_shape)
+        for mask, crop, (x0, y0, x1, y1) in zip(expected, crops, windows.tolist()):
+            self.assertEqual(mask.sum(), crop.sum())
+            self.assertTrue(torch.equal(mask[y0:y1, x0:x1], crop[: y1 - y0, : x1 - x0]))
+
+        rles = crops_to_rles(crops, windows, image_shape)
+        for mask, rle in zip(expected, rles):
+            self.assertEqual(rle, mask_util.encode(np.asfortranarray(mask.numpy(), np.uint8)))
+        self.assertEqual(crops_to_rles(crops[:0], windows[:0], image_shape), [])
+
+
 def benchmark_paste():
     S = 800
     H, W = image_shape = (S, S)
@@ -0,0 +1,117 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+import numpy as np
+import unittest
+import torch
+
+from detectron2.modeling.roi_heads.mask_head import (
+    TransformerEncoder,
+    TransformerEncoderLayer,
+    crop_and_resize_incoherent,
+    crop_and_resize_my,
+    get_incoherent_mask,
+    refine_uncertain_points,
+    sample_mask_points,
+    select_refine_boxes,
+)
+from detectron2.structures import CroppedBitMasks, polygons_to_bitmask
+
+
+class TestMaskHeadTargets(unittest.TestCase):
+    def test_incoherent_mask_targets(self):
+        rng = np.random.RandomState(0)
+        for _ in range(30):
+            h, w = rng.randint(20, 150, size=2).tolist()
+            polygons = []
+            for _ in range(4):
+                xy = rng.uniform(-10, [w + 10, h + 10], size=(rng.randint(3, 10), 2))
+                xy = xy * rng.uniform(0.1, 1) + rng.uniform(0, min(h, w) / 2)
+                polygons.append([xy.ravel()])
+            full = torch.stack([torch.from_numpy(polygons_to_bitmask(p, h, w)) for p in polygons])
+            index = torch.as_tensor(rng.randint(0, 4, size=9))
+            boxes = rng.uniform(-20, max(h, w), size=(9, 2))
+            boxes = np.concatenate([boxes, boxes + rng.uniform(1, max(h, w), size=(9, 2))], 1)
+            boxes = torch.as_tensor(boxes, dtype=torch.float32)
+
+            expected = crop_and_resize_my(
+                get_incoherent_mask(full[index].unsqueeze(1), 2).squeeze(1), boxes, 28, 2
+            )
+            masks = CroppedBitMasks.from_segmentations(polygons, h, w)[index]
+            output = crop_and_resize_incoherent(masks, boxes, 28, 2)
+            self.assertTrue(torch.equal(output, expected))
+
+
+class TestSelectRefineBoxes(unittest.TestCase):
+    def test_per_image_budget(self):
+        num_boxes_per_image = [5, 0, 12, 3]
+        priority = torch.rand(sum(num_boxes_per_image))
+        for max_boxes in [0, 2, 4, 20]:
+            expected, expected_first, start = [], [], 0
+            for n in num_boxes_per_image:
+                order = priority[start : start + n].argsort(descending=True)[:max_boxes]
+                expected.extend((order + start).tolist())
+                expected_first.extend(range(start, start + min(n, max_boxes)))
+                start += n
+
+            inds = select_refine_boxes(num_boxes_per_image, max_boxes, priority)
+            self.assertEqual(inds.tolist(), sorted(expected))
+            inds = select_refine_boxes(num_boxes_per_image, max_boxes)
+            self.assertEqual(inds.tolist(), expected_first)
+
+        inds = select_refine_boxes(num_boxes_per_image, -1, priority)
+        self.assertEqual(inds.tolist(), list(range(len(priority))))
+        self.assertEqual(len(select_refine_boxes([], 10)), 0)
+
+
+class TestSampleMaskPoints(unittest.TestCase):
+    def test_points_in_mask(self):
+        masks = torch.rand(6, 7, 9) < torch.tensor([0.0, 0.05, 0.2, 0.5, 0.9, 1.0])[:, None, None]
+        for num_points in [1, 10, 63, 100]:
+            inds, counts = sample_mask_points(masks, num_points)
+            self.assertEqual(inds.shape, (6, num_points))
+            self.assertEqual(counts.tolist(), masks.flatten(1).sum(1).tolist())
+            for mask, box_inds, count in zip(masks.flatten(1), inds, counts.tolist()):
+                if count == 0:
+                    continue
+                self.assertTrue(mask[box_inds].all())
+                # every point of the mask is drawn floor or ceil(num_points / count) times
+                hist = torch.bincount(box_inds, minlength=len(mask))[mask]
+                self.assertEqual(len(hist), count)
+                self.assertGreaterEqual(hist.min().item(), num_points // count)
+                self.assertLessEqual(hist.max().item(), -(-num_points // count))
+
+
+class TestRefineUncertainPoints(unittest.TestCase):
+    def test_matches_per_box(self):
+        torch.manual_seed(0)
+        encoder = TransformerEncoder(TransformerEncoderLayer(d_model=256, nhead=4), num_layers=3)
+        encoder.eval()
+        num_boxes, num_tokens = 5, 16
+        box_feats = torch.rand(num_boxes, 257, num_tokens)
+        box_pos = torch.rand(num_boxes, 256, num_tokens)
+        points = []
+        for max_count in [10, 30, 0]:
+            counts = torch.randint(0, max_count + 1, (num_boxes,))
+            counts[2] = 0
+            inds = torch.repeat_interleave(torch.arange(num_boxes), counts)
+            points.append((inds, torch.rand(len(inds), 257), torch.rand(len(inds), 256)))
+
+        with torch.no_grad():
+            output = refine_uncertain_points(encoder, box_feats, box_pos, points)
+            for k in range(num_boxes):
+                # the sequence of one box, without padding
+                feats = [box_feats[k].T] + [p[1][p[0] == k] for p in points]
+                pos = [box_pos[k].T] + [p[2][p[0] == k] for p in points]
+                src = torch.cat(feats).T[None, :, :, None]
+                encoded = encoder(src, torch.cat(pos)[:, None]).permute(1, 2, 0).unsqueeze(-1)
+                expected = encoder.conv_r1(encoded).flatten()[num_tokens:]
+                preds = torch.cat([out[p[0] == k] for out, p in zip(output, points)])
+                self.assertTrue(torch.allclose(preds, expected, atol=1e-5))
+        self.assertEqual([len(x) for x in output], [len(p[0]) for p in points])
+
+        empty = [(p[0][:0], p[1][:0], p[2][:0]) for p in points]
+        output = refine_uncertain_points(encoder, box_feats, box_pos, empty)
+        self.assertEqual([len(x) for x in output], [0, 0, 0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -8,7 +8,7 @@ from contextlib import contextmanager
 from copy import deepcopy
 import torch
 
-from detectron2.structures import BitMasks, Boxes, ImageList, Instances
+from detectron2.structures import BitMasks, Boxes, ImageList, Instances, ROIMasks
 from detectron2.utils.events import EventStorage
 from detectron2.utils.testing import get_model_no_weights
 
@@ -137,6 +137,20 @@ class MaskRCNNE2ETest(ModelE2ETest, unittest.TestCase):
     #         props, _ = self.model.proposal_generator(images, features)
     #         self.assertEqual(len(props[0]), 0)
 
+    def test_score_only(self):
+        self.model.eval()
+        self.model.score_only = True
+        inputs = [create_model_input(torch.rand(3, s[0], s[1])) for s in [(200, 250), (200, 249)]]
+        with torch.no_grad():
+            outputs = self.model(inputs)
+        for output in outputs:
+            instances = output["instances"]
+            self.assertIsInstance(instances.pred_masks, ROIMasks)
+            self.assertEqual(len(instances.pred_mask_areas), len(instances))
+            coverage = output["mask_coverage"]
+            self.assertEqual(coverage["class_areas"].shape, (self.model.roi_heads.num_classes,))
+            self.assertLessEqual(coverage["union_area"], instances.pred_mask_areas.sum().item())
+
     def test_roiheads_inf_nan_data(self):
         self.model.eval()
         for tensor in [self._inf_tensor, self._nan_tensor]:
@@ -3,7 +3,13 @@ import logging
 import unittest
 import torch
 
-from detectron2.modeling.poolers import ROIPooler, _fmt_box_list
+from detectron2.layers import ROIAlign
+from detectron2.modeling.poolers import (
+    ROIPooler,
+    ROIRefineFeatures,
+    _fmt_box_list,
+    roi_align_bins,
+)
 from detectron2.structures import Boxes, RotatedBoxes
 from detectron2.utils.testing import random_boxes
 
@@ -104,6 +110,76 @@ class TestROIPooler(unittest.TestCase):
     def test_scriptability_gpu(self):
         self._test_scriptability(device="cuda")
 
+    def test_refine_features(self):
+        scales = (1.0 / 4, 1.0 / 8, 1.0 / 16, 1.0 / 32)
+        pooler = ROIPooler(14, scales, 0, "ROIAlignV2")
+        features = [torch.rand(2, 256, 128 // int(1 / s), 96 // int(1 / s)) for s in scales]
+        boxes = [Boxes(random_boxes(n, 90)) for n in [7, 5]]
+        with torch.no_grad():
+            output, refine_features, _ = pooler(features, boxes)
+            self.assertEqual(output.shape, (12, 256, 14, 14))
+            self.assertEqual(len(refine_features), 12)
+
+            inds = torch.tensor([1, 6, 8])
+            outputs = refine_features(inds)
+            self.assertEqual([x.shape[-1] for x in outputs], [28, 56, 112])
+            # pooling a subset of boxes is the same as pooling all boxes
+            all_outputs = refine_features(torch.arange(12))
+            for x, all_x in zip(outputs, all_outputs):
+                self.assertTrue(torch.allclose(x, all_x[inds]))
+            self.assertEqual(refine_features(inds[:0])[0].shape, (0, 256, 28, 28))
+
+            # sampling some bins is the same as pooling dense features
+            for k, x in enumerate(all_outputs):
+                box_inds = torch.randint(0, 12, (50,))
+                bins = torch.randint(0, x.shape[-1], (50, 2))
+                output = refine_features.sample(k, box_inds, bins)
+                expected = x[box_inds, :, bins[:, 0], bins[:, 1]]
+                self.assertTrue(torch.allclose(output, expected, atol=1e-5))
+
+    def test_refine_features_semantic_on_rois(self):
+        scales = (1.0 / 4, 1.0 / 8)
+        pooler = ROIPooler(14, scales, 0, "ROIAlignV2").eval()
+        semantic = torch.nn.Sequential(
+            torch.nn.Conv2d(8, 8, 3, 1, 1), torch.nn.ReLU(), torch.nn.Conv2d(8, 8, 3, 1, 1)
+        )
+        features = [torch.rand(2, 8, 64, 48), torch.rand(2, 8, 32, 24)]
+        boxes = [Boxes(random_boxes(n, 200) - 10) for n in [6, 4]]
+        with torch.no_grad():
+            _, refine_features, _ = pooler(features, boxes)
+            expected_features = [features[0] + semantic(features[0]), features[1]]
+            args = (refine_features.pooler_fmt_boxes, refine_features.level_assignments)
+            expected = ROIRefineFeatures(refine_features.level_poolers, expected_features, *args)
+            for box_inds in [torch.tensor([0, 7]), torch.arange(10)]:
+                output = ROIRefineFeatures(refine_features.level_poolers, features, *args, semantic)
+                for k, size in enumerate([28, 56, 112]):
+                    inds = box_inds[torch.randint(0, len(box_inds), (40,))]
+                    bins = torch.randint(0, size, (40, 2))
+                    self.assertTrue(
+                        torch.allclose(
+                            output.sample(k, inds, bins), expected.sample(k, inds, bins), atol=1e-5
+                        )
+                    )
+                self.assertIsNotNone(output.semantic)
+                # dense pooling computes the branch on the whole feature map
+                output = output(box_inds)
+                for x, expected_x in zip(output, expected(box_inds)):
+                    self.assertTrue(torch.allclose(x, expected_x, atol=1e-5))
+        self.assertEqual(len(features), 2)
+
+    def test_roi_align_bins(self):
+        features = torch.rand(2, 8, 20, 30, dtype=torch.float64)
+        rois = torch.cat([torch.randint(0, 2, (40, 1)), random_boxes(40, 150)], dim=1).double()
+        rois[:5, 3:] = rois[:5, 1:3]
+        bins = torch.randint(0, 7, (40, 2))
+        for aligned in [True, False]:
+            for sampling_ratio in [0, 2]:
+                for scale in [1.0, 0.25]:
+                    pooler = ROIAlign((7, 7), scale, sampling_ratio, aligned)
+                    expected = pooler(features, rois)[torch.arange(40), :, bins[:, 0], bins[:, 1]]
+                    output = roi_align_bins(features, rois, bins, 7, scale, sampling_ratio, aligned)
+                    self.assertTrue(torch.allclose(output, expected))
+
     def test_no_images(self):
         N, C, H, W = 0, 32, 32, 32
         feature = torch.rand(N, C, H, W) - 0.5
@@ -0,0 +1,106 @@
+# Copyright (c) Facebook, Inc. and its affiliates. All Rights Reserved
+import unittest
+import torch
+
+from detectron2.config import get_cfg
+from detectron2.layers import ShapeSpec
+
+try:
+    import swinb.swin_transformer as swinb
+    import swint.swin_transformer as swint
+    from swinb import add_swinb_config
+except ImportError:  # timm is not installed
+    swinb = swint = None
+
+
+def _attn_mask(Hp, Wp, window_size, shift_size):
+    # the mask computed in each forward before it was cached
+    img_mask = torch.zeros((1, Hp, Wp, 1))
+    cnt = 0
+    for h in (slice(0, -window_size), slice(-window_size, -shift_size), slice(-shift_size, None)):
+        for w in (slice(0, -window_size), slice(-window_size, -shift_size), slice(-shift_size, None)):
+            img_mask[:, h, w, :] = cnt
+            cnt += 1
+    mask_windows = swint.window_partition(img_mask, window_size).view(-1, window_size ** 2)
+    attn_mask = mask_windows.unsqueeze(1) - mask_windows.unsqueeze(2)
+    return attn_mask.masked_fill(attn_mask != 0, -100.0).masked_fill(attn_mask == 0, 0.0)
+
+
+@unittest.skipIf(swint is None, "timm is not installed")
+class TestSwinTransformer(unittest.TestCase):
+    def _backbone(self, module, fused_attn=False):
+        torch.manual_seed(0)
+        return module.SwinTransformer(
+            embed_dim=24,
+            depths=[2, 2],
+            num_heads=[2, 4],
+            drop_path_rate=0.0,
+            fused_attn=fused_attn,
+            out_features=["stage2", "stage3"],
+        )
+
+    def test_attn_mask_cache(self):
+        for Hp, Wp in [(14, 21), (21, 14), (7, 7)]:
+            mask = swint.compute_attn_mask(Hp, Wp, 7, 3, torch.device("cpu"))
+            self.assertTrue(torch.equal(mask, _attn_mask(Hp, Wp, 7, 3)))
+            self.assertIs(mask, swint.compute_attn_mask(Hp, Wp, 7, 3, torch.device("cpu")))
+
+    def test_frozen_bias(self):
+        for module in [swint, swinb]:
+            model = self._backbone(module)
+            model.eval()
+            attn = model.layers[0].blocks[1].attn
+            x = torch.rand(1, 3, 45, 61)
+            with torch.no_grad():
+                expected = model(x)["stage3"]
+                bias = attn.relative_position_bias()
+                self.assertIs(attn.relative_position_bias(), bias)
+                self.assertTrue(torch.equal(model(x)["stage3"], expected))
+
+            # loading weights invalidates the frozen bias
+            state_dict = {k: v.clone() for k, v in model.state_dict().items()}
+            for k, v in state_dict.items():
+                if k.endswith("relative_position_bias_table"):
+                    v.add_(1.0)
+            model.load_state_dict(state_dict)
+            with torch.no_grad():
+                self.assertTrue(torch.equal(attn.relative_position_bias(), bias + 1.0))
+
+            # gradients flow to the table in training
+            model.train()
+            model(x)["stage3"].sum().backward()
+            self.assertIsNotNone(attn.relative_position_bias_table.grad)
+
+    @unittest.skipIf(swint is None or not swint._SDPA_AVAILABLE, "Requires PyTorch >= 2.1")
+    def test_fused_attn(self):
+        model = self._backbone(swint)
+        fused_model = self._backbone(swint, fused_attn=True)
+        fused_model.load_state_dict(model.state_dict())
+        # padded feature maps with shifted windows, and a batch of several images
+        x = torch.rand(2, 3, 45, 61)
+
+        for training in [False, True]:
+            model.train(training)
+            fused_model.train(training)
+            with torch.no_grad():
+                for name, out in model(x).items():
+                    self.assertTrue(torch.allclose(fused_model(x)[name], out, atol=1e-5), name)
+
+        model(x)["stage3"].sum().backward()
+        fused_model(x)["stage3"].sum().backward()
+        for (name, p), fused_p in zip(model.named_parameters(), fused_model.parameters()):
+            if p.grad is None:  # not used by the outputs
+                self.assertIsNone(fused_p.grad, name)
+            else:
+                self.assertTrue(torch.allclose(fused_p.grad, p.grad, atol=1e-4), name)
+
+    def test_build_backbones(self):
+        cfg = get_cfg()
+        add_swinb_config(cfg)
+        cfg.MODEL.SWINT.FUSED_ATTN = True
+        cfg.MODEL.SWINT.DEPTHS = [2, 2, 2, 2]
+        for build in [swint.build_swint_backbone, swinb.build_swinb_backbone]:
+            backbone = build(cfg, ShapeSpec(channels=3))
+            self.assertEqual(backbone.output_shape()["stage5"].channels, 1024)
+            attn = backbone.layers[0].blocks[0].attn
+            self.assertEqual(attn.fused_attn, swint._SDPA_AVAILABLE)
@@ -1,8 +1,23 @@
 # Copyright (c) Facebook, Inc. and its affiliates.
+import numpy as np
 import unittest
 import torch
+from torch.nn import functional as F
 
-from detectron2.structures.masks import BitMasks, PolygonMasks, polygons_to_bitmask
+from detectron2.structures.masks import (
+    BitMasks,
+    CroppedBitMasks,
+    PolygonMasks,
+    polygons_to_bitmask,
+)
+
+
+def random_polygons(rng, height, width):
+    num_points = rng.randint(3, 10)
+    center = rng.uniform(-10, [width + 10, height + 10])
+    radius = rng.uniform(1, max(height, width) / 2, size=num_points)
+    angle = np.sort(rng.uniform(0, 2 * np.pi, size=num_points))
+    return [np.stack([center[0] + radius * np.cos(angle), center[1] + radius * np.sin(angle)], 1)]
 
 
 class TestBitMask(unittest.TestCase):
@@ -39,5 +54,34 @@ class TestBitMask(unittest.TestCase):
             self.assertTrue(torch.all(box == reconstruct_box).item())
 
 
+class TestCroppedBitMasks(unittest.TestCase):
+    def test_matches_bitmasks(self):
+        rng = np.random.RandomState(0)
+        for _ in range(50):
+            h, w = rng.randint(10, 100, size=2).tolist()
+            polygons = [[p.ravel() for p in random_polygons(rng, h, w)] for _ in range(4)]
+            full = torch.stack([torch.from_numpy(polygons_to_bitmask(p, h, w)) for p in polygons])
+            masks = CroppedBitMasks.from_segmentations(
+                polygons[:2] + [full[2].numpy(), full[3].numpy()], h, w
+            )
+            self.assertTrue(torch.equal(masks.to_bitmasks().tensor, full))
+            self.assertTrue(torch.equal(masks.nonempty(), BitMasks(full).nonempty()))
+            self.assertTrue(
+                torch.equal(
+                    masks.get_bounding_boxes().tensor, BitMasks(full).get_bounding_boxes().tensor
+                )
+            )
+
+            index = torch.as_tensor(rng.randint(0, 4, size=6))
+            subset = masks[index]
+            self.assertEqual(len(subset), 6)
+            self.assertTrue(torch.equal(subset.to_bitmasks().tensor, full[index]))
+            for output_size in [(h // 4, w // 4), (h // 3 + 1, w // 5 + 2), (2 * h, 2 * w)]:
+                union = F.interpolate(
+                    (full[index].sum(0) >= 1).float()[None, None], output_size
+                )[0, 0]
+                self.assertTrue(torch.equal(subset.union_mask(output_size), union > 0))
+
+
 if __name__ == "__main__":
     unittest.main()
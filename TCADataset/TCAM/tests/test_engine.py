@@ -7,13 +7,15 @@ import tempfile
 import time
 import unittest
 from unittest import mock
+import cv2
+import numpy as np
 import torch
 from fvcore.common.checkpoint import Checkpointer
 from torch import nn
 
 from detectron2 import model_zoo
 from detectron2.config import configurable, get_cfg
-from detectron2.engine import DefaultTrainer, SimpleTrainer, default_setup, hooks
+from detectron2.engine import BatchPredictor, DefaultTrainer, SimpleTrainer, default_setup, hooks
 from detectron2.modeling.meta_arch import META_ARCH_REGISTRY
 from detectron2.utils.events import CommonMetricPrinter, JSONWriter
 
@@ -36,6 +38,22 @@ class _SimpleModel(nn.Module):
         return {"loss": x.sum() + sum([x.mean() for x in self.parameters()])}
 
 
+@META_ARCH_REGISTRY.register()
+class _BatchModel(nn.Module):
+    @configurable
+    def __init__(self):
+        super().__init__()
+        self.batches = []
+
+    @classmethod
+    def from_config(cls, cfg):
+        return {}
+
+    def forward(self, batched_inputs):
+        self.batches.append([x["image"].shape for x in batched_inputs])
+        return [{"value": x["image"][0, 0, 0].item()} for x in batched_inputs]
+
+
 class TestTrainer(unittest.TestCase):
     def _data_loader(self, device):
         device = torch.device(device)
@@ -185,3 +203,37 @@ class TestTrainer(unittest.TestCase):
             cfg = model_zoo.get_config("COCO-InstanceSegmentation/mask_rcnn_R_50_FPN_1x.py")
             cfg.train.output_dir = os.path.join(d, "omegaconf")
             default_setup(cfg, {})
+
+
+class TestBatchPredictor(unittest.TestCase):
+    def test_batch_predictor(self):
+        cfg = get_cfg()
+        cfg.MODEL.META_ARCHITECTURE = "_BatchModel"
+        cfg.MODEL.WEIGHTS = ""
+        cfg.INPUT.MIN_SIZE_TEST = 20
+        cfg.INPUT.MAX_SIZE_TEST = 60
+        # landscape and portrait images, identified by their first pixel
+        sizes = [(20, 40), (40, 20), (20, 36), (20, 40), (30, 30), (20, 38), (40, 20)]
+        images = [np.full((h, w, 3), k, dtype=np.uint8) for k, (h, w) in enumerate(sizes)]
+
+        with tempfile.TemporaryDirectory(prefix="detectron2_test") as d:
+            path = os.path.join(d, "image.png")
+            cv2.imwrite(path, images[3])
+            images[3] = path
+            for num_workers in [0, 2]:
+                predictor = BatchPredictor(cfg, batch_size=2, num_workers=num_workers)
+                outputs = predictor(images)
+                self.assertEqual([x["value"] for x in outputs], list(range(len(images))))
+                for batch in predictor.model.batches:
+                    self.assertLessEqual(len(batch), 2)
+                    aspect_ratios = [w / h for _, h, w in batch]
+                    self.assertLess(max(aspect_ratios) / min(aspect_ratios), 1.2)
+                self.assertEqual(sum(len(x) for x in predictor.model.batches), len(images))
+                self.assertEqual(set(predictor.throughput()), {1, 2})
+
+        # a model on CPU does not wait for CUDA devices
+        self.assertEqual(predictor.device.type, "cpu")
+        with mock.patch("torch.cuda.is_available", return_value=True), mock.patch(
+            "torch.cuda.synchronize", side_effect=AssertionError
+        ):
+            predictor(images[:2])
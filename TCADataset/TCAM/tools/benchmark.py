@@ -161,9 +161,58 @@ def benchmark_eval(args):
     logger.info("{} iters in {} seconds.".format(max_iter, timer.seconds()))
 
 
+@torch.no_grad()
+def benchmark_mask_head(args):
+    """
+    Benchmark the mask branch in inference, with the semantic branch of the mask pooler
+    computed on the whole P2 feature map and only around the refined boxes.
+    """
+    cfg = setup(args)
+    model = build_model(cfg)
+    model.eval()
+    DetectionCheckpointer(model).load(cfg.MODEL.WEIGHTS)
+    roi_heads = model.roi_heads
+
+    cfg.defrost()
+    cfg.DATALOADER.NUM_WORKERS = 0
+    data_loader = build_detection_test_loader(cfg, cfg.DATASETS.TEST[0])
+
+    def sync():
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+
+    max_iter = 100
+    timers = {False: Timer(), True: Timer()}
+    for timer in timers.values():
+        timer.pause()
+    for idx, d in enumerate(tqdm.tqdm(itertools.islice(data_loader, max_iter + 5))):
+        images = model.preprocess_image(d)
+        features = model.backbone(images.tensor)
+        proposals, _ = model.proposal_generator(images, features)
+        instances = roi_heads._forward_box(features, proposals)
+        for semantic_on_rois, timer in timers.items():
+            roi_heads.mask_pooler.semantic_on_rois = semantic_on_rois
+            if idx < 5:  # warmup
+                roi_heads._forward_mask(features, instances)
+                continue
+            sync()
+            timer.resume()
+            roi_heads._forward_mask(features, instances)
+            sync()
+            timer.pause()
+    for semantic_on_rois, timer in timers.items():
+        logger.info(
+            "Mask branch, semantic_on_rois={}: {} iters in {} seconds.".format(
+                semantic_on_rois, max_iter, timer.seconds()
+            )
+        )
+
+
 if __name__ == "__main__":
     parser = default_argument_parser()
-    parser.add_argument("--task", choices=["train", "eval", "data", "data_advanced"], required=True)
+    parser.add_argument(
+        "--task", choices=["train", "eval", "mask_head", "data", "data_advanced"], required=True
+    )
     args = parser.parse_args()
     assert not args.eval_only
 
@@ -185,4 +234,7 @@ if __name__ == "__main__":
         f = benchmark_eval
         # only benchmark single-GPU inference.
         assert args.num_gpus == 1 and args.num_machines == 1
+    elif args.task == "mask_head":
+        f = benchmark_mask_head
+        assert args.num_gpus == 1 and args.num_machines == 1
     launch(f, args.num_gpus, args.num_machines, args.machine_rank, args.dist_url, args=(args,))
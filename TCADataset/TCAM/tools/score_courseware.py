@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# Copyright (c) Facebook, Inc. and its affiliates.
+"""
+Compute the courseware scores of a dataset from saved predictions, without a model.
+
+The predictions are a :class:`PredictionDump` directory (written by COCOEvaluator with
+``TEST.COLUMNAR_DUMP``), or a "coco_instances_results.json" file. Like COCOEvaluator, only the
+images with at least one predicted mask are scored.
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import multiprocessing as mp
+import numpy as np
+import tempfile
+from collections import defaultdict
+from itertools import chain
+from pycocotools.coco import COCO
+from tabulate import tabulate
+
+from detectron2.config import get_cfg
+from detectron2.evaluation import PredictionDump
+from detectron2.evaluation.coco_evaluation import (
+    TEXT_CATEGORY_IDS,
+    compt_score,
+    compute_ptrate,
+    courseware_score_metrics,
+    gen_area_dict,
+)
+from detectron2.evaluation.prediction_dump import coco_json_to_prediction_dump
+from detectron2.evaluation.rle_coverage import union_area
+from detectron2.utils.file_io import PathManager
+from detectron2.utils.logger import create_small_table, setup_logger
+
+logger = logging.getLogger("detectron2")
+
+# The inputs of the workers of score_images. They are set before the workers are forked,
+# so that the workers inherit them instead of unpickling copies.
+_FORKED_INPUTS = {}
+
+
+def _score_images(indices):
+    coco_gt, dump = _FORKED_INPUTS["coco_gt"], _FORKED_INPUTS["dump"]
+    score_threshold = _FORKED_INPUTS["score_threshold"]
+    rows = []
+    for idx in indices.tolist():
+        image = dump.image(idx)
+        if image["image_id"] not in coco_gt.imgs:
+            continue
+        keep = [
+            k
+            for k, (rle, score) in enumerate(zip(image["rles"], image["score"].tolist()))
+            if rle is not None and score >= score_threshold
+        ]
+        if len(keep) == 0:
+            continue
+        rles = [image["rles"][k] for k in keep]
+        is_text = np.isin(image["category_id"][keep], TEXT_CATEGORY_IDS)
+        pred_areas = union_area([r for r, t in zip(rles, is_text) if t]), union_area(rles)
+        true_areas = gen_area_dict(coco_gt, coco_gt.imgToAnns[image["image_id"]])
+        rows.append((image["image_id"], *true_areas, *pred_areas))
+    return rows
+
+
+def score_images(coco_gt, dump, score_threshold=0.0, num_workers=0):
+    """
+    Compute the text and total areas of the ground truth and the predictions of the images
+    in ``num_workers`` forked processes.
+
+    Returns:
+        ndarray: int64 array of shape (N, 5), the image id, the ground truth text and total
+            areas, and the predicted text and total areas of the N scored images.
+    """
+    chunks = np.array_split(np.arange(len(dump)), max(num_workers, 1) * 8)
+    _FORKED_INPUTS.update(coco_gt=coco_gt, dump=dump, score_threshold=score_threshold)
+    try:
+        if num_workers > 0 and "fork" in mp.get_all_start_methods():
+            with mp.get_context("fork").Pool(num_workers) as pool:
+                rows = pool.map(_score_images, chunks)
+        else:
+            rows = [_score_images(chunk) for chunk in chunks]
+    finally:
+        _FORKED_INPUTS.clear()
+    return np.array(list(chain(*rows)), dtype=np.int64).reshape(-1, 5)
+
+
+def main(args):
+    cfg = get_cfg()
+    if args.config_file:
+        cfg.merge_from_file(args.config_file)
+    cfg.merge_from_list(args.opts)
+    score_bands = (cfg.TEST.SCORE_BANDS.LOWER_BOUNDS, cfg.TEST.SCORE_BANDS.SCORES)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        coco_gt = COCO(PathManager.get_local_path(args.gt))
+
+    with contextlib.ExitStack() as stack:
+        if PathManager.isdir(args.predictions):
+            dump = PredictionDump(args.predictions)
+        else:
+            with PathManager.open(args.predictions, "r") as f:
+                coco_results = json.load(f)
+            dirname = stack.enter_context(tempfile.TemporaryDirectory())
+            coco_json_to_prediction_dump(coco_results, dirname)
+            dump = PredictionDump(dirname)
+        logger.info(f"Scoring the predictions of {len(dump)} images ...")
+        areas = score_images(coco_gt, dump, args.score_threshold, args.num_workers)
+
+    image_ids = areas[:, 0].tolist()
+    true_rates = compute_ptrate(areas[:, 1], areas[:, 2])
+    pred_rates = compute_ptrate(areas[:, 3], areas[:, 4])
+    true_scores = compt_score(true_rates, score_bands)
+    pred_scores = compt_score(pred_rates, score_bands)
+    metrics = courseware_score_metrics(true_scores, pred_scores)
+    logger.info(
+        f"Courseware score of {len(image_ids)} images:\n" + create_small_table(metrics)
+        if metrics
+        else "No image is scored."
+    )
+
+    groups = [coco_gt.imgs[k].get(args.group_by) for k in image_ids]
+    group_metrics = {}
+    if any(x is not None for x in groups):
+        indices = defaultdict(list)
+        for i, group in enumerate(groups):
+            indices[str(group)].append(i)
+        table = []
+        for group in sorted(indices):
+            inds = indices[group]
+            res = courseware_score_metrics(true_scores[inds], pred_scores[inds])
+            group_metrics[group] = res
+            table.append([group, len(inds), res["rho"], res["mae"], res["rmse"]])
+        logger.info(
+            f"Courseware score per {args.group_by}:\n"
+            + tabulate(
+                table,
+                headers=[args.group_by, "images", "rho", "mae", "rmse"],
+                tablefmt="pipe",
+                floatfmt=".3f",
+                numalign="left",
+            )
+        )
+
+    if args.output:
+        images = [
+            {
+                "image_id": image_id,
+                args.group_by: group,
+                "true_rate": true_rate,
+                "pred_rate": pred_rate,
+                "true_score": true_score,
+                "pred_score": pred_score,
+            }
+            for image_id, group, true_rate, pred_rate, true_score, pred_score in zip(
+                image_ids,
+                groups,
+                true_rates.tolist(),
+                pred_rates.tolist(),
+                true_scores.tolist(),
+                pred_scores.tolist(),
+            )
+        ]
+        with PathManager.open(args.output, "w") as f:
+            json.dump({"metrics": metrics, "groups": group_metrics, "images": images}, f)
+        logger.info(f"Saved the scores of the images to {args.output}.")
+    return metrics
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Score courseware from saved predictions and the ground truth."
+    )
+    parser.add_argument(
+        "--predictions",
+        required=True,
+        help="directory of a columnar prediction dump, or json file in COCO's result format",
+    )
+    parser.add_argument("--gt", required=True, help="json file of the ground truth annotations")
+    parser.add_argument(
+        "--group-by",
+        default="subject",
+        help="field of the images in the ground truth to report the metrics of each value of",
+    )
+    parser.add_argument(
+        "--score-threshold", default=0.0, type=float, help="ignore predictions below this score"
+    )
+    parser.add_argument(
+        "--num-workers", default=mp.cpu_count(), type=int, help="number of worker processes"
+    )
+    parser.add_argument("--output", help="json file to save the scores of each image to")
+    parser.add_argument(
+        "--config-file", metavar="FILE", help="config file of the score bands (TEST.SCORE_BANDS)"
+    )
+    parser.add_argument(
+        "opts",
+        help="Modify config options using the command-line 'KEY VALUE' pairs",
+        default=None,
+        nargs=argparse.REMAINDER,
+    )
+    args = parser.parse_args()
+    setup_logger(name="detectron2")
+    main(args)
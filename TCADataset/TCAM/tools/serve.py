@@ -0,0 +1,403 @@
+#!/usr/bin/env python
+# Copyright (c) Facebook, Inc. and its affiliates.
+"""
+A local HTTP service that predicts the layout instances and the courseware score of slides.
+
+Concurrent requests are coalesced into micro-batches: a batch runs when it has
+``--max-batch-size`` images, or ``--max-latency-ms`` after its first image is ready.
+Images are decoded and resized, and predictions are encoded, in a pool of threads while
+the model runs on the previous batch. Only the standard library's asyncio is used.
+
+Endpoints:
+
+* ``POST /predict``: the body is an image file (e.g. JPEG or PNG). Returns a json object
+  with the "instances" of the image in COCO's result format (without "image_id"), and its
+  "text_rate" and courseware "score", banded like :func:`compt_score`. With
+  ``TEST.SCORE_ONLY True``, the instances have the "area" of their mask instead of its
+  "segmentation", and the masks are never pasted into full-image masks. A body that is
+  not an image gets a 400 response, and a failure of the model a 500 response. If the
+  model fails on a micro-batch, its images are retried one at a time.
+* ``GET /metrics``: returns a json object with the number of requests and errors, the
+  queue depth, the histogram of batch sizes and the p50/p99 latencies in milliseconds.
+
+Example:
+::
+    ./serve.py --config-file configs/transfiner/mask_rcnn_R_50_FPN_3x.yaml \\
+        MODEL.WEIGHTS model_final.pth
+    curl --data-binary @slide.jpg http://127.0.0.1:8080/predict
+"""
+import argparse
+import asyncio
+import io
+import json
+import logging
+import numpy as np
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+import torch
+from PIL import Image, ImageOps
+
+from detectron2.config import CfgNode, get_cfg
+from detectron2.data.detection_utils import convert_PIL_to_numpy
+from detectron2.engine import BatchPredictor
+from detectron2.evaluation.coco_evaluation import (
+    TEXT_CATEGORY_IDS,
+    compt_score,
+    compute_ptrate,
+    get_text_classes,
+    instances_to_coco_json,
+)
+from detectron2.evaluation.rle_coverage import union_area
+from detectron2.utils.logger import setup_logger
+
+from swinb import add_swinb_config
+from swint import add_swint_config
+
+logger = logging.getLogger("detectron2")
+
+_MAX_BODY_SIZE = 64 * 1024 * 1024
+_REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+}
+
+
+class InvalidImageError(ValueError):
+    """
+    The body of a request could not be read as an image.
+    """
+
+
+class MicroBatcher:
+    """
+    Run the model of a :class:`BatchPredictor` on micro-batches of the images of
+    concurrent requests.
+    """
+
+    def __init__(self, predictor, max_batch_size, max_latency, num_workers, score_bands):
+        """
+        Args:
+            predictor (BatchPredictor): the model and its preprocessing.
+            max_batch_size (int): maximum number of images of a batch.
+            max_latency (float): seconds a ready image waits for a batch to fill.
+            num_workers (int): number of threads decoding, resizing and encoding images.
+            score_bands (tuple[list[float], list[int]]): see :func:`compt_score`.
+        """
+        self.predictor = predictor
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.score_bands = score_bands
+        # the metadata of the first test dataset maps the classes to dataset category ids
+        metadata = getattr(predictor, "metadata", None)
+        self._text_classes = (
+            get_text_classes(metadata) if metadata is not None else list(TEXT_CATEGORY_IDS)
+        )
+        id_map = metadata.get("thing_dataset_id_to_contiguous_id") if metadata else None
+        self._reverse_id_map = {v: k for k, v in id_map.items()} if id_map else None
+
+        self._workers = ThreadPoolExecutor(max(num_workers, 1))
+        # the model runs in its own thread, so that the event loop keeps serving requests
+        self._model_thread = ThreadPoolExecutor(1)
+        # (model inputs, future of the outputs, time it was ready) of the images to batch
+        self._pending = deque()
+        self._wakeup = asyncio.Event()
+
+        self.num_requests = 0
+        self.num_errors = 0
+        self.num_preprocessing = 0
+        self.batch_sizes = Counter()
+        self.latencies = deque(maxlen=10000)
+
+    def _preprocess(self, body):
+        image = ImageOps.exif_transpose(Image.open(io.BytesIO(body)))
+        return self.predictor.preprocess(convert_PIL_to_numpy(image, "BGR"))
+
+    def _run_model(self, inputs):
+        with torch.no_grad():
+            outputs = self.predictor.model(inputs)
+            return [dict(x, instances=x["instances"].to("cpu")) for x in outputs]
+
+    def _postprocess(self, output):
+        instances = output["instances"]
+        coverage = output.get("mask_coverage")
+        if coverage is not None:
+            # score-only mode: the areas are computed by the model, without the masks
+            areas = instances.pred_mask_areas.tolist()
+            instances.remove("pred_masks")
+            results = instances_to_coco_json(instances, None)
+            for x, area in zip(results, areas):
+                x["area"] = area
+            class_rles = coverage["class_rles"]
+            text_rles = [class_rles[c] for c in self._text_classes if c in class_rles]
+            rate = compute_ptrate(union_area(text_rles), coverage["union_area"])
+        else:
+            results = instances_to_coco_json(instances, None)
+            rles = [x["segmentation"] for x in results if "segmentation" in x]
+            text_rles = [
+                x["segmentation"]
+                for x in results
+                if "segmentation" in x and x["category_id"] in self._text_classes
+            ]
+            rate = compute_ptrate(union_area(text_rles), union_area(rles))
+        for x in results:
+            del x["image_id"]
+            if self._reverse_id_map is not None:
+                x["category_id"] = self._reverse_id_map[x["category_id"]]
+        return {
+            "instances": results,
+            "text_rate": float(rate),
+            "score": int(compt_score(rate, self.score_bands)),
+        }
+
+    async def predict(self, body):
+        """
+        Args:
+            body (bytes): an image file.
+
+        Returns:
+            dict: the predictions of the image.
+
+        Raises:
+            InvalidImageError: if ``body`` is not a valid image. Other errors are failures
+                of the model or of the service.
+        """
+        loop = asyncio.get_running_loop()
+        self.num_preprocessing += 1
+        try:
+            inputs = await loop.run_in_executor(self._workers, self._preprocess, body)
+        except Exception as e:
+            raise InvalidImageError(f"{type(e).__name__}: {e}") from e
+        finally:
+            self.num_preprocessing -= 1
+        future = loop.create_future()
+        self._pending.append((inputs, future, loop.time()))
+        self._wakeup.set()
+        output = await future
+        return await loop.run_in_executor(self._workers, self._postprocess, output)
+
+    async def run(self):
+        """
+        Form the batches and run the model on them, forever.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._wakeup.wait()
+            if not self._pending:
+                self._wakeup.clear()
+                continue
+            # wait for the batch to fill until the deadline of its oldest image
+            deadline = self._pending[0][2] + self.max_latency
+            while len(self._pending) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    break
+
+            batch_size = min(len(self._pending), self.max_batch_size)
+            batch = [self._pending.popleft() for _ in range(batch_size)]
+            if not self._pending:
+                self._wakeup.clear()
+            await self._run_batch(batch)
+
+    async def _run_batch(self, batch):
+        """
+        Run the model on a batch and resolve the futures of its images. If the batch fails,
+        its images are retried one at a time, so that one bad image only fails its own request.
+        """
+        loop = asyncio.get_running_loop()
+        self.batch_sizes[len(batch)] += 1
+        try:
+            outputs = await loop.run_in_executor(
+                self._model_thread, self._run_model, [x[0] for x in batch]
+            )
+        except Exception as e:
+            if len(batch) > 1:
+                logger.warning(
+                    f"Failed to run the model on a batch of {len(batch)} images: "
+                    f"{type(e).__name__}: {e}. Retrying them one at a time."
+                )
+                for x in batch:
+                    await self._run_batch([x])
+                return
+            logger.exception("Failed to run the model on an image.")
+            future = batch[0][1]
+            if not future.cancelled():
+                future.set_exception(e)
+            return
+        for (_, future, _), output in zip(batch, outputs):
+            if not future.cancelled():
+                future.set_result(output)
+
+    def metrics(self):
+        """
+        Returns:
+            dict: the metrics of the service.
+        """
+        latencies = np.asarray(self.latencies) * 1000
+        return {
+            "requests": self.num_requests,
+            "errors": self.num_errors,
+            "queue_depth": len(self._pending),
+            "preprocessing": self.num_preprocessing,
+            "batch_sizes": {str(k): v for k, v in sorted(self.batch_sizes.items())},
+            "latency_ms": {
+                "p50": float(np.percentile(latencies, 50)) if len(latencies) else None,
+                "p99": float(np.percentile(latencies, 99)) if len(latencies) else None,
+            },
+        }
+
+
+async def _read_request(reader):
+    """
+    Returns:
+        str, str, bytes: the method, the path and the body of an HTTP request.
+    """
+    request_line = (await reader.readline()).decode("latin-1").rstrip("\r\n")
+    method, path, _ = request_line.split(" ", 2)
+    headers = {}
+    while True:
+        line = (await reader.readline()).decode("latin-1").rstrip("\r\n")
+        if not line:
+            break
+        key, value = line.split(":", 1)
+        headers[key.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", 0))
+    if length > _MAX_BODY_SIZE:
+        raise ValueError(413)
+    body = await reader.readexactly(length) if length else b""
+    return method, path.split("?", 1)[0], body
+
+
+def _write_response(writer, status, content):
+    body = json.dumps(content).encode()
+    header = (
+        f"HTTP/1.1 {status} {_REASONS[status]}\r\n"
+        "Content-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        "Connection: close\r\n\r\n"
+    )
+    writer.write(header.encode("latin-1") + body)
+
+
+def make_handler(batcher):
+    """
+    Returns:
+        the client connection callback of :func:`asyncio.start_server`.
+    """
+
+    async def handle(reader, writer):
+        start = time.perf_counter()
+        status, content = 200, None
+        try:
+            method, path, body = await _read_request(reader)
+            if (method, path) == ("POST", "/predict"):
+                batcher.num_requests += 1
+                try:
+                    content = await batcher.predict(body)
+                    batcher.latencies.append(time.perf_counter() - start)
+                except InvalidImageError as e:
+                    batcher.num_errors += 1
+                    status, content = 400, {"error": str(e)}
+                except Exception as e:
+                    batcher.num_errors += 1
+                    status, content = 500, {"error": f"{type(e).__name__}: {e}"}
+            elif (method, path) == ("GET", "/metrics"):
+                content = batcher.metrics()
+            else:
+                status, content = 404, {"error": f"No endpoint {method} {path}"}
+        except ValueError as e:
+            status = 413 if e.args == (413,) else 400
+            content = {"error": "Invalid request"}
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+            return
+        _write_response(writer, status, content)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    return handle
+
+
+def setup(args):
+    """
+    Create configs and perform basic setups.
+    """
+    cfg = get_cfg()
+    # the Swin-T and Swin-B backbones share the MODEL.SWINT node, with different defaults
+    backbone = CfgNode.load_yaml_with_base(args.config_file).get("MODEL", {}).get("BACKBONE", {})
+    backbone_name = dict(zip(args.opts[0::2], args.opts[1::2])).get(
+        "MODEL.BACKBONE.NAME", backbone.get("NAME", "")
+    )
+    if "swinb" in backbone_name:
+        add_swinb_config(cfg)
+    else:
+        add_swint_config(cfg)
+    cfg.merge_from_file(args.config_file)
+    cfg.merge_from_list(args.opts)
+    cfg.freeze()
+    return cfg
+
+
+async def serve(args):
+    cfg = setup(args)
+    predictor = BatchPredictor(cfg, batch_size=args.max_batch_size, num_workers=0)
+    batcher = MicroBatcher(
+        predictor,
+        max_batch_size=predictor.batch_size,
+        max_latency=args.max_latency_ms / 1000,
+        num_workers=(
+            cfg.TEST.BATCH_PREDICTOR.NUM_WORKERS if args.num_workers is None else args.num_workers
+        ),
+        score_bands=(cfg.TEST.SCORE_BANDS.LOWER_BOUNDS, cfg.TEST.SCORE_BANDS.SCORES),
+    )
+    server = await asyncio.start_server(make_handler(batcher), args.host, args.port)
+    logger.info(
+        "Serving on http://{}:{} with micro-batches of up to {} images.".format(
+            args.host, args.port, batcher.max_batch_size
+        )
+    )
+    async with server:
+        await asyncio.gather(server.serve_forever(), batcher.run())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the predictions of a model over HTTP.")
+    parser.add_argument("--config-file", required=True, metavar="FILE", help="path to config file")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--port", default=8080, type=int, help="port to listen on")
+    parser.add_argument(
+        "--max-batch-size",
+        type=int,
+        help="maximum number of images of a batch, TEST.BATCH_PREDICTOR.BATCH_SIZE by default",
+    )
+    parser.add_argument(
+        "--max-latency-ms",
+        default=10.0,
+        type=float,
+        help="milliseconds an image waits for its batch to fill",
+    )
+    parser.add_argument(
+        "--num-workers",
+        type=int,
+        help="number of threads decoding and encoding images, "
+        "TEST.BATCH_PREDICTOR.NUM_WORKERS by default",
+    )
+    parser.add_argument(
+        "opts",
+        help="Modify config options using the command-line 'KEY VALUE' pairs",
+        default=None,
+        nargs=argparse.REMAINDER,
+    )
+    args = parser.parse_args()
+    setup_logger(name="detectron2")
+    asyncio.run(serve(args))
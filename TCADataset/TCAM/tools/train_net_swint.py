@@ -64,7 +64,16 @@ def build_evaluator(cfg, dataset_name, output_folder=None):
             )
         )
     if evaluator_type in ["coco", "coco_panoptic_seg"]:
-        evaluator_list.append(COCOEvaluator(dataset_name, output_dir=output_folder))
+        evaluator_list.append(
+            COCOEvaluator(
+                dataset_name,
+                output_dir=output_folder,
+                shard_evaluation=cfg.TEST.SHARD_EVALUATION,
+                num_workers=cfg.TEST.EVAL_NUM_WORKERS,
+                columnar_dump=cfg.TEST.COLUMNAR_DUMP,
+                score_bands=(cfg.TEST.SCORE_BANDS.LOWER_BOUNDS, cfg.TEST.SCORE_BANDS.SCORES),
+            )
+        )
     if evaluator_type == "coco_panoptic_seg":
         evaluator_list.append(COCOPanopticEvaluator(dataset_name, output_folder))
     if evaluator_type == "cityscapes_instance":
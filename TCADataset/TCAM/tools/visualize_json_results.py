@@ -10,6 +10,7 @@ import cv2
 import tqdm
 
 from detectron2.data import DatasetCatalog, MetadataCatalog
+from detectron2.evaluation import PredictionDump
 from detectron2.structures import Boxes, BoxMode, Instances
 from detectron2.utils.file_io import PathManager
 from detectron2.utils.logger import setup_logger
@@ -42,7 +43,11 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="A script that visualizes the json predictions from COCO or LVIS dataset."
     )
-    parser.add_argument("--input", required=True, help="JSON file produced by the model")
+    parser.add_argument(
+        "--input",
+        required=True,
+        help="JSON file or directory of a columnar prediction dump produced by the model",
+    )
     parser.add_argument("--output", required=True, help="output directory")
     parser.add_argument("--dataset", help="name of the dataset", default="coco_2017_val")
     parser.add_argument("--conf-threshold", default=0.5, type=float, help="confidence threshold")
@@ -50,12 +55,23 @@ if __name__ == "__main__":
 
     logger = setup_logger()
 
-    with PathManager.open(args.input, "r") as f:
-        predictions = json.load(f)
+    if PathManager.isdir(args.input):
+        # only the predictions of the visualized images are read
+        dump = PredictionDump(args.input)
+
+        def get_predictions(image_id):
+            return dump.get(image_id)
+
+    else:
+        with PathManager.open(args.input, "r") as f:
+            predictions = json.load(f)
+
+        pred_by_image = defaultdict(list)
+        for p in predictions:
+            pred_by_image[p["image_id"]].append(p)
 
-    pred_by_image = defaultdict(list)
-    for p in predictions:
-        pred_by_image[p["image_id"]].append(p)
+        def get_predictions(image_id):
+            return pred_by_image[image_id]
 
     dicts = list(DatasetCatalog.get(args.dataset))
     metadata = MetadataCatalog.get(args.dataset)
@@ -79,7 +95,7 @@ if __name__ == "__main__":
         img = cv2.imread(dic["file_name"], cv2.IMREAD_COLOR)[:, :, ::-1]
         basename = os.path.basename(dic["file_name"])
 
-        predictions = create_instances(pred_by_image[dic["image_id"]], img.shape[:2])
+        predictions = create_instances(get_predictions(dic["image_id"]), img.shape[:2])
         vis = Visualizer(img, metadata)
         vis_pred = vis.draw_instance_predictions(predictions).get_image()
 